@@ -0,0 +1,142 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+import almacen
+import sinergias
+from zonas import ZONAS_CONOCIDAS
+
+# Escalera de radios del slider de la interfaz (0.5 a 5 km, cada 0.5)
+RADIOS = tuple(round(r, 1) for r in np.arange(0.5, 5.01, 0.5))
+
+ARCHIVO_AGREGADOS = 'agregados.json'
+
+
+def ruta_agregados(directorio=almacen.DIRECTORIO_COLUMNAR):
+    """Los agregados viven junto al almacén columnar (o junto al CSV si no existe)"""
+    if os.path.isdir(directorio):
+        return os.path.join(directorio, ARCHIVO_AGREGADOS)
+    return os.path.splitext(almacen.RUTA_CSV)[0] + '.' + ARCHIVO_AGREGADOS
+
+
+def clave_radio(radio_km):
+    """Clave del radio en la escalera, o None si el radio no está precalculado.
+
+    Solo un radio igual a uno de la escalera usa el precalculado: 1.96 km no
+    es 2.0 km, se calcula en vivo.
+    """
+    iguales = np.flatnonzero(np.isclose(float(radio_km), RADIOS, rtol=0, atol=1e-9))
+    return str(RADIOS[iguales[0]]) if len(iguales) else None
+
+
+def _alcance(radio_km):
+    # Las oportunidades de un radio dependen también de los complementos
+    # que están justo afuera de él
+    return radio_km + sinergias.RADIO_COMPLEMENTO_KM
+
+
+def huella_zona(df, indice, lat, lon):
+    """Huella de las filas que pueden influir en cualquier radio de la zona"""
+    posiciones = indice.buscar_radio(lat, lon, _alcance(max(RADIOS)))
+    huella = hashlib.blake2b(digest_size=8)
+    huella.update(np.ascontiguousarray(indice.lats[posiciones]).tobytes())
+    huella.update(np.ascontiguousarray(indice.lons[posiciones]).tobytes())
+    huella.update(np.ascontiguousarray(df['sinergia'].cat.codes.to_numpy()[posiciones]).tobytes())
+    huella.update(np.ascontiguousarray(df['rol_sinergia'].cat.codes.to_numpy()[posiciones]).tobytes())
+    # Los nombres solo importan en las anclas (aparecen en las oportunidades)
+    anclas = posiciones[df['rol_sinergia'].cat.codes.to_numpy()[posiciones] == 0]
+    huella.update('\x00'.join(map(str, df['categoria_negocio'].to_numpy()[anclas])).encode())
+    return huella.hexdigest()
+
+
+def calcular_zona(df, indice, lat, lon, radios=RADIOS):
+    """Conteos, histograma de sinergias y oportunidades para cada radio de la escalera"""
+    sinergia = df['sinergia'].cat.codes.to_numpy()
+    nombres_sinergia = list(df['sinergia'].cat.categories) + ['otros']
+
+    # Una sola búsqueda con el radio mayor; los radios menores se cortan por distancia
+    posiciones, distancias = indice.buscar_radio(lat, lon, max(radios), con_distancias=True)
+    codigos = sinergia[posiciones].astype(np.int64)
+    codigos[codigos < 0] = len(nombres_sinergia) - 1
+
+    resultado = {}
+    for radio in radios:
+        dentro = distancias <= radio
+        histograma = np.bincount(codigos[dentro], minlength=len(nombres_sinergia))
+        oportunidades = sinergias.buscar_oportunidades(df, indice, lat, lon, radio)
+        resultado[str(radio)] = {
+            "total_negocios_zona": int(dentro.sum()),
+            "histograma_sinergias": dict(zip(nombres_sinergia, histograma.tolist())),
+            "total_oportunidades": len(oportunidades),
+            "oportunidades": oportunidades,
+        }
+    return resultado
+
+
+def refrescar(agregados, df, indice, zonas=ZONAS_CONOCIDAS, version=None):
+    """Recalcula solo las zonas cuyas filas cambiaron (compara huellas).
+
+    Devuelve los agregados actualizados y la lista de zonas recalculadas.
+    """
+    anteriores = (agregados or {}).get("zonas", {})
+    if (agregados or {}).get("radio_complemento_km") != sinergias.RADIO_COMPLEMENTO_KM:
+        # Con otro radio de complemento ninguna zona guardada sirve
+        anteriores = {}
+    nuevas, recalculadas = {}, []
+    for zona, (lat, lon, _) in zonas.items():
+        huella = huella_zona(df, indice, lat, lon)
+        previa = anteriores.get(zona)
+        if previa and previa.get("huella") == huella and set(previa["radios"]) == {str(r) for r in RADIOS}:
+            nuevas[zona] = previa
+        else:
+            nuevas[zona] = {"huella": huella, "radios": calcular_zona(df, indice, lat, lon)}
+            recalculadas.append(zona)
+    return {"version": version or almacen.version_datos(df),
+            "radio_complemento_km": sinergias.RADIO_COMPLEMENTO_KM, "zonas": nuevas}, recalculadas
+
+
+def guardar(agregados, ruta=None):
+    ruta = ruta or ruta_agregados()
+    temporal = ruta + '.tmp'
+    with open(temporal, 'w', encoding='utf-8') as f:
+        json.dump(agregados, f, ensure_ascii=False)
+    os.replace(temporal, ruta)
+
+
+def cargar(ruta=None):
+    ruta = ruta or ruta_agregados()
+    try:
+        with open(ruta, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def preparar(df, indice, ruta=None, version=None, zonas=ZONAS_CONOCIDAS):
+    """Carga los agregados guardados, recalcula lo que haya cambiado y los persiste"""
+    ruta = ruta or ruta_agregados()
+    agregados = cargar(ruta)
+    version = version or almacen.version_datos(df)
+    if (agregados is not None and agregados.get("version") == version
+            and agregados.get("radio_complemento_km") == sinergias.RADIO_COMPLEMENTO_KM
+            and set(agregados.get("zonas", {})) == set(zonas)):
+        return agregados
+
+    agregados, _ = refrescar(agregados, df, indice, zonas, version)
+    try:
+        guardar(agregados, ruta)
+    except OSError:
+        # En despliegues de solo lectura se quedan en memoria
+        pass
+    return agregados
+
+
+def consultar(agregados, zona, radio_km):
+    """Resultado precalculado de (zona, radio), o None si no está en la escalera"""
+    clave = clave_radio(radio_km)
+    if agregados is None or clave is None:
+        return None
+    zona = agregados["zonas"].get(zona)
+    return zona["radios"].get(clave) if zona else None
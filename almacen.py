@@ -0,0 +1,149 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+import artefacto
+
+# Archivos de datos
+RUTA_CSV = 'datos_ensenada.csv'
+DIRECTORIO_COLUMNAR = 'datos_ensenada.col'
+
+# Las coordenadas se guardan en float32 (~1 m de precisión, suficiente para negocios)
+COLUMNAS_FLOAT32 = ('latitud', 'longitud')
+
+
+def version_datos(df):
+    """Huella corta del contenido del DataFrame; cambia si cambian los datos"""
+    huella = hashlib.blake2b(digest_size=8)
+    huella.update(str(len(df)).encode())
+    for nombre in df.columns:
+        serie = df[nombre]
+        huella.update(str(nombre).encode())
+        if isinstance(serie.dtype, pd.CategoricalDtype):
+            huella.update(np.ascontiguousarray(serie.cat.codes.to_numpy()).tobytes())
+            huella.update('\x00'.join(map(str, serie.cat.categories)).encode())
+        elif serie.dtype.kind in 'fiub':
+            huella.update(np.ascontiguousarray(serie.to_numpy()).tobytes())
+        else:
+            huella.update('\x00'.join(map(str, serie.tolist())).encode())
+    return huella.hexdigest()
+
+
+def compactar(df):
+    """Tipos compactos: coordenadas en float32 y textos como categorías
+    (códigos enteros más un diccionario de cadenas por columna)
+    """
+    columnas = {}
+    for nombre in df.columns:
+        serie = df[nombre]
+        if isinstance(serie.dtype, pd.CategoricalDtype):
+            pass
+        elif not pd.api.types.is_numeric_dtype(serie):
+            serie = serie.astype('category')
+        elif nombre in COLUMNAS_FLOAT32 and serie.dtype != np.float32:
+            serie = serie.astype(np.float32)
+        columnas[nombre] = serie
+    return pd.DataFrame(columnas, copy=False)
+
+
+def uso_memoria(df):
+    """Bytes de cada columna (datos y diccionario), cuánto está en mmap y cuánto
+    ocuparía la tabla con float64 y textos object
+    """
+    columnas = []
+    for nombre in df.columns:
+        serie = df[nombre]
+        if isinstance(serie.dtype, pd.CategoricalDtype):
+            # .array.codes no copia (cat.codes sí)
+            columnas.append((nombre, serie.array.codes, [str(c) for c in serie.cat.categories]))
+        elif pd.api.types.is_numeric_dtype(serie):
+            columnas.append((nombre, serie.to_numpy(), None))
+        else:
+            columnas.append((nombre, serie.to_numpy(dtype=object), None))
+    return artefacto.uso_memoria(columnas, len(df))
+
+
+def _guardar_npy(ruta, valores):
+    # Escribir aparte y reemplazar: quien tenga el archivo abierto con mmap
+    # sigue viendo la versión anterior
+    temporal = ruta + '.tmp'
+    with open(temporal, 'wb') as f:
+        np.save(f, valores)
+    os.replace(temporal, ruta)
+
+
+def guardar_columnar(df, directorio=DIRECTORIO_COLUMNAR, secuencia=0):
+    """Guarda el DataFrame como un .npy por columna más un meta.json.
+
+    Las columnas de texto o categóricas se guardan con codificación de
+    diccionario: un arreglo de códigos enteros y la lista de categorías.
+    'secuencia' es el último cambio del registro de cambios ya incluido.
+    """
+    os.makedirs(directorio, exist_ok=True)
+    columnas = []
+    for nombre in df.columns:
+        serie = df[nombre]
+        if isinstance(serie.dtype, pd.CategoricalDtype) or not pd.api.types.is_numeric_dtype(serie):
+            categorica = serie if isinstance(serie.dtype, pd.CategoricalDtype) else serie.astype('category')
+            _guardar_npy(os.path.join(directorio, f'{nombre}.npy'), categorica.cat.codes.to_numpy())
+            columnas.append({
+                "nombre": nombre,
+                "tipo": "categoria",
+                "categorias": [str(c) for c in categorica.cat.categories]
+            })
+        else:
+            valores = serie.to_numpy()
+            if nombre in COLUMNAS_FLOAT32:
+                valores = valores.astype(np.float32)
+            _guardar_npy(os.path.join(directorio, f'{nombre}.npy'), valores)
+            columnas.append({"nombre": nombre, "tipo": str(valores.dtype)})
+
+    # meta.json se escribe al final: si existe, el resto de archivos está completo
+    ruta_meta = os.path.join(directorio, 'meta.json')
+    with open(ruta_meta + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump({"filas": len(df), "columnas": columnas, "secuencia": secuencia}, f, ensure_ascii=False)
+    os.replace(ruta_meta + '.tmp', ruta_meta)
+
+
+def leer_meta(directorio=DIRECTORIO_COLUMNAR):
+    with open(os.path.join(directorio, 'meta.json'), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def cargar_columnar(directorio=DIRECTORIO_COLUMNAR):
+    """Abre el almacén columnar con mmap (las páginas se comparten entre procesos)"""
+    meta = leer_meta(directorio)
+
+    datos = {}
+    for columna in meta['columnas']:
+        arreglo = np.load(os.path.join(directorio, f"{columna['nombre']}.npy"), mmap_mode='r')
+        if columna['tipo'] == 'categoria':
+            datos[columna['nombre']] = pd.Categorical.from_codes(
+                arreglo, dtype=pd.CategoricalDtype(columna['categorias']))
+        else:
+            datos[columna['nombre']] = arreglo
+
+    # copy=False evita que pandas consolide (y copie) las columnas numéricas
+    return pd.DataFrame(datos, copy=False)
+
+
+def existe_columnar(directorio=DIRECTORIO_COLUMNAR):
+    return os.path.exists(os.path.join(directorio, 'meta.json'))
+
+
+def marca_columnar(directorio=DIRECTORIO_COLUMNAR):
+    """mtime (ns) de meta.json, que se reescribe al final de cada guardado; None si no existe"""
+    try:
+        return os.stat(os.path.join(directorio, 'meta.json')).st_mtime_ns
+    except OSError:
+        return None
+
+
+def cargar_datos(ruta_csv=RUTA_CSV, directorio=DIRECTORIO_COLUMNAR):
+    """Usa el almacén columnar si ya se construyó; si no, lee el CSV"""
+    if existe_columnar(directorio):
+        return cargar_columnar(directorio)
+    return compactar(pd.read_csv(ruta_csv))
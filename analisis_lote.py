@@ -0,0 +1,268 @@
+import argparse
+import atexit
+import csv
+import json
+import math
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import agregados
+import almacen
+import regiones
+from indice_espacial import IndiceEspacial, validar_radio
+from zonas import ZONAS_CONOCIDAS
+
+# Las columnas que necesita el cálculo de oportunidades
+COLUMNAS_LOTE = ['categoria_negocio', 'latitud', 'longitud', 'sinergia', 'rol_sinergia']
+
+# Pedazos por proceso: más pedazos reparten mejor centros lentos y rápidos
+PEDAZOS_POR_PROCESO = 4
+
+# Con pocos centros no vale la pena levantar procesos
+MINIMO_PARA_PROCESOS = 8
+
+# Tope de centros por petición a la API (para más, usar la línea de comandos)
+MAXIMO_CENTROS_API = 1000
+# Topes de radios por petición y de cálculos (centros x radios): con la escalera
+# completa alcanzan los MAXIMO_CENTROS_API centros
+MAXIMO_RADIOS_API = 20
+MAXIMO_CALCULOS_API = MAXIMO_CENTROS_API * len(agregados.RADIOS)
+
+# Copias columnares (una por versión de datos) que se conservan para el pool;
+# las anteriores se borran al escribir una nueva
+COPIAS_COMPARTIDAS = 2
+
+# Pool de procesos de toda la vida del servidor y copias compartidas (versión -> directorio)
+_pool = None
+_procesos_pool = 0
+_copias = {}
+_candado = threading.Lock()
+
+# Datos abiertos en cada proceso del pool (directorio -> (df, índice))
+_abiertos = {}
+
+
+def centros_de(zonas=(), centros=(), conocidas=ZONAS_CONOCIDAS):
+    """Lista de (nombre, lat, lon) a partir de nombres de zona y centros arbitrarios.
+
+    Los centros pueden ser dicts {"nombre", "lat", "lon"} o tuplas (lat, lon).
+    """
+    resultado = []
+    for zona in zonas:
+        clave = str(zona).strip().lower()
+        if clave not in conocidas:
+            raise KeyError(f"Zona '{zona}' no encontrada")
+        lat, lon, _ = conocidas[clave]
+        resultado.append((clave, lat, lon))
+    for i, centro in enumerate(centros):
+        try:
+            if isinstance(centro, dict):
+                lat, lon = float(centro['lat']), float(centro['lon'])
+                nombre = centro.get('nombre') or f'{lat},{lon}'
+            else:
+                if len(centro) != 2:
+                    raise ValueError
+                lat, lon = float(centro[0]), float(centro[1])
+                nombre = f'{lat},{lon}'
+        except (KeyError, TypeError, ValueError):
+            raise ValueError(f"Centro {i} inválido: se esperaba {{\"lat\", \"lon\"}} o [lat, lon] numéricos")
+        if not (math.isfinite(lat) and math.isfinite(lon)):
+            raise ValueError(f"Centro {i} inválido: lat y lon deben ser números finitos")
+        resultado.append((str(nombre), lat, lon))
+    return resultado
+
+
+def validar_peticion(centros, radios):
+    """Radios de una petición a la API; ValueError si la petición es demasiado grande"""
+    if isinstance(radios, (str, bytes)) or not hasattr(radios, '__len__'):
+        raise ValueError("'radios' debe ser una lista de números")
+    if not centros:
+        raise ValueError("Indica al menos una zona o un centro")
+    if len(centros) > MAXIMO_CENTROS_API:
+        raise ValueError(f"Máximo {MAXIMO_CENTROS_API} centros por petición")
+    if not radios or len(radios) > MAXIMO_RADIOS_API:
+        raise ValueError(f"Indica de 1 a {MAXIMO_RADIOS_API} radios")
+    radios = [validar_radio(r) for r in radios]
+    if len(centros) * len(radios) > MAXIMO_CALCULOS_API:
+        raise ValueError(f"Máximo {MAXIMO_CALCULOS_API} cálculos (centros x radios) por petición")
+    return radios
+
+
+def _datos_compartidos(directorio):
+    # Cada proceso abre la copia con mmap (las páginas se comparten) una vez por versión
+    if directorio not in _abiertos:
+        while len(_abiertos) >= COPIAS_COMPARTIDAS:
+            _abiertos.pop(next(iter(_abiertos)))
+        df = almacen.cargar_columnar(directorio)
+        _abiertos[directorio] = (df, IndiceEspacial(df['latitud'].to_numpy(), df['longitud'].to_numpy()))
+    return _abiertos[directorio]
+
+
+def _analizar_pedazo(directorio, pedazo, radios):
+    df, indice = _datos_compartidos(directorio)
+    return [_analizar_centro(df, indice, centro, radios) for centro in pedazo]
+
+
+def _analizar_centro(df, indice, centro, radios):
+    nombre, lat, lon = centro
+    return {"centro": nombre, "lat": lat, "lon": lon,
+            "radios": agregados.calcular_zona(df, indice, lat, lon, radios)}
+
+
+def iniciar_pool(procesos=None):
+    """El pool de procesos compartido por todas las peticiones (se crea una vez).
+
+    Los procesos salen de un forkserver (o spawn): hacer fork de un servidor
+    con hilos puede heredar candados tomados y bloquearse. El servidor de
+    procesos solo importa este módulo, no el programa principal.
+    """
+    global _pool, _procesos_pool
+    with _candado:
+        if _pool is None:
+            _procesos_pool = procesos or os.cpu_count() or 1
+            metodos = multiprocessing.get_all_start_methods()
+            contexto = multiprocessing.get_context('forkserver' if 'forkserver' in metodos else 'spawn')
+            if contexto.get_start_method() == 'forkserver':
+                contexto.set_forkserver_preload([__name__])
+            _pool = ProcessPoolExecutor(_procesos_pool, mp_context=contexto)
+        return _pool
+
+
+def _copia_compartida(df, version):
+    """Directorio con la copia columnar de 'df' para el pool (se escribe una vez por versión)"""
+    with _candado:
+        if version in _copias:
+            return _copias[version]
+        # /dev/shm es memoria compartida en Linux; si no existe, un temporal en disco
+        base = '/dev/shm' if os.path.isdir('/dev/shm') else None
+        directorio = tempfile.mkdtemp(prefix='lote_', dir=base)
+        almacen.guardar_columnar(df[COLUMNAS_LOTE], directorio)
+        _copias[version] = directorio
+        while len(_copias) > COPIAS_COMPARTIDAS:
+            shutil.rmtree(_copias.pop(next(iter(_copias))), ignore_errors=True)
+        return directorio
+
+
+@atexit.register
+def _cerrar():
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+    for directorio in _copias.values():
+        shutil.rmtree(directorio, ignore_errors=True)
+
+
+def analizar_lote(df, centros, radios=agregados.RADIOS, procesos=None, indice=None, version=None):
+    """Oportunidades de cada centro (nombre, lat, lon) para cada radio.
+
+    'df' debe venir de sinergias.clasificar(). Los centros se reparten en el
+    pool compartido, cuyos procesos abren con mmap una copia columnar de
+    'df' (una por 'version' de los datos; no se envía el DataFrame a cada
+    proceso). 'procesos' solo cuenta al crear el pool. Devuelve la lista de
+    resultados en el mismo orden que 'centros'.
+    """
+    global _pool
+    radios = tuple(sorted({round(validar_radio(r), 3) for r in radios}))
+    if not radios:
+        raise ValueError("Se necesita al menos un radio")
+    procesos = procesos or os.cpu_count() or 1
+
+    if procesos == 1 or len(centros) < MINIMO_PARA_PROCESOS:
+        indice = indice or IndiceEspacial(df['latitud'].to_numpy(), df['longitud'].to_numpy())
+        return [_analizar_centro(df, indice, centro, radios) for centro in centros]
+
+    pool = iniciar_pool(procesos)
+    directorio = _copia_compartida(df, version or almacen.version_datos(df[COLUMNAS_LOTE]))
+    tamano = max(1, -(-len(centros) // (_procesos_pool * PEDAZOS_POR_PROCESO)))
+    pedazos = [centros[i:i + tamano] for i in range(0, len(centros), tamano)]
+    try:
+        resultados = pool.map(_analizar_pedazo, [directorio] * len(pedazos), pedazos,
+                              [radios] * len(pedazos))
+        return [resultado for pedazo in resultados for resultado in pedazo]
+    except BrokenProcessPool:
+        # Un proceso murió: la siguiente petición crea otro pool
+        with _candado:
+            if _pool is pool:
+                _pool = None
+        raise
+
+
+def tabla_resumen(resultados):
+    """Una fila por (centro, radio) con conteos; para reportes en CSV"""
+    filas = []
+    for resultado in resultados:
+        for radio, datos in resultado["radios"].items():
+            fila = {"centro": resultado["centro"], "lat": resultado["lat"], "lon": resultado["lon"],
+                    "radio_km": float(radio),
+                    "total_negocios_zona": datos["total_negocios_zona"],
+                    "total_oportunidades": datos["total_oportunidades"]}
+            fila.update({f"negocios_{clave}": valor for clave, valor in datos["histograma_sinergias"].items()})
+            fila["oportunidades"] = '; '.join(f"{op['oportunidad']} ({op['ancla']})"
+                                              for op in datos["oportunidades"])
+            filas.append(fila)
+    return filas
+
+
+def _leer_centros(ruta):
+    # CSV con columnas nombre (opcional), lat y lon
+    with open(ruta, newline='', encoding='utf-8') as f:
+        return [dict(fila) for fila in csv.DictReader(f)]
+
+
+def _escribir(resultados, ruta):
+    if ruta.endswith('.csv'):
+        filas = tabla_resumen(resultados)
+        with open(ruta, 'w', newline='', encoding='utf-8') as f:
+            escritor = csv.DictWriter(f, fieldnames=list(filas[0]) if filas else ['centro'])
+            escritor.writeheader()
+            escritor.writerows(filas)
+    else:
+        with open(ruta, 'w', encoding='utf-8') as f:
+            json.dump({"resultados": resultados}, f, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Análisis de oportunidades por lote (varias zonas/centros y radios)")
+    parser.add_argument('--region', default=regiones.REGION_POR_DEFECTO,
+                        help="región (municipio) a analizar; ver regiones.json")
+    parser.add_argument('--zonas', nargs='*', default=[],
+                        help=f"zonas de la región (en {regiones.REGION_POR_DEFECTO}: {', '.join(ZONAS_CONOCIDAS)}); "
+                             "'todas' para usarlas todas")
+    parser.add_argument('--centro', action='append', default=[], metavar='LAT,LON',
+                        help="centro arbitrario (se puede repetir)")
+    parser.add_argument('--centros', metavar='ARCHIVO.csv',
+                        help="CSV de centros con columnas nombre, lat, lon")
+    parser.add_argument('--radios', type=float, nargs='+', default=list(agregados.RADIOS),
+                        help="radios en km (por defecto la escalera del slider)")
+    parser.add_argument('--procesos', type=int, default=None,
+                        help="procesos del pool (por defecto uno por núcleo)")
+    parser.add_argument('--salida', default='reporte_oportunidades.json',
+                        help="archivo de resultados (.json completo o .csv resumen)")
+    args = parser.parse_args()
+
+    # Incluye los cambios del registro (PUT) que aún no se compactan
+    datos_region = regiones.Regiones()
+    try:
+        conocidas = datos_region.zonas(args.region)
+    except regiones.RegionDesconocida as e:
+        parser.error(str(e))
+    df = datos_region.datos(args.region).instantanea().df
+
+    zonas = list(conocidas) if args.zonas == ['todas'] else args.zonas
+    centros = [c.split(',') for c in args.centro]
+    if args.centros:
+        centros += _leer_centros(args.centros)
+    lista = centros_de(zonas, centros, conocidas)
+    if not lista:
+        parser.error("indica --zonas, --centro o --centros")
+
+    inicio = time.perf_counter()
+    resultados = analizar_lote(df, lista, args.radios, args.procesos)
+    _escribir(resultados, args.salida)
+    print(f"{len(lista)} centros x {len(args.radios)} radios en "
+          f"{time.perf_counter() - inicio:.1f} s -> '{args.salida}'")
@@ -1,40 +1,136 @@
-from flask import Flask, request, jsonify
-import pandas as pd
+import time
+
+# Arranque en frío: se mide desde la primera línea hasta que la app queda lista
+_INICIO = time.perf_counter()
+
+from flask import Flask, Response, g, request, jsonify
+import json
 import os
+import sys
+import tempfile
+import threading
+
+# Los módulos del proyecto viven en la carpeta raíz
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+# Al importar solo se cargan módulos ligeros (sin pandas): en Vercel cada
+# arranque en frío paga lo que se importe aquí. pandas, los índices y el
+# motor de filtros se cargan con la primera ruta que los necesita.
+import artefacto
+import busqueda
+import cache_respuestas
+import metricas
+import negociacion
+import regiones
+import sitios
+import teselas
+from indice_espacial import validar_radio
+
+# Vercel sirve 'app' como aplicación WSGI: cada petición pasa por el ruteo
+# de Flask y sus before_request (región, métricas), igual que en local
 app = Flask(__name__)
 
-# Cargar datos del CSV
-try:
-    df = pd.read_csv('datos_ensenada.csv')
-except:
-    # CSV de ejemplo si no existe el archivo
-    df = pd.DataFrame({
-        'id': range(100),
-        'nombre': [f'Negocio {i}' for i in range(100)],
-        'ventas': range(100, 200)
-    })
+# Almacén columnar que se despliega con la función (python filtrar_datos.py --solo-columnar)
+DIRECTORIO_DATOS = os.environ.get('DIRECTORIO_DATOS', 'datos_ensenada.col')
+
+# DatosVivos completos de la región por defecto; None hasta que una ruta los pide
+datos = None
+_candado_datos = threading.Lock()
+
+# Las demás regiones también se cargan al primer uso (LRU con presupuesto de memoria)
+regiones_datos = regiones.Regiones()
+
+# Almacén leído solo con numpy para las rutas ligeras (False si no hay)
+_artefacto = None
+
+
+def _datos():
+    """Los DatosVivos, cargados una sola vez al primer uso"""
+    global datos
+    if datos is None:
+        with _candado_datos:
+            if datos is None:
+                inicio = time.perf_counter()
+                import pandas as pd
+                import datos_vivos
+                # Almacén columnar con mmap si existe, si no el CSV, más los
+                # cambios del registro; cada petición usa una instantánea inmutable
+                try:
+                    cargados = datos_vivos.DatosVivos.desde_disco(directorio=DIRECTORIO_DATOS)
+                except (OSError, ValueError, KeyError):
+                    # Datos de ejemplo si no hay almacén ni CSV (o no se pueden leer). Van
+                    # con su propio directorio temporal: no deben reproducir el registro
+                    # de cambios de los datos reales ni recargar su almacén
+                    cargados = datos_vivos.DatosVivos(pd.DataFrame({
+                        'id': range(100),
+                        'nombre': [f'Negocio {i}' for i in range(100)],
+                        'ventas': range(100, 200)
+                    }), directorio=tempfile.mkdtemp(prefix='datos_ejemplo_'))
+                regiones_datos.fijar(regiones_datos.por_defecto, cargados)
+                datos = cargados
+                metricas.registrar_arranque('carga_datos', time.perf_counter() - inicio)
+    return datos
+
+
+def _ligero():
+    """Almacén para contestar sin pandas, o None si hay que usar los datos completos"""
+    global _artefacto
+    if datos is not None or g.region != regiones_datos.por_defecto:
+        return None
+    if _artefacto is None or (_artefacto and _artefacto.reescrito()):
+        # Al primer uso, y de nuevo si el almacén se regeneró (recarga en caliente)
+        _artefacto = artefacto.abrir(DIRECTORIO_DATOS) or False
+    # Con cambios del registro sin compactar solo sirven los datos completos
+    return _artefacto if _artefacto and _artefacto.vigente() else None
+
+
+def _version():
+    # La versión del almacén coincide con la de los datos completos sin cambios pendientes
+    ligero = _ligero()
+    return ligero.version if ligero is not None else _datos_peticion().instantanea().version
+
+
+def _datos_region(clave):
+    # La región por defecto se carga aparte (con su tiempo de arranque y respaldo de ejemplo)
+    if clave == regiones_datos.por_defecto:
+        return _datos()
+    return regiones_datos.datos(clave)
+
+
+def _datos_peticion():
+    return _datos_region(g.region)
+
+
+# Cache de respuestas; la clave incluye la versión de los datos
+cache = cache_respuestas.crear_cache()
 
-# Simular tus módulos si no existen
-try:
-    import filtrar_datos
-except ImportError:
-    # Módulo simulado
-    class filtrar_datos:
-        @staticmethod
-        def filtrar(df, columna, valor, operador):
-            if operador == 'igual':
-                return df[df[columna] == valor].to_dict('records')
-            return df.head(10).to_dict('records')
-
-try:
-    import investigador
-except ImportError:
-    # Módulo simulado
-    class investigador:
-        @staticmethod
-        def analizar(df, tipo_analisis):
-            return f"Análisis {tipo_analisis} completado"
+# Teselas del mapa en disco (por región y versión de los datos)
+cache_teselas = teselas.CacheTeselas()
+
+# Tiempos por ruta y etapa, cache, arranque y memoria en /metrics (más perfilado opt-in)
+metricas.instrumentar(app, cache, lambda: datos)
+
+# Respuestas de datos comprimidas con brotli/gzip según Accept-Encoding
+negociacion.comprimir_respuestas(app)
+
+@app.before_request
+def _resolver_region():
+    # Región de la petición: ?region=, la de la zona (/oportunidades/<zona>) o la que contiene ?lat=&lon=
+    zona = (request.view_args or {}).get('zona')
+    try:
+        g.region = regiones_datos.ruta(region=request.args.get('region', type=str),
+                                       zona=zona.strip().lower() if zona else None,
+                                       lat=request.args.get('lat', type=float),
+                                       lon=request.args.get('lon', type=float))
+    except regiones.RegionDesconocida as e:
+        return jsonify({"error": str(e)}), 404
+
+def _registro_json(df, id, extra=None):
+    """{"registro": {...}, ...} serializado desde las columnas (nulos como null)"""
+    import formatos
+    registro = next(formatos.filas_json(df, id, id + 1))[0]
+    campos = ''.join(f',{json.dumps(clave)}:{json.dumps(valor)}' for clave, valor in (extra or {}).items())
+    return '{"registro":' + registro + campos + '}'
 
 @app.route('/')
 def home():
@@ -44,103 +140,399 @@ def home():
             "/excel/negocio/datos",
             "/excel/negocio/datos/<id>",
             "/excel/negocio/filtrar",
+            "/excel/negocio/buscar",
             "/excel/negocio/analizar",
-            "/excel/negocio/estadisticas"
-        ]
+            "/excel/negocio/analizar/lote",
+            "/excel/negocio/estadisticas",
+            "/oportunidades/<zona>",
+            "/tiles/<z>/<x>/<y>",
+            "/sitios/puntaje",
+            "/sitios/rejilla",
+            "/regiones"
+        ],
+        "arranque_s": metricas.ARRANQUE,
+        "datos_cargados": datos is not None
     })
 
 @app.route('/excel/negocio/datos', methods=['GET'])
 def obtener_datos():
     try:
+        import formatos
+        df = _datos_peticion().instantanea().df
         limite = request.args.get('limite', default=100, type=int)
-        datos = df.head(limite).to_dict('records')
-        return jsonify({"datos": datos, "total": len(datos)}), 200
+        desde = request.args.get('desde', default=0, type=int)
+        # ?formato= o cabecera Accept: json, ndjson, columnas, msgpack o arrow
+        formato = negociacion.elegir(request.args.get('formato', type=str), request.headers.get('Accept'),
+                                     formatos.FORMATOS_TABLA + ('ndjson',))
+
+        # Paginación por desplazamiento: 'siguiente' es el 'desde' de la próxima página
+        inicio = min(max(desde, 0), len(df))
+        fin = min(inicio + max(limite, 0), len(df))
+        siguiente = fin if fin < len(df) else None
+
+        # Se serializa directo de las columnas y se envía por partes
+        if formato == 'ndjson':
+            respuesta = Response(formatos.generar_ndjson(df, inicio, fin),
+                                 mimetype='application/x-ndjson')
+            respuesta.headers['X-Total-Registros'] = str(len(df))
+            if siguiente is not None:
+                respuesta.headers['X-Siguiente'] = str(siguiente)
+            return respuesta, 200
+
+        extra = {"total": fin - inicio, "desde": inicio,
+                 "siguiente": siguiente, "total_registros": len(df)}
+        if formato != 'json':
+            # Formatos por columnas: directo de los arreglos, sin objetos por fila
+            with metricas.etapa('serializacion'):
+                cuerpo, tipo = formatos.tabla(df.iloc[inicio:fin], formato, extra)
+            return Response(cuerpo, mimetype=tipo), 200
+        return Response(formatos.generar_json(df, inicio, fin, extra),
+                        mimetype='application/json'), 200
+    except negociacion.FormatoNoDisponible as e:
+        return jsonify({"error": str(e)}), 406
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @app.route('/excel/negocio/datos/<int:id>', methods=['GET'])
 def obtener_dato_especifico(id):
     try:
+        ligero = _ligero()
+        if ligero is not None:
+            if id >= ligero.filas or id < 0:
+                return jsonify({"error": "Registro no encontrado"}), 404
+            return Response(json.dumps({"registro": ligero.registro(id)}, ensure_ascii=False,
+                                       separators=(',', ':')), mimetype='application/json'), 200
+
+        df = _datos_peticion().instantanea().df
         if id >= len(df) or id < 0:
             return jsonify({"error": "Registro no encontrado"}), 404
         
-        registro = df.iloc[id].to_dict()
-        return jsonify({"registro": registro}), 200
+        return Response(_registro_json(df, id), mimetype='application/json'), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
 @app.route('/excel/negocio/datos/<int:id>', methods=['PUT'])
 def actualizar_dato(id):
     try:
-        if id >= len(df) or id < 0:
-            return jsonify({"error": "Registro no encontrado"}), 404
-        
         datos_actualizados = request.get_json()
-        # Aquí iría la lógica para actualizar el DataFrame
-        return jsonify({"mensaje": "Registro actualizado", "id": id}), 200
+        if not isinstance(datos_actualizados, dict):
+            return jsonify({"error": "Se esperaba un objeto JSON con las columnas a cambiar"}), 400
+
+        # Se registra en el WAL y se publica una nueva instantánea
+        instantanea = _datos_peticion().actualizar([{**datos_actualizados, "id": id}])
+        return Response(_registro_json(instantanea.df, id, {
+            "mensaje": "Registro actualizado", "id": id, "version": instantanea.version
+        }), mimetype='application/json'), 200
+    except IndexError:
+        return jsonify({"error": "Registro no encontrado"}), 404
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route('/excel/negocio/datos', methods=['PUT'])
+def actualizar_datos():
+    try:
+        # Cuerpo: {"cambios": [{"id": 3, "latitud": 31.86}, ...]}; se aplican todos o ninguno
+        cuerpo = request.get_json()
+        cambios = cuerpo.get('cambios') if isinstance(cuerpo, dict) else None
+        if not isinstance(cambios, list):
+            return jsonify({"error": "Se esperaba {\"cambios\": [...]}"}), 400
+
+        instantanea = _datos_peticion().actualizar(cambios)
+        return jsonify({"mensaje": "Registros actualizados", "total": len(cambios),
+                        "version": instantanea.version}), 200
+    except IndexError as e:
+        return jsonify({"error": str(e)}), 404
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
 @app.route('/excel/negocio/filtrar', methods=['GET'])
+@cache_respuestas.cacheada(cache, _version)
 def filtrar_datos_ia():
     try:
+        import filtrar_datos
+        import formatos
         columna = request.args.get('columna', type=str)
         valor = request.args.get('valor', type=str)
         operador = request.args.get('operador', default='igual', type=str)
+        # Predicados extra: ?filtro=columna:operador:valor (se pueden repetir)
+        predicados = [filtrar_datos.leer_predicado(f) for f in request.args.getlist('filtro')]
+        formato = negociacion.elegir(request.args.get('formato', type=str), request.headers.get('Accept'),
+                                     formatos.FORMATOS_TABLA)
         
         # Usar tu módulo de IA para filtrar
-        resultado = filtrar_datos.filtrar(df, columna, valor, operador)
-        return jsonify({"datos_filtrados": resultado}), 200
+        instantanea = _datos_peticion().instantanea()
+        posiciones = filtrar_datos.filtrar_posiciones(instantanea.df, columna, valor, operador,
+                                                      predicados=predicados, motor=instantanea.motor)
+        if formato != 'json':
+            with metricas.etapa('serializacion'):
+                cuerpo, tipo = formatos.tabla(instantanea.df.iloc[posiciones], formato, {"total": len(posiciones)})
+            return Response(cuerpo, mimetype=tipo), 200
+        with metricas.etapa('materializacion'):
+            filas = instantanea.df.iloc[posiciones]
+        with metricas.etapa('serializacion'):
+            # Mismo JSON que /excel/negocio/datos: coordenadas a 6 decimales y vacíos como null
+            cuerpo = ''.join(formatos.generar_json(filas, 0, len(filas), {"total": len(filas)},
+                                                   clave='datos_filtrados'))
+        return Response(cuerpo, mimetype='application/json'), 200
+    except negociacion.FormatoNoDisponible as e:
+        return jsonify({"error": str(e)}), 406
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route('/excel/negocio/buscar', methods=['GET'])
+@cache_respuestas.cacheada(cache, _version)
+def buscar_nombres():
+    try:
+        consulta = request.args.get('q', default='', type=str)
+        k = request.args.get('k', default=10, type=int)
+        columna = request.args.get('columna', default='categoria_negocio', type=str)
+        if not consulta.strip():
+            return jsonify({"error": "Falta el texto a buscar (?q=...)"}), 400
+        if columna not in busqueda.COLUMNAS_BUSQUEDA:
+            return jsonify({"error": f"La columna '{columna}' no admite búsqueda; usa una de: "
+                                     f"{', '.join(busqueda.COLUMNAS_BUSQUEDA)}"}), 400
+
+        # Búsqueda difusa con el índice de palabras y trigramas (sin recorrer la columna)
+        with metricas.etapa('busqueda'):
+            resultados = _datos_peticion().instantanea().motor.buscar(columna, consulta, max(1, min(k, 100)))
+        return jsonify({
+            "consulta": consulta,
+            "resultados": [{"nombre": valor, "puntaje": round(puntaje, 3),
+                            "total_registros": int(len(filas)), "ids": filas[:50].tolist()}
+                           for valor, puntaje, filas in resultados],
+            "total": len(resultados)
+        }), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
 @app.route('/excel/negocio/analizar', methods=['GET'])
+@cache_respuestas.cacheada(cache, _version)
 def analizar_datos():
     try:
         tipo_analisis = request.args.get('tipo_analisis', type=str)
+        opciones = {}
+        if 'celda_km' in request.args:
+            opciones['celda_km'] = request.args.get('celda_km', type=float)
+        if 'forma' in request.args:
+            # Forma de las rejillas (arreglos o geojson); ?formato= es el de la respuesta
+            opciones['forma'] = request.args.get('forma', type=str)
+        if 'caja' in request.args:
+            # caja = "lat_min,lon_min,lat_max,lon_max"
+            opciones['caja'] = [float(v) for v in request.args['caja'].split(',')]
         
         # Usar tu módulo de investigador.py para análisis IA
-        resultado = investigador.analizar(df, tipo_analisis)
-        return jsonify({"analisis": resultado}), 200
+        import investigador
+        with metricas.etapa('analisis'):
+            resultado = investigador.analizar(_datos_peticion().instantanea().df, tipo_analisis, **opciones)
+        with metricas.etapa('serializacion'):
+            return jsonify({"analisis": resultado}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route('/excel/negocio/analizar/lote', methods=['POST'])
+def analizar_lote():
+    try:
+        import agregados
+        import analisis_lote
+        # Cuerpo: {"zonas": [...], "centros": [{"nombre", "lat", "lon"}], "radios": [...]}
+        cuerpo = request.get_json()
+        if not isinstance(cuerpo, dict):
+            return jsonify({"error": "Se esperaba un objeto JSON con zonas y/o centros"}), 400
+        centros = analisis_lote.centros_de(cuerpo.get('zonas', []), cuerpo.get('centros', []),
+                                           regiones_datos.zonas_todas())
+        # Topes de centros, radios y cálculos por petición (ValueError -> 400)
+        radios = analisis_lote.validar_peticion(centros, cuerpo.get('radios', agregados.RADIOS))
+
+        # Los centros se reparten en un pool de procesos
+        # (cada centro con los datos de la región que lo contiene)
+        resultados = [None] * len(centros)
+        with metricas.etapa('analisis_lote'):
+            for region, posiciones in regiones_datos.agrupar(centros, g.region).items():
+                instantanea = _datos_region(region).instantanea()
+                parciales = analisis_lote.analizar_lote(instantanea.df, [centros[i] for i in posiciones],
+                                                        radios,
+                                                        indice=instantanea.indice, version=instantanea.version)
+                for posicion, resultado in zip(posiciones, parciales):
+                    resultados[posicion] = resultado
+        return jsonify({"resultados": resultados, "total": len(resultados)}), 200
+    except KeyError as e:
+        return jsonify({"error": str(e.args[0])}), 404
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
 @app.route('/excel/negocio/estadisticas', methods=['GET'])
+@cache_respuestas.cacheada(cache, _version)
 def obtener_estadisticas():
     try:
+        ligero = _ligero()
+        if ligero is not None:
+            return jsonify({"estadisticas": ligero.estadisticas()}), 200
+
+        import almacen
+        df = _datos_peticion().instantanea().df
         stats = {
             "total_registros": len(df),
             "columnas": list(df.columns),
             "tipos_datos": df.dtypes.astype(str).to_dict(),
-            "registros_nulos": df.isnull().sum().to_dict()
+            "registros_nulos": df.isnull().sum().to_dict(),
+            # Memoria de la tabla en este worker (y cuánto se comparte por mmap)
+            "uso_memoria": almacen.uso_memoria(df)
         }
         return jsonify({"estadisticas": stats}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-# Handler para Vercel
-def handler(request):
-    from flask import Response
-    import json
-    
-    with app.app_context():
-        path = request.path
-        method = request.method
-        
-        # Simular el routing de Flask para Vercel
-        if path == '/' and method == 'GET':
-            return Response(json.dumps(home()), mimetype='application/json')
-        elif path.startswith('/excel/negocio/datos') and method == 'GET':
-            if '/' in path.split('/excel/negocio/datos/')[-1]:
-                id_str = path.split('/')[-1]
-                if id_str.isdigit():
-                    return obtener_dato_especifico(int(id_str))
-            return obtener_datos()
-        elif path.startswith('/excel/negocio/filtrar') and method == 'GET':
-            return filtrar_datos_ia()
-        elif path.startswith('/excel/negocio/analizar') and method == 'GET':
-            return analizar_datos()
-        elif path.startswith('/excel/negocio/estadisticas') and method == 'GET':
-            return obtener_estadisticas()
+@app.route('/oportunidades/<zona>', methods=['GET'])
+@cache_respuestas.cacheada(cache, _version)
+def oportunidades_zona(zona):
+    try:
+        zona = zona.strip().lower()
+        formato = negociacion.elegir(request.args.get('formato', type=str), request.headers.get('Accept'),
+                                     negociacion.FORMATOS_OBJETO)
+        zonas = regiones_datos.zonas(g.region)
+        if zona not in zonas:
+            return jsonify({"error": f"Zona '{zona}' no encontrada"}), 404
+
+        lat, lon, radio_zona = zonas[zona]
+        radio_km = validar_radio(request.args.get('radio_km', default=radio_zona))
+
+        # Radios del slider precalculados en el almacén desplegado: sin cargar pandas
+        ligero = _ligero()
+        precalculado = ligero.oportunidades(zona, radio_km) if ligero is not None else None
+        if precalculado is not None:
+            resultado, radio_complemento = precalculado
+        else:
+            import agregados
+            import sinergias
+            instantanea = _datos_peticion().instantanea()
+            if instantanea.indice is None:
+                return jsonify({"error": f"Zona '{zona}' no encontrada"}), 404
+            radio_complemento = sinergias.RADIO_COMPLEMENTO_KM
+
+            # Los radios del slider ya están precalculados: es solo una búsqueda
+            resultado = agregados.consultar(instantanea.agregados, zona, radio_km)
+            if resultado is None:
+                # Radio fuera de la escalera precalculada: se calcula igual que los agregados
+                with metricas.etapa('oportunidades'):
+                    resultado = agregados.calcular_zona(
+                        instantanea.df, instantanea.indice, lat, lon, (radio_km,))[str(radio_km)]
+
+        respuesta = {
+            "zona": zona,
+            "radio_km": radio_km,
+            "region": g.region,
+            **resultado,
+            "nota": "Anclas sin negocio complementario a menos de "
+                    f"{radio_complemento} km"
+        }
+        if formato == 'msgpack':
+            return Response(negociacion.empaquetar(respuesta), mimetype=negociacion.TIPOS['msgpack']), 200
+        return jsonify(respuesta), 200
+    except negociacion.FormatoNoDisponible as e:
+        return jsonify({"error": str(e)}), 406
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route('/tiles/<int:z>/<int:x>/<int:y>', methods=['GET'])
+@app.route('/tiles/<int:z>/<int:x>/<int:y>.<formato>', methods=['GET'])
+def obtener_tesela(z, x, y, formato=None):
+    try:
+        # Formato por extensión, ?formato= o Accept (los mapas piden image/png)
+        formato = negociacion.elegir(formato or request.args.get('formato', type=str),
+                                     request.headers.get('Accept'), tuple(teselas.FORMATOS))
+        color = request.args.get('color', type=str)
+
+        # Del disco si ya se generó; si no, de la pirámide en memoria de esta versión
+        # (armada de los .npy sin pandas mientras no hagan falta los datos completos)
+        ligero = _ligero()
+        version = _version()
+        if ligero is not None:
+            construir = lambda: teselas.Piramide.desde_artefacto(ligero)
         else:
-            return Response(json.dumps({"error": "Ruta no encontrada"}), status=404, mimetype='application/json')
+            construir = lambda: teselas.Piramide.desde_df(_datos_peticion().instantanea().df)
+        cuerpo, tipo = teselas.servir(cache_teselas, g.region, version, z, x, y, formato, color, construir)
+        respuesta = Response(cuerpo, mimetype=tipo)
+        # La URL ya fija z/x/y: basta la versión de los datos y la variante
+        respuesta.set_etag(f"{version}.{color or 'puntos'}.{formato}")
+        return respuesta.make_conditional(request)
+    except negociacion.FormatoNoDisponible as e:
+        return jsonify({"error": str(e)}), 406
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+def _tablas_sitios(region=None):
+    # Sumas acumuladas por capa de la región (por defecto la de la petición) y versión de los datos
+    # Armadas de los .npy sin pandas mientras no hagan falta los datos completos
+    region = region or g.region
+    ligero = _ligero() if region == g.region else None
+    if ligero is not None:
+        return sitios.tablas_para(region, ligero.version, lambda: sitios.TablasSitios.desde_artefacto(ligero))
+    instantanea = _datos_region(region).instantanea()
+    return sitios.tablas_para(region, instantanea.version, lambda: sitios.TablasSitios.desde_df(instantanea.df))
+
+def _responder_sitios(respuesta, formato):
+    if formato == 'msgpack':
+        return Response(negociacion.empaquetar(respuesta), mimetype=negociacion.TIPOS['msgpack']), 200
+    return jsonify(respuesta), 200
+
+@app.route('/sitios/puntaje', methods=['GET', 'POST'])
+def puntuar_sitios():
+    # Negocios por capa y oportunidad a ~radio_km de cualquier punto: GET ?lat=&lon= para uno,
+    # POST {"puntos": [[lat, lon], ...], "radio_km": r} para muchos en una sola llamada
+    try:
+        formato = negociacion.elegir(request.args.get('formato', type=str), request.headers.get('Accept'),
+                                     negociacion.FORMATOS_OBJETO)
+        if request.method == 'POST':
+            cuerpo = request.get_json(silent=True) or {}
+            lats, lons = sitios.leer_puntos(cuerpo.get('puntos', []))
+            radio_km = float(cuerpo.get('radio_km', sitios.RADIO_KM))
+            # Cada punto con las tablas de la región que lo contiene
+            grupos = regiones_datos.agrupar([(None, lat, lon) for lat, lon in zip(lats.tolist(), lons.tolist())],
+                                            g.region)
+            respuesta = {"total": len(lats), "region": g.region,
+                         "regiones": {region: len(posiciones) for region, posiciones in grupos.items()},
+                         **sitios.respuesta([(_tablas_sitios(region), posiciones)
+                                             for region, posiciones in grupos.items()],
+                                            lats, lons, radio_km, formato)}
+        else:
+            lat = request.args.get('lat', type=float)
+            lon = request.args.get('lon', type=float)
+            if lat is None or lon is None:
+                return jsonify({"error": "Faltan los parámetros lat y lon"}), 400
+            lats, lons = sitios.leer_puntos([[lat, lon]])
+            radio_km = request.args.get('radio_km', default=sitios.RADIO_KM, type=float)
+            respuesta = {"lat": lat, "lon": lon, "region": g.region,
+                         **sitios.respuesta(_tablas_sitios(), lats, lons, radio_km, unico=True)}
+        return _responder_sitios(respuesta, formato)
+    except negociacion.FormatoNoDisponible as e:
+        return jsonify({"error": str(e)}), 406
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route('/sitios/rejilla', methods=['GET'])
+@cache_respuestas.cacheada(cache, _version)
+def rejilla_sitios():
+    # Superficie de oportunidad: puntaje de cada centro de una rejilla (?caja=lat_min,lon_min,lat_max,lon_max&paso_km=)
+    try:
+        formato = negociacion.elegir(request.args.get('formato', type=str), request.headers.get('Accept'),
+                                     negociacion.FORMATOS_OBJETO)
+        tablas = _tablas_sitios()
+        caja = sitios.leer_caja(request.args.get('caja', type=str))
+        paso_km = request.args.get('paso_km', default=sitios.PASO_KM, type=float)
+        radio_km = request.args.get('radio_km', default=sitios.RADIO_KM, type=float)
+        lats, lons, rejilla = tablas.rejilla(caja, paso_km)
+        respuesta = {"region": g.region, "rejilla": rejilla, "total": len(lats),
+                     **sitios.respuesta(tablas, lats, lons, radio_km, formato)}
+        return _responder_sitios(respuesta, formato)
+    except negociacion.FormatoNoDisponible as e:
+        return jsonify({"error": str(e)}), 406
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route('/regiones', methods=['GET'])
+def listar_regiones():
+    # Regiones del catálogo, cuáles están cargadas y cuánta memoria ocupan
+    return jsonify(regiones_datos.resumen()), 200
+
+# Listo para atender: Flask, los módulos ligeros y las rutas (los datos aún no)
+metricas.registrar_arranque('importacion', time.perf_counter() - _INICIO)
@@ -0,0 +1,118 @@
+"""Modo ASGI de la API (Uvicorn).
+
+Se arranca con `python api.py` o con `uvicorn api_asgi:app --port 8000`.
+Expone las mismas rutas que la app Flask de api.py: todas se despachan a sus
+vistas de Flask, con la misma validación, cache y ETag que en modo WSGI.
+Todo el trabajo de pandas/numpy corre en pools de hilos acotados, separados
+por carril para que un análisis lento de toda la ciudad no bloquee las
+consultas baratas. Si un carril está lleno se contesta 503 (Retry-After).
+"""
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+# Hilos por carril y peticiones que pueden esperar turno antes de rechazar
+HILOS = {
+    "ligero": int(os.environ.get('ASGI_HILOS_LIGEROS', 8)),
+    "pesado": int(os.environ.get('ASGI_HILOS_PESADOS', 2)),
+    # Las escrituras se serializan de todas formas (candado del WAL)
+    "escritura": 1,
+}
+EN_ESPERA = int(os.environ.get('ASGI_EN_ESPERA', 16))
+
+# Carril de cada vista de Flask; las que no aparecen van al ligero
+CARRIL_POR_VISTA = {
+    "obtener_datos": "pesado",
+    "filtrar_datos_ia": "pesado",
+    "analizar_datos": "pesado",
+    "analizar_lote": "pesado",
+    "rejilla_sitios": "pesado",
+    "puntuar_sitios": "pesado",
+    "actualizar_dato": "escritura",
+    "actualizar_datos": "escritura",
+}
+
+METODOS = ["GET", "POST", "PUT", "DELETE", "PATCH"]
+
+
+class Saturado(Exception):
+    pass
+
+
+class Carril:
+    """Pool de hilos acotado con un límite de peticiones en curso (contrapresión)"""
+
+    def __init__(self, nombre, hilos, en_espera=EN_ESPERA):
+        self.nombre = nombre
+        self.pool = ThreadPoolExecutor(hilos, thread_name_prefix=f'asgi-{nombre}')
+        self.limite = hilos + en_espera
+        # Solo se modifica desde el event loop, no necesita candado
+        self.en_curso = 0
+
+    async def ejecutar(self, funcion, *args):
+        if self.en_curso >= self.limite:
+            raise Saturado(self.nombre)
+        self.en_curso += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.pool, funcion, *args)
+        finally:
+            self.en_curso -= 1
+
+
+def _saturado(carril):
+    return JSONResponse({"error": f"Servidor ocupado ({carril}), intenta de nuevo en un momento"},
+                        status_code=503, headers={"Retry-After": "1"})
+
+
+def _despachar(flask_app, metodo, ruta, consulta, cuerpo, cabeceras):
+    # Corre en un hilo del pool: la vista de Flask completa, con su cache y ETag
+    with flask_app.test_request_context(ruta, method=metodo, query_string=consulta,
+                                        data=cuerpo, headers=cabeceras):
+        return flask_app.full_dispatch_request()
+
+
+def crear_app(flask_app):
+    """App ASGI sobre la app Flask de api.py"""
+    carriles = {nombre: Carril(nombre, hilos) for nombre, hilos in HILOS.items()}
+    adaptador = flask_app.url_map.bind('localhost')
+
+    async def reenviar(request):
+        ruta, metodo = request.url.path, request.method
+        try:
+            vista, _ = adaptador.match(ruta, metodo)
+        except Exception:
+            # 404/405: que Flask arme la respuesta en el carril ligero
+            vista = None
+        carril = CARRIL_POR_VISTA.get(vista, "ligero")
+
+        try:
+            respuesta = await carriles[carril].ejecutar(
+                _despachar, flask_app, metodo, ruta, request.url.query,
+                await request.body(), list(request.headers.items()))
+        except Saturado:
+            return _saturado(carril)
+
+        cabeceras = {clave: valor for clave, valor in respuesta.headers.items()
+                     if clave.lower() != 'content-length'}
+        if respuesta.is_streamed:
+            # Starlette consume el generador (formatos.*) fuera del event loop
+            return StreamingResponse(respuesta.iter_encoded(), status_code=respuesta.status_code,
+                                     headers=cabeceras)
+        return Response(respuesta.get_data(), status_code=respuesta.status_code, headers=cabeceras)
+
+    return Starlette(routes=[
+        Route('/{ruta:path}', reenviar, methods=METODOS),
+    ])
+
+
+def __getattr__(nombre):
+    # `uvicorn api_asgi:app` carga api.py solo cuando se pide la app
+    if nombre == 'app':
+        import api
+        globals()['app'] = crear_app(api.app)
+        return globals()['app']
+    raise AttributeError(nombre)
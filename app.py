@@ -1,9 +1,14 @@
 import streamlit as st
 import pandas as pd
 import folium
+from folium.plugins import FastMarkerCluster
 from streamlit_folium import st_folium
+import html
 import requests
+from requests.adapters import HTTPAdapter
 import json
+import threading
+from zonas import ZONAS_CONOCIDAS
 
 # --- CONFIGURACIÓN ---
 st.set_page_config(
@@ -12,36 +17,76 @@ st.set_page_config(
     layout="wide"
 )
 
-# Zonas conocidas
-ZONAS_CONOCIDAS = {
-    "maneadero": (31.7167, -116.5667, 3), 
-    "centro": (31.8650, -116.6217, 2),
-    "chapultepec": (31.8386, -116.6014, 2), 
-    "sauzal": (31.8833, -116.6833, 2.5),
-    "valle dorado": (31.8489, -116.5858, 2)
+API_URL = "http://localhost:8000"
+# Segundos que se reutiliza una respuesta de la API
+TTL_RESULTADOS = 300
+RADIO_POR_DEFECTO = 2.0
+# Con más oportunidades que esto, el mapa las agrupa en clusters
+UMBRAL_AGRUPAR = 30
+COLORES_SINERGIA = {"educacion": "blue", "salud": "red", "deporte": "orange"}
+# Capa con todos los negocios: teselas de la API (una imagen por tesela, sin un marcador por negocio)
+URL_TESELAS = API_URL + "/tiles/{z}/{x}/{y}.png?color=sinergia"
+
+# Cada punto del cluster se dibuja en el navegador a partir de un arreglo:
+# [lat, lon, tooltip, popup, color]
+MARCADOR_CLUSTER_JS = """
+function (row) {
+    var marker = L.circleMarker(new L.LatLng(row[0], row[1]),
+                                {radius: 7, color: row[4], fillOpacity: 0.8});
+    marker.bindTooltip(row[2]);
+    marker.bindPopup(row[3]);
+    return marker;
 }
+"""
 
-API_URL = "http://localhost:8000"
+# --- CONEXIÓN Y CACHE DE LA API ---
+@st.cache_resource
+def obtener_sesion():
+    """Una sola sesión HTTP (con pool de conexiones) para todo el servidor"""
+    sesion = requests.Session()
+    adaptador = HTTPAdapter(pool_connections=4, pool_maxsize=len(ZONAS_CONOCIDAS) + 4)
+    sesion.mount("http://", adaptador)
+    sesion.mount("https://", adaptador)
+    return sesion
+
+@st.cache_data(ttl=TTL_RESULTADOS, show_spinner=False)
+def consultar_oportunidades(zona, radio_km):
+    """Llama a la API; los errores se lanzan para que no queden en la cache"""
+    response = obtener_sesion().get(
+        f"{API_URL}/oportunidades/{zona}",
+        params={"radio_km": radio_km},
+        timeout=10
+    )
+    response.raise_for_status()
+    return response.json()
+
+def _precargar_zonas():
+    for zona in ZONAS_CONOCIDAS:
+        try:
+            consultar_oportunidades(zona, RADIO_POR_DEFECTO)
+        except requests.exceptions.RequestException:
+            # Si la API no está lista, la zona se pedirá cuando se use
+            pass
+
+@st.cache_resource
+def iniciar_precarga():
+    """Precarga todas las zonas en segundo plano (una vez por servidor)"""
+    hilo = threading.Thread(target=_precargar_zonas, daemon=True)
+    hilo.start()
+    return hilo
 
 # --- FUNCIÓN PARA LA API ---
-def analizar_con_api(zona, radio_km=2.0):
+def analizar_con_api(zona, radio_km=RADIO_POR_DEFECTO):
     try:
         st.info(f"🔍 Solicitando datos de {zona} a la API...")
         
-        response = requests.get(
-            f"{API_URL}/oportunidades/{zona}",
-            params={"radio_km": radio_km},
-            timeout=10
-        )
-        
-        if response.status_code == 200:
-            datos = response.json()
-            st.success(f"✅ Datos recibidos de la API para {zona}")
-            return datos
-        else:
-            st.error(f"❌ Error de la API: {response.status_code}")
-            return None
+        datos = consultar_oportunidades(zona, float(radio_km))
+        st.success(f"✅ Datos recibidos de la API para {zona}")
+        return datos
             
+    except requests.exceptions.HTTPError as e:
+        st.error(f"❌ Error de la API: {e.response.status_code}")
+        return None
     except requests.exceptions.ConnectionError:
         st.error("""
         ❌ No se puede conectar con la API. 
@@ -58,6 +103,12 @@ def analizar_con_api(zona, radio_km=2.0):
         return None
 
 # --- FUNCIÓN PARA CREAR MAPA ---
+def capa_negocios():
+    """Todos los negocios como teselas de la API (costo fijo sin importar cuántos sean)"""
+    return folium.TileLayer(URL_TESELAS, attr="Negocios: DENUE (INEGI)", name="Todos los negocios",
+                            overlay=True, opacity=0.8)
+
+@st.cache_resource(max_entries=32)
 def crear_mapa_bonito(zona_info, oportunidades=None):
     """Crea el mapa con keys únicas"""
     lat_zona, lon_zona, _ = zona_info
@@ -72,6 +123,7 @@ def crear_mapa_bonito(zona_info, oportunidades=None):
     
     folium.TileLayer('OpenStreetMap').add_to(mapa)
     folium.TileLayer('CartoDB positron').add_to(mapa)
+    capa_negocios().add_to(mapa)
     folium.LayerControl().add_to(mapa)
     
     # Marcar el centro de la zona
@@ -81,8 +133,20 @@ def crear_mapa_bonito(zona_info, oportunidades=None):
         icon=folium.Icon(color='purple', icon='home')
     ).add_to(mapa)
     
+    # Muchas oportunidades: un solo cluster construido desde arreglos
+    if oportunidades and len(oportunidades) > UMBRAL_AGRUPAR:
+        datos_cluster = [
+            [op['ancla_lat'], op['ancla_lon'],
+             html.escape(f"Ancla: {op['ancla']}"),
+             f"<b>{html.escape(op['ancla'])}</b><br>{html.escape(op['oportunidad'])}",
+             COLORES_SINERGIA.get(op.get('categoria_sinergia'), 'green')]
+            for op in oportunidades
+        ]
+        FastMarkerCluster(datos_cluster, callback=MARCADOR_CLUSTER_JS,
+                          name="Oportunidades").add_to(mapa)
+    
     # Marcar oportunidades de la API
-    if oportunidades:
+    elif oportunidades:
         for i, op in enumerate(oportunidades):
             # Marcador AZUL para el negocio "ancla"
             folium.Marker(
@@ -112,16 +176,55 @@ def crear_mapa_bonito(zona_info, oportunidades=None):
     
     return mapa
 
+def crear_capa_enfoque(op):
+    """Capa ligera con la oportunidad seleccionada; se agrega sin reconstruir el mapa"""
+    capa = folium.FeatureGroup(name="Enfoque")
+    folium.Marker(
+        [op['ancla_lat'], op['ancla_lon']],
+        tooltip=op['ancla'],
+        icon=folium.Icon(color='red', icon='info-sign')
+    ).add_to(capa)
+    folium.Circle(
+        location=[op['ancla_lat'], op['ancla_lon']],
+        radius=500,
+        color='green',
+        fill=True,
+        fillOpacity=0.1
+    ).add_to(capa)
+    return capa
+
+@st.cache_resource
+def crear_mapa_bienvenida():
+    mapa_bienvenida = folium.Map(
+        location=[31.8650, -116.6217],
+        zoom_start=11
+    )
+    capa_negocios().add_to(mapa_bienvenida)
+    
+    for zona_nombre, zona_info in ZONAS_CONOCIDAS.items():
+        folium.Marker(
+            [zona_info[0], zona_info[1]],
+            tooltip=zona_nombre.title(),
+            popup=f"Analizar {zona_nombre.title()}"
+        ).add_to(mapa_bienvenida)
+    
+    return mapa_bienvenida
+
 # --- INTERFAZ PRINCIPAL ---
 st.title("🤖 Emprende IA v2.0")
 st.header("Tu Asistente de Negocios Inteligente para Ensenada")
 st.markdown("---")
 
+# Las zonas se piden a la API en segundo plano desde el arranque
+iniciar_precarga()
+
 # Estado de la aplicación
 if 'resultados' not in st.session_state:
     st.session_state.resultados = None
 if 'zona_analizada' not in st.session_state:
     st.session_state.zona_analizada = None
+if 'enfoque' not in st.session_state:
+    st.session_state.enfoque = None
 
 # Panel de control
 col_config, col_resultados = st.columns([1, 2])
@@ -139,7 +242,7 @@ with col_config:
         
         radio_seleccionado = st.slider(
             "Radio de búsqueda (km):", 
-            0.5, 5.0, 2.0, 0.5,
+            0.5, 5.0, RADIO_POR_DEFECTO, 0.5,
             key="slider_radio_principal"
         )
         
@@ -150,6 +253,7 @@ with col_config:
                 if resultados:
                     st.session_state.resultados = resultados
                     st.session_state.zona_analizada = zona_seleccionada
+                    st.session_state.enfoque = None
                     st.success("✅ ¡Análisis desde API completado!")
                 else:
                     st.error("❌ No se pudieron obtener datos de la API")
@@ -185,44 +289,26 @@ with col_resultados:
                 st.subheader(f"💡 Oportunidades Detectadas ({len(datos['oportunidades'])})")
                 
                 # Mostrar cada oportunidad SIN KEY en el expander
+                # (sin mini-mapas: el botón enfoca el mapa principal)
                 for i, op in enumerate(datos['oportunidades']):
                     # EXPANDER SIN PARÁMETRO KEY
-                    with st.expander(f"🏪 {op['oportunidad']} - Cerca de {op['ancla']}", expanded=True):
+                    with st.expander(f"🏪 {op['oportunidad']} - Cerca de {op['ancla']}",
+                                     expanded=st.session_state.enfoque == i):
                         
-                        col_info, col_mapa = st.columns([2, 1])
+                        st.write(f"**Tipo:** {op.get('categoria_sinergia', 'N/A').title()}")
+                        st.write(f"**Ancla:** {op['ancla']}")
+                        st.write(f"**Dirección:** {op.get('ancla_direccion', 'Coordenadas disponibles')}")
+                        st.write(f"**Confianza:** {op.get('confianza', 'alta')}")
                         
-                        with col_info:
-                            st.write(f"**Tipo:** {op.get('categoria_sinergia', 'N/A').title()}")
-                            st.write(f"**Ancla:** {op['ancla']}")
-                            st.write(f"**Dirección:** {op.get('ancla_direccion', 'Coordenadas disponibles')}")
-                            st.write(f"**Confianza:** {op.get('confianza', 'alta')}")
-                            
-                            if 'educacion' in op.get('categoria_sinergia', ''):
-                                st.info("💡 **Recomendación:** Papelería, útiles escolares, copias")
-                            elif 'salud' in op.get('categoria_sinergia', ''):
-                                st.info("💡 **Recomendación:** Farmacia, productos médicos")
-                            elif 'deporte' in op.get('categoria_sinergia', ''):
-                                st.info("💡 **Recomendación:** Suplementos, ropa deportiva")
+                        if 'educacion' in op.get('categoria_sinergia', ''):
+                            st.info("💡 **Recomendación:** Papelería, útiles escolares, copias")
+                        elif 'salud' in op.get('categoria_sinergia', ''):
+                            st.info("💡 **Recomendación:** Farmacia, productos médicos")
+                        elif 'deporte' in op.get('categoria_sinergia', ''):
+                            st.info("💡 **Recomendación:** Suplementos, ropa deportiva")
                         
-                        with col_mapa:
-                            # Mapa mini con KEY ÚNICA
-                            mapa_mini = folium.Map(
-                                location=[op['ancla_lat'], op['ancla_lon']], 
-                                zoom_start=16,
-                                width=200,
-                                height=150
-                            )
-                            folium.Marker(
-                                [op['ancla_lat'], op['ancla_lon']],
-                                tooltip=op['ancla'],
-                                icon=folium.Icon(color='red', icon='info-sign')
-                            ).add_to(mapa_mini)
-                            
-                            # KEY ÚNICA para cada st_folium
-                            st_folium(mapa_mini, 
-                                    height=150, 
-                                    width=200, 
-                                    key=f"mapa_mini_{zona_nombre}_{i}")
+                        if st.button("📍 Ver en el mapa", key=f"enfocar_{zona_nombre}_{i}"):
+                            st.session_state.enfoque = i
                 
                 # --- MAPA PRINCIPAL ---
                 st.subheader("🗺️ Mapa de Oportunidades")
@@ -240,10 +326,23 @@ with col_resultados:
                 zona_info = ZONAS_CONOCIDAS[zona_nombre]
                 mapa_principal = crear_mapa_bonito(zona_info, oportunidades_para_mapa)
                 
+                # Enfoque bajo demanda: se mueve el mismo mapa en vez de crear otro
+                enfoque = st.session_state.enfoque
+                if enfoque is not None and enfoque < len(datos['oportunidades']):
+                    op = datos['oportunidades'][enfoque]
+                    centro, zoom = [op['ancla_lat'], op['ancla_lon']], 17
+                    capa_enfoque = crear_capa_enfoque(op)
+                else:
+                    centro, zoom = [zona_info[0], zona_info[1]], 14
+                    capa_enfoque = None
+                
                 # KEY ÚNICA para el mapa principal
                 st_folium(mapa_principal, 
                          height=500, 
                          use_container_width=True, 
+                         center=centro,
+                         zoom=zoom,
+                         feature_group_to_add=capa_enfoque,
                          key=f"mapa_principal_{zona_nombre}")
                 
             else:
@@ -262,17 +361,7 @@ with col_resultados:
         
         # Mapa de bienvenida
         st.subheader("📍 Zonas Disponibles para Análisis")
-        mapa_bienvenida = folium.Map(
-            location=[31.8650, -116.6217],
-            zoom_start=11
-        )
-        
-        for zona_nombre, zona_info in ZONAS_CONOCIDAS.items():
-            folium.Marker(
-                [zona_info[0], zona_info[1]],
-                tooltip=zona_nombre.title(),
-                popup=f"Analizar {zona_nombre.title()}"
-            ).add_to(mapa_bienvenida)
+        mapa_bienvenida = crear_mapa_bienvenida()
         
         st_folium(mapa_bienvenida, 
                  height=400, 
@@ -285,7 +374,7 @@ with st.sidebar:
     
     if st.button("Probar Conexión API", key="boton_test_api"):
         try:
-            response = requests.get(f"{API_URL}/test", timeout=5)
+            response = obtener_sesion().get(f"{API_URL}/test", timeout=5)
             if response.status_code == 200:
                 st.success("✅ API conectada correctamente")
                 st.json(response.json())
@@ -333,6 +422,7 @@ with st.sidebar:
             
             st.session_state.resultados = datos_ejemplo
             st.session_state.zona_analizada = zona_emergencia
+            st.session_state.enfoque = None
             st.rerun()
 
 # --- BOTÓN PARA LIMPIAR ---
@@ -0,0 +1,200 @@
+"""Lectura del almacén columnar solo con numpy (sin pandas).
+
+En despliegues sin servidor cada arranque en frío paga la importación de
+pandas y la construcción de índices. Las rutas ligeras (estadísticas, un
+registro, oportunidades de los radios precalculados) se pueden contestar
+directo de los .npy, meta.json y agregados.json que genera
+`python filtrar_datos.py --solo-columnar`, mientras no haya cambios
+pendientes en el registro (WAL). Las respuestas son las mismas que da la
+ruta completa.
+"""
+import hashlib
+import json
+import os
+import sys
+
+import numpy as np
+
+# Mismos nombres que almacen, agregados y datos_vivos
+ARCHIVO_META = 'meta.json'
+ARCHIVO_AGREGADOS = 'agregados.json'
+ARCHIVO_CAMBIOS = 'cambios.wal'
+
+# Tamaño de un apuntador en un arreglo object (una columna de textos sin compactar)
+BYTES_APUNTADOR = 8
+
+
+def compartido(valores):
+    # Arreglos abiertos con mmap: las páginas son del archivo y se comparten entre workers
+    while valores is not None and not isinstance(valores, np.memmap):
+        valores = valores.base
+    return valores is not None
+
+
+def uso_memoria(columnas, filas):
+    """Memoria de una tabla compacta y lo que ocuparía con los tipos por defecto.
+
+    'columnas' son tuplas (nombre, valores, categorías o None); las columnas
+    categóricas dan sus códigos en 'valores' y las de texto sin compactar un
+    arreglo object. El diccionario se cuenta como
+    objetos str de Python, una sola vez por columna; sin compactar, cada fila
+    tiene su propio str (como lo deja read_csv) y las coordenadas son float64.
+    """
+    detalle = {}
+    for nombre, valores, categorias in columnas:
+        columna = {"tipo": str(valores.dtype), "datos_bytes": int(valores.nbytes),
+                   "compartida": compartido(valores)}
+        if categorias is not None:
+            tamanos = np.array([sys.getsizeof(str(c)) for c in categorias] + [sys.getsizeof(float('nan'))],
+                               dtype=np.int64)
+            columna["categorias"] = len(categorias)
+            columna["diccionario_bytes"] = int(tamanos[:-1].sum()) + BYTES_APUNTADOR * len(categorias)
+            # El código -1 (vacío) se lee como NaN
+            usos = np.bincount(np.where(valores < 0, len(categorias), valores), minlength=len(tamanos))
+            columna["sin_compactar_bytes"] = int(usos @ tamanos) + BYTES_APUNTADOR * filas
+        else:
+            if valores.dtype == object:
+                # Textos sin compactar: un str por fila además del apuntador
+                columna["datos_bytes"] += sum(map(sys.getsizeof, valores.tolist()))
+            columna["diccionario_bytes"] = 0
+            columna["sin_compactar_bytes"] = 8 * filas if valores.dtype.kind in 'fiu' else columna["datos_bytes"]
+        columna["total_bytes"] = columna["datos_bytes"] + columna["diccionario_bytes"]
+        detalle[nombre] = columna
+
+    total = sum(c["total_bytes"] for c in detalle.values())
+    sin_compactar = sum(c["sin_compactar_bytes"] for c in detalle.values())
+    compartida = sum(c["datos_bytes"] for c in detalle.values() if c["compartida"])
+    return {
+        "total_bytes": total,
+        "compartida_bytes": compartida,
+        "privada_bytes": total - compartida,
+        "bytes_por_registro": round(total / filas, 1) if filas else 0,
+        "sin_compactar_bytes": sin_compactar,
+        "reduccion": round(sin_compactar / total, 2) if total else None,
+        "columnas": detalle
+    }
+
+
+class Artefacto:
+    """Almacén columnar abierto con mmap, con las consultas que no necesitan pandas"""
+
+    def __init__(self, directorio, ruta_cambios=None):
+        self.directorio = directorio
+        self.ruta_cambios = (ruta_cambios or os.environ.get('RUTA_CAMBIOS')
+                             or os.path.join(directorio, ARCHIVO_CAMBIOS))
+        ruta_meta = os.path.join(directorio, ARCHIVO_META)
+        self._marca = os.stat(ruta_meta).st_mtime_ns
+        with open(ruta_meta, encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self.filas = self.meta['filas']
+        self.columnas = {columna['nombre']: columna for columna in self.meta['columnas']}
+        self._arreglos = {}
+        self._version = None
+        self._agregados = None
+
+    def reescrito(self):
+        """True si el almacén se regeneró (o se compactó) después de abrirlo"""
+        try:
+            return os.stat(os.path.join(self.directorio, ARCHIVO_META)).st_mtime_ns != self._marca
+        except OSError:
+            return True
+
+    def vigente(self):
+        """False si el almacén se reescribió o hay cambios del registro sin compactar"""
+        if self.reescrito():
+            return False
+        try:
+            return os.path.getsize(self.ruta_cambios) == 0
+        except OSError:
+            return True
+
+    def arreglo(self, nombre):
+        if nombre not in self._arreglos:
+            self._arreglos[nombre] = np.load(os.path.join(self.directorio, f'{nombre}.npy'), mmap_mode='r')
+        return self._arreglos[nombre]
+
+    @property
+    def version(self):
+        """La misma huella que almacen.version_datos del DataFrame cargado"""
+        if self._version is None:
+            huella = hashlib.blake2b(digest_size=8)
+            huella.update(str(self.filas).encode())
+            for nombre, columna in self.columnas.items():
+                huella.update(str(nombre).encode())
+                huella.update(np.ascontiguousarray(self.arreglo(nombre)).tobytes())
+                if columna['tipo'] == 'categoria':
+                    huella.update('\x00'.join(columna['categorias']).encode())
+            self._version = huella.hexdigest()
+        return self._version
+
+    @property
+    def agregados(self):
+        """agregados.json, solo si corresponde a estos datos (si no, None)"""
+        if self._agregados is None:
+            try:
+                with open(os.path.join(self.directorio, ARCHIVO_AGREGADOS), encoding='utf-8') as f:
+                    agregados = json.load(f)
+            except (OSError, ValueError):
+                agregados = {}
+            if agregados.get("version") != self.version or "radio_complemento_km" not in agregados:
+                agregados = {}
+            self._agregados = agregados
+        return self._agregados or None
+
+    def estadisticas(self):
+        """Lo mismo que /estadisticas calcula con df.dtypes y df.isnull()"""
+        tipos, nulos = {}, {}
+        for nombre, columna in self.columnas.items():
+            valores = self.arreglo(nombre)
+            if columna['tipo'] == 'categoria':
+                tipos[nombre] = 'category'
+                nulos[nombre] = int(np.count_nonzero(valores < 0))
+            else:
+                tipos[nombre] = columna['tipo']
+                nulos[nombre] = int(np.count_nonzero(np.isnan(valores))) if valores.dtype.kind == 'f' else 0
+        return {
+            "total_registros": self.filas,
+            "columnas": list(self.columnas),
+            "tipos_datos": tipos,
+            "registros_nulos": nulos,
+            "uso_memoria": uso_memoria(
+                [(nombre, self.arreglo(nombre), columna.get('categorias')) for nombre, columna in self.columnas.items()],
+                self.filas)
+        }
+
+    def registro(self, id):
+        """Fila 'id' como dict (como formatos.filas_json: float32 a 6 decimales, vacíos como None)"""
+        registro = {}
+        for nombre, columna in self.columnas.items():
+            valor = self.arreglo(nombre)[id]
+            if columna['tipo'] == 'categoria':
+                registro[nombre] = columna['categorias'][valor] if valor >= 0 else None
+            elif valor.dtype.kind == 'f':
+                valor = np.float64(valor)
+                if np.isnan(valor):
+                    registro[nombre] = None
+                else:
+                    registro[nombre] = float(np.round(valor, 6) if columna['tipo'] == 'float32' else valor)
+            else:
+                registro[nombre] = valor.item()
+        return registro
+
+    def oportunidades(self, zona, radio_km):
+        """Resultado precalculado de (zona, radio) y el radio de complemento, o None"""
+        agregados = self.agregados
+        if agregados is None or zona not in agregados["zonas"]:
+            return None
+        # Como agregados.clave_radio: solo un radio igual a uno de la escalera
+        radio = float(radio_km)
+        for clave, resultado in agregados["zonas"][zona]["radios"].items():
+            if abs(float(clave) - radio) <= 1e-9:
+                return resultado, agregados["radio_complemento_km"]
+        return None
+
+
+def abrir(directorio, ruta_cambios=None):
+    """Artefacto del directorio, o None si no hay almacén columnar utilizable"""
+    try:
+        return Artefacto(directorio, ruta_cambios)
+    except (OSError, ValueError, KeyError):
+        return None
@@ -0,0 +1,368 @@
+"""Benchmark de la API de negocios.
+
+Uso:
+    python benchmarks/benchmark_api.py                        # las filas reales, test client
+    python benchmarks/benchmark_api.py --filas 19101 200000 1000000
+    python benchmarks/benchmark_api.py --modo gunicorn --workers 4 --concurrencia 16
+    python benchmarks/benchmark_api.py --app api/main.py
+    python benchmarks/benchmark_api.py --comparar benchmarks/resultados/anterior.json
+
+Cada tamaño de datos corre en un proceso aparte (en una carpeta temporal con su
+propio datos_ensenada.csv y almacén columnar), así se mide el arranque en frío y
+la memoria máxima (RSS) sin que un escenario contamine al siguiente.
+Los resultados se guardan como JSON en benchmarks/resultados/.
+"""
+import argparse
+import concurrent.futures
+import datetime
+import importlib.util
+import json
+import os
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+import numpy as np
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DIRECTORIO_RESULTADOS = os.path.join(RAIZ, 'benchmarks', 'resultados')
+
+# Rutas que se miden en cada escenario
+CONSULTAS = [
+    '/excel/negocio/datos?limite=10',
+    '/excel/negocio/datos?limite=100',
+    '/excel/negocio/datos?limite=1000',
+    '/excel/negocio/datos?limite=10000',
+    '/excel/negocio/datos?limite=10000&formato=ndjson',
+    '/excel/negocio/filtrar?columna=categoria_negocio&valor=FARMACIA&operador=prefijo',
+    '/excel/negocio/filtrar?columna=categoria_negocio&valor=PAPELERIA&operador=contiene',
+    '/excel/negocio/estadisticas',
+    '/excel/negocio/analizar?tipo_analisis=densidad',
+    '/oportunidades/centro?radio_km=0.5',
+    '/oportunidades/centro?radio_km=2',
+    '/oportunidades/centro?radio_km=5',
+    '/oportunidades/maneadero?radio_km=3',
+]
+
+# Regresión: cuánto puede empeorar p95 respecto a la corrida base
+TOLERANCIA_REGRESION = 0.20
+# ...y por cuántos milisegundos como mínimo (evita falsas alarmas por ruido)
+MINIMO_REGRESION_MS = 0.5
+
+
+def percentiles(tiempos):
+    tiempos_ms = np.asarray(tiempos) * 1000
+    return {
+        "p50_ms": round(float(np.percentile(tiempos_ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(tiempos_ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(tiempos_ms, 99)), 3),
+    }
+
+
+def datos_reales():
+    """Los registros que sirve la API: los del almacén columnar (ya limpios) o, si no
+    se ha construido, los del CSV"""
+    # pandas se importa aquí y no arriba: el trabajador no debe tenerlo
+    # cargado antes de importar la app (falsearía el arranque en frío)
+    import pandas as pd
+
+    sys.path.insert(0, RAIZ)
+    import almacen
+
+    df = almacen.cargar_datos(os.path.join(RAIZ, almacen.RUTA_CSV),
+                              os.path.join(RAIZ, almacen.DIRECTORIO_COLUMNAR))
+    return pd.DataFrame({
+        'categoria_negocio': df['categoria_negocio'].astype(object),
+        'latitud': df['latitud'].astype('float64'),
+        'longitud': df['longitud'].astype('float64'),
+    })
+
+
+def generar_datos(filas, directorio, semilla=0):
+    """Escribe en 'directorio' un datos_ensenada.csv de 'filas' filas (y su almacén columnar).
+
+    Las filas se remuestrean de los datos reales con un pequeño desplazamiento
+    aleatorio en las coordenadas, para conservar la distribución de la ciudad.
+    """
+    import almacen
+    import sinergias
+
+    reales = datos_reales()
+    if filas == len(reales):
+        df = reales
+    else:
+        generador = np.random.default_rng(semilla)
+        muestra = generador.integers(0, len(reales), filas)
+        df = reales.iloc[muestra].reset_index(drop=True)
+        df['latitud'] = df['latitud'] + generador.normal(0, 0.002, filas)
+        df['longitud'] = df['longitud'] + generador.normal(0, 0.002, filas)
+
+    df.to_csv(os.path.join(directorio, almacen.RUTA_CSV), index=False)
+    almacen.guardar_columnar(sinergias.clasificar(df),
+                             os.path.join(directorio, almacen.DIRECTORIO_COLUMNAR))
+
+
+def medir_test_client(app, repeticiones):
+    """Latencias de cada consulta usando el test client de Flask (sin red)"""
+    cliente = app.test_client()
+    resultados = []
+    for consulta in CONSULTAS:
+        respuesta = cliente.get(consulta)
+        respuesta.get_data()
+        tiempos = []
+        inicio_total = time.perf_counter()
+        for _ in range(repeticiones):
+            inicio = time.perf_counter()
+            respuesta = cliente.get(consulta)
+            respuesta.get_data()
+            tiempos.append(time.perf_counter() - inicio)
+        total = time.perf_counter() - inicio_total
+        resultados.append({
+            "consulta": consulta,
+            "estado": respuesta.status_code,
+            "bytes": len(respuesta.get_data()),
+            "peticiones_por_s": round(repeticiones / total, 1),
+            **percentiles(tiempos),
+        })
+    return resultados
+
+
+def trabajador(args):
+    """Proceso hijo: importa la app (arranque en frío), mide y escribe JSON en stdout"""
+    os.chdir(args.directorio)
+    sys.path.insert(0, RAIZ)
+    inicio = time.perf_counter()
+    spec = importlib.util.spec_from_file_location('app_bench', os.path.join(RAIZ, args.app))
+    modulo = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(modulo)
+    importacion = time.perf_counter() - inicio
+
+    # Arranque en frío hasta la primera respuesta (lo que ve Vercel en '/')
+    respuesta = modulo.app.test_client().get('/')
+    respuesta.get_data()
+    primera_respuesta = time.perf_counter() - inicio
+
+    resultados = medir_test_client(modulo.app, args.repeticiones)
+    maximo_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    json.dump({
+        "importacion_s": round(importacion, 4),
+        "primera_respuesta_s": round(primera_respuesta, 4),
+        "rss_maximo_mb": round(maximo_rss_kb / 1024, 1),
+        "consultas": resultados,
+    }, sys.stdout)
+
+
+def _entorno(con_cache):
+    entorno = dict(os.environ)
+    entorno['PYTHONPATH'] = RAIZ + os.pathsep + entorno.get('PYTHONPATH', '')
+    if not con_cache:
+        # Capacidad 0: cada petición recorre la ruta completa
+        entorno['CACHE_TAMANO'] = '0'
+    return entorno
+
+
+def correr_test_client(args, filas, directorio):
+    inicio = time.perf_counter()
+    salida = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--trabajador', '--directorio', directorio,
+         '--app', args.app, '--repeticiones', str(args.repeticiones)],
+        capture_output=True, text=True, env=_entorno(args.con_cache), check=True)
+    # La app puede imprimir mensajes al importarse; el JSON es la última línea
+    resultado = json.loads(salida.stdout.strip().splitlines()[-1])
+    resultado["proceso_total_s"] = round(time.perf_counter() - inicio, 3)
+    return resultado
+
+
+def _puerto_libre():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _pedir(url):
+    inicio = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url, timeout=60) as respuesta:
+            cuerpo = respuesta.read()
+            estado = respuesta.status
+    except urllib.error.HTTPError as e:
+        cuerpo, estado = e.read(), e.code
+    return time.perf_counter() - inicio, estado, len(cuerpo)
+
+
+def correr_gunicorn(args, filas, directorio):
+    """Levanta gunicorn con la app y la carga con peticiones concurrentes"""
+    puerto = _puerto_libre()
+    modulo = args.app[:-3].replace('/', '.').replace(os.sep, '.')
+    # api/main.py no es un paquete: se agrega su carpeta al path y se usa 'main'
+    if '.' in modulo:
+        carpeta, modulo = os.path.join(RAIZ, os.path.dirname(args.app)), modulo.rsplit('.', 1)[1]
+    else:
+        carpeta = RAIZ
+    entorno = _entorno(args.con_cache)
+    entorno['PYTHONPATH'] = carpeta + os.pathsep + entorno['PYTHONPATH']
+
+    inicio = time.perf_counter()
+    proceso = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-w', str(args.workers), '-b', f'127.0.0.1:{puerto}',
+         f'{modulo}:app'], cwd=directorio, env=entorno,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base = f'http://127.0.0.1:{puerto}'
+    try:
+        while True:
+            try:
+                _pedir(base + '/excel/negocio/estadisticas')
+                break
+            except OSError:
+                if proceso.poll() is not None or time.perf_counter() - inicio > 120:
+                    raise RuntimeError("gunicorn no arrancó")
+                time.sleep(0.05)
+        arranque = time.perf_counter() - inicio
+
+        resultados = []
+        with concurrent.futures.ThreadPoolExecutor(args.concurrencia) as pool:
+            for consulta in CONSULTAS:
+                urls = [base + consulta] * args.repeticiones
+                inicio_total = time.perf_counter()
+                respuestas = list(pool.map(_pedir, urls))
+                total = time.perf_counter() - inicio_total
+                resultados.append({
+                    "consulta": consulta,
+                    "estado": respuestas[-1][1],
+                    "bytes": respuestas[-1][2],
+                    "peticiones_por_s": round(len(urls) / total, 1),
+                    **percentiles([r[0] for r in respuestas]),
+                })
+
+        # RSS de los procesos de gunicorn (maestro + workers) desde /proc
+        rss_kb = 0
+        for pid in [proceso.pid] + _hijos(proceso.pid):
+            try:
+                with open(f'/proc/{pid}/status') as f:
+                    rss_kb += next(int(l.split()[1]) for l in f if l.startswith('VmHWM'))
+            except (OSError, StopIteration):
+                pass
+        return {
+            "arranque_s": round(arranque, 3),
+            "rss_maximo_mb": round(rss_kb / 1024, 1) if rss_kb else None,
+            "consultas": resultados,
+        }
+    finally:
+        proceso.terminate()
+        proceso.wait()
+
+
+def _hijos(pid):
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            return [int(p) for p in f.read().split()]
+    except OSError:
+        return []
+
+
+def comparar(actual, base):
+    """Lista de consultas cuyo p95 empeoró más que la tolerancia"""
+    anteriores = {(e['filas'], e['modo'], c['consulta']): c
+                  for e in base['escenarios'] for c in e['consultas']}
+    regresiones = []
+    for escenario in actual['escenarios']:
+        for consulta in escenario['consultas']:
+            previa = anteriores.get((escenario['filas'], escenario['modo'], consulta['consulta']))
+            if previa and previa['p95_ms'] > 0:
+                cambio = consulta['p95_ms'] / previa['p95_ms'] - 1
+                if (cambio > TOLERANCIA_REGRESION
+                        and consulta['p95_ms'] - previa['p95_ms'] > MINIMO_REGRESION_MS):
+                    regresiones.append({
+                        "filas": escenario['filas'],
+                        "consulta": consulta['consulta'],
+                        "p95_antes_ms": previa['p95_ms'],
+                        "p95_ahora_ms": consulta['p95_ms'],
+                        "cambio": round(cambio, 3),
+                    })
+    return regresiones
+
+
+def _commit_actual():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=RAIZ,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de la API de negocios")
+    parser.add_argument('--app', default='api.py', help="api.py o api/main.py")
+    parser.add_argument('--modo', choices=['test_client', 'gunicorn'], default='test_client')
+    parser.add_argument('--filas', type=int, nargs='+',
+                        help="tamaños del conjunto de datos (se generan a partir de los reales; "
+                             "por defecto los registros reales)")
+    parser.add_argument('--repeticiones', type=int, default=50)
+    parser.add_argument('--workers', type=int, default=2, help="workers de gunicorn")
+    parser.add_argument('--concurrencia', type=int, default=8, help="peticiones simultáneas (gunicorn)")
+    parser.add_argument('--con-cache', action='store_true', help="no desactivar la cache de respuestas")
+    parser.add_argument('--salida', help="archivo JSON de resultados")
+    parser.add_argument('--comparar', help="JSON de una corrida anterior para detectar regresiones")
+    parser.add_argument('--trabajador', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--directorio', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.trabajador:
+        trabajador(args)
+        return
+
+    escenarios = []
+    for filas in args.filas or [len(datos_reales())]:
+        directorio = tempfile.mkdtemp(prefix='bench_negocios_')
+        try:
+            print(f"--- {filas} filas ({args.modo}) ---", file=sys.stderr)
+            generar_datos(filas, directorio)
+            if args.modo == 'gunicorn':
+                resultado = correr_gunicorn(args, filas, directorio)
+            else:
+                resultado = correr_test_client(args, filas, directorio)
+        finally:
+            shutil.rmtree(directorio, ignore_errors=True)
+
+        for consulta in resultado['consultas']:
+            print(f"{consulta['consulta']:<90} {consulta['estado']}  p50 {consulta['p50_ms']:>9.3f} ms"
+                  f"  p95 {consulta['p95_ms']:>9.3f} ms  {consulta['peticiones_por_s']:>8.1f} req/s",
+                  file=sys.stderr)
+        escenarios.append({"filas": filas, "modo": args.modo, **resultado})
+
+    informe = {
+        "fecha": datetime.datetime.now().isoformat(timespec='seconds'),
+        "commit": _commit_actual(),
+        "app": args.app,
+        "repeticiones": args.repeticiones,
+        "con_cache": args.con_cache,
+        "escenarios": escenarios,
+    }
+
+    salida = args.salida
+    if not salida:
+        os.makedirs(DIRECTORIO_RESULTADOS, exist_ok=True)
+        marca = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+        salida = os.path.join(DIRECTORIO_RESULTADOS, f'{marca}-{informe["commit"] or "local"}.json')
+    with open(salida, 'w', encoding='utf-8') as f:
+        json.dump(informe, f, indent=2, ensure_ascii=False)
+    print(f"Resultados guardados en '{salida}'", file=sys.stderr)
+
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as f:
+            regresiones = comparar(informe, json.load(f))
+        for r in regresiones:
+            print(f"REGRESIÓN: {r['consulta']} ({r['filas']} filas) p95 "
+                  f"{r['p95_antes_ms']} -> {r['p95_ahora_ms']} ms", file=sys.stderr)
+        if regresiones:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
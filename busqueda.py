@@ -0,0 +1,201 @@
+import hashlib
+import os
+import re
+import unicodedata
+
+import numpy as np
+
+# Columnas con índice de búsqueda guardado junto al almacén columnar
+COLUMNAS_BUSQUEDA = ('categoria_negocio',)
+PLANTILLA_ARCHIVO = 'busqueda_{columna}.npz'
+
+# Similitud mínima (trigramas) para que una palabra cuente como parecida
+SIMILITUD_PALABRA = 0.4
+
+# Con al menos estas letras la última palabra también se busca como prefijo
+MINIMO_PREFIJO = 3
+
+# Tipos en disco -> en memoria. Los textos ya normalizados son ASCII (un byte
+# por letra en vez de cuatro) y los conteos caben en 8 o 16 bits; el archivo
+# además se comprime
+TIPOS_EN_DISCO = {
+    'vocabulario': ('S', str),
+    'trigramas': ('S', str),
+    'inicios': (np.uint32, np.int64),
+    'inicios_trigramas': (np.uint32, np.int64),
+    'nombres_de': (np.uint32, np.int32),
+    'palabras_de': (np.uint32, np.int32),
+    'palabras_por_nombre': (np.uint8, np.int32),
+    'trigramas_por_palabra': (np.uint8, np.int32),
+}
+
+_PALABRA = re.compile(r'[A-Z0-9]+')
+_ESPACIOS = re.compile(r'\s+')
+
+
+def normalizar(texto):
+    """Mayúsculas, sin acentos y sin espacios sobrantes (igual que sinergias.normalizar_nombres)"""
+    texto = unicodedata.normalize('NFKD', str(texto)).encode('ascii', errors='ignore').decode('ascii')
+    return _ESPACIOS.sub(' ', texto.upper()).strip()
+
+
+def palabras(texto):
+    return _PALABRA.findall(normalizar(texto))
+
+
+def trigramas(palabra):
+    # Con relleno, como pg_trgm: "  farmacia " da también los trigramas del inicio
+    relleno = f'  {palabra} '
+    return {relleno[i:i + 3] for i in range(len(relleno) - 2)}
+
+
+def huella_nombres(nombres):
+    huella = hashlib.blake2b(digest_size=8)
+    huella.update('\x00'.join(map(str, nombres)).encode('utf-8'))
+    return huella.hexdigest()
+
+
+def _invertido(claves, ids):
+    """Índice invertido en formato CSR: vocabulario ordenado, inicios y listas de ids"""
+    vocabulario, inverso = np.unique(np.asarray(claves, dtype=str), return_inverse=True)
+    orden = np.argsort(inverso.reshape(-1), kind='stable')
+    inicios = np.searchsorted(inverso.reshape(-1)[orden], np.arange(len(vocabulario) + 1))
+    return vocabulario, inicios.astype(np.int64), np.asarray(ids, dtype=np.int32)[orden]
+
+
+class IndiceBusqueda:
+    """Búsqueda difusa de nombres: índice invertido de palabras más trigramas.
+
+    Cada palabra de la consulta se compara por trigramas contra el
+    vocabulario (no contra cada nombre); el puntaje de un nombre es el
+    promedio, por palabra de la consulta, de su palabra más parecida.
+    """
+
+    def __init__(self, nombres):
+        nombres = list(nombres)
+        self.total = len(nombres)
+        self.huella = huella_nombres(nombres)
+
+        claves, ids = [], []
+        self.palabras_por_nombre = np.zeros(self.total, dtype=np.int32)
+        for i, nombre in enumerate(nombres):
+            unicas = set(palabras(nombre))
+            self.palabras_por_nombre[i] = len(unicas)
+            claves.extend(unicas)
+            ids.extend([i] * len(unicas))
+        self.vocabulario, self.inicios, self.nombres_de = _invertido(claves, ids)
+
+        claves, ids = [], []
+        self.trigramas_por_palabra = np.zeros(len(self.vocabulario), dtype=np.int32)
+        for j, palabra in enumerate(self.vocabulario.tolist()):
+            propios = trigramas(palabra)
+            self.trigramas_por_palabra[j] = len(propios)
+            claves.extend(propios)
+            ids.extend([j] * len(propios))
+        self.trigramas, self.inicios_trigramas, self.palabras_de = _invertido(claves, ids)
+
+    def __len__(self):
+        return self.total
+
+    def _lista(self, vocabulario, inicios, ids, clave):
+        i = np.searchsorted(vocabulario, clave)
+        if i < len(vocabulario) and vocabulario[i] == clave:
+            return ids[inicios[i]:inicios[i + 1]]
+        return ids[:0]
+
+    def palabras_parecidas(self, palabra, prefijo=False):
+        """Ids del vocabulario parecidos a 'palabra' y su similitud (Jaccard de trigramas)"""
+        propios = trigramas(palabra)
+        listas = [self._lista(self.trigramas, self.inicios_trigramas, self.palabras_de, t) for t in propios]
+        comunes = np.bincount(np.concatenate(listas), minlength=len(self.vocabulario)) if listas \
+            else np.zeros(len(self.vocabulario), dtype=np.int64)
+        similitud = comunes / (len(propios) + self.trigramas_por_palabra - comunes)
+
+        if prefijo and len(palabra) >= MINIMO_PREFIJO:
+            # Mientras se escribe: "FARMA" ya debe encontrar "FARMACIA"
+            inicio = np.searchsorted(self.vocabulario, palabra, side='left')
+            fin = np.searchsorted(self.vocabulario, palabra + '\x7f', side='left')
+            similitud[inicio:fin] = np.maximum(similitud[inicio:fin], 0.9)
+
+        ids = np.flatnonzero(similitud >= SIMILITUD_PALABRA)
+        return ids, similitud[ids]
+
+    def puntajes(self, consulta, todas=False):
+        """Puntaje (0 a 1) de cada nombre para la consulta.
+
+        Con 'todas' los nombres a los que les falta alguna palabra quedan en 0.
+        """
+        buscadas = palabras(consulta)
+        total = np.zeros(self.total)
+        completos = np.ones(self.total, dtype=bool)
+        for k, palabra in enumerate(buscadas):
+            ids, similitud = self.palabras_parecidas(palabra, prefijo=k == len(buscadas) - 1)
+            mejor = np.zeros(self.total)
+            for j, s in zip(ids.tolist(), similitud.tolist()):
+                nombres = self.nombres_de[self.inicios[j]:self.inicios[j + 1]]
+                mejor[nombres] = np.maximum(mejor[nombres], s)
+            total += mejor
+            completos &= mejor > 0
+        total /= max(len(buscadas), 1)
+        if todas:
+            total[~completos] = 0
+        return total
+
+    def buscar(self, consulta, k=10, minimo=0.3, todas=False):
+        """Los k nombres con mayor puntaje (ids y puntajes, de mayor a menor)"""
+        puntajes = self.puntajes(consulta, todas)
+        candidatos = np.flatnonzero(puntajes >= minimo)
+        if k is not None and len(candidatos) > k:
+            candidatos = candidatos[np.argpartition(-puntajes[candidatos], k - 1)[:k]]
+        # Empates: primero los nombres más cortos (menos palabras sobrantes)
+        orden = np.lexsort((self.palabras_por_nombre[candidatos], -puntajes[candidatos]))
+        candidatos = candidatos[orden]
+        return candidatos, puntajes[candidatos]
+
+    def guardar(self, ruta):
+        temporal = ruta + '.tmp.npz'
+        arreglos = {}
+        for clave, (en_disco, _) in TIPOS_EN_DISCO.items():
+            arreglo = getattr(self, clave)
+            if arreglo.dtype.kind in 'iu' and len(arreglo) and arreglo.max() > np.iinfo(en_disco).max:
+                en_disco = arreglo.dtype
+            arreglos[clave] = arreglo.astype(en_disco)
+        np.savez_compressed(temporal, huella=np.array(self.huella), total=np.array(self.total), **arreglos)
+        os.replace(temporal, ruta)
+
+    @classmethod
+    def cargar(cls, ruta):
+        with np.load(ruta) as datos:
+            indice = cls.__new__(cls)
+            for clave in datos.files:
+                indice.__dict__[clave] = datos[clave]
+        for clave, (_, en_memoria) in TIPOS_EN_DISCO.items():
+            indice.__dict__[clave] = indice.__dict__[clave].astype(en_memoria)
+        indice.huella = str(indice.huella)
+        indice.total = int(indice.total)
+        return indice
+
+
+def ruta_indice(directorio, columna):
+    return os.path.join(directorio, PLANTILLA_ARCHIVO.format(columna=columna))
+
+
+def cargar_indices(directorio):
+    """Índices guardados con el almacén (columna -> IndiceBusqueda); los que falten se omiten.
+
+    Quien los use debe comparar su huella con la de sus nombres.
+    """
+    indices = {}
+    for columna in COLUMNAS_BUSQUEDA:
+        try:
+            indices[columna] = IndiceBusqueda.cargar(ruta_indice(directorio, columna))
+        except (OSError, KeyError, ValueError):
+            pass
+    return indices
+
+
+def guardar_indices(motor, directorio):
+    """Construye (si hace falta) y guarda los índices de búsqueda de un MotorFiltros"""
+    for columna in COLUMNAS_BUSQUEDA:
+        if columna in motor.df.columns:
+            motor.indice(columna).busqueda.guardar(ruta_indice(directorio, columna))
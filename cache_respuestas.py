@@ -0,0 +1,162 @@
+import functools
+import hashlib
+import itertools
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask import Response, make_response, request
+
+# Filas que puede tener el respaldo SQLite: las claves incluyen la versión de
+# los datos, así que cada cambio deja atrás entradas que ya nadie pide
+MAXIMO_FILAS_SQLITE = int(os.environ.get('CACHE_SQLITE_FILAS', 10_000))
+
+# Cada cuántas escrituras (por proceso) se purgan las filas vencidas y las que sobran
+ESCRITURAS_POR_PURGA = 100
+
+
+class RespaldoSQLite:
+    """Almacén compartido entre workers (un archivo SQLite en disco local)"""
+
+    def __init__(self, ruta, maximo_filas=MAXIMO_FILAS_SQLITE):
+        self.ruta = ruta
+        self.maximo_filas = maximo_filas
+        self.local = threading.local()
+        self._escrituras = itertools.count(1)
+        with self._conexion() as conexion:
+            conexion.execute("CREATE TABLE IF NOT EXISTS respuestas ("
+                             "clave TEXT PRIMARY KEY, expira REAL, estado INTEGER, "
+                             "tipo TEXT, etag TEXT, cuerpo BLOB)")
+            conexion.execute("CREATE INDEX IF NOT EXISTS respuestas_expira ON respuestas (expira)")
+            self._purgar(conexion)
+
+    def _conexion(self):
+        # sqlite3 no permite compartir conexiones entre hilos
+        if getattr(self.local, 'conexion', None) is None:
+            self.local.conexion = sqlite3.connect(self.ruta, timeout=1)
+        return self.local.conexion
+
+    def obtener(self, clave):
+        fila = self._conexion().execute(
+            "SELECT expira, estado, tipo, etag, cuerpo FROM respuestas WHERE clave = ?",
+            (clave,)).fetchone()
+        if fila is None or fila[0] < time.time():
+            return None
+        return fila[1:]
+
+    def guardar(self, clave, entrada, ttl):
+        with self._conexion() as conexion:
+            conexion.execute("INSERT OR REPLACE INTO respuestas VALUES (?, ?, ?, ?, ?, ?)",
+                             (clave, time.time() + ttl) + tuple(entrada))
+            if next(self._escrituras) % ESCRITURAS_POR_PURGA == 0:
+                self._purgar(conexion)
+
+    def _purgar(self, conexion):
+        # Vencidas (incluye las de versiones de datos anteriores) y, si aún
+        # sobran, las que vencen antes
+        conexion.execute("DELETE FROM respuestas WHERE expira < ?", (time.time(),))
+        conexion.execute("DELETE FROM respuestas WHERE clave IN (SELECT clave FROM respuestas "
+                         "ORDER BY expira DESC LIMIT -1 OFFSET ?)", (self.maximo_filas,))
+
+
+class CacheRespuestas:
+    """Cache LRU con expiración (TTL) para respuestas completas de la API"""
+
+    def __init__(self, capacidad=256, ttl=300, respaldo=None):
+        self.capacidad = capacidad
+        self.ttl = ttl
+        self.respaldo = respaldo
+        self.entradas = OrderedDict()
+        self.candado = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+
+    def obtener(self, clave):
+        with self.candado:
+            entrada = self.entradas.get(clave)
+            if entrada is not None:
+                expira, datos = entrada
+                if expira >= time.time():
+                    self.entradas.move_to_end(clave)
+                    self.aciertos += 1
+                    return datos
+                del self.entradas[clave]
+
+        datos = self.respaldo.obtener(clave) if self.respaldo else None
+        with self.candado:
+            if datos is None:
+                self.fallos += 1
+            else:
+                self.aciertos += 1
+                self._guardar_local(clave, datos)
+        return datos
+
+    def guardar(self, clave, datos):
+        with self.candado:
+            self._guardar_local(clave, datos)
+        if self.respaldo:
+            self.respaldo.guardar(clave, datos, self.ttl)
+
+    def _guardar_local(self, clave, datos):
+        self.entradas[clave] = (time.time() + self.ttl, datos)
+        self.entradas.move_to_end(clave)
+        while len(self.entradas) > self.capacidad:
+            self.entradas.popitem(last=False)
+
+    def limpiar(self):
+        with self.candado:
+            self.entradas.clear()
+
+
+def crear_cache():
+    """Cache configurada por variables de entorno (CACHE_TAMANO, CACHE_TTL, CACHE_SQLITE, CACHE_SQLITE_FILAS)"""
+    ruta_sqlite = os.environ.get('CACHE_SQLITE')
+    return CacheRespuestas(
+        capacidad=int(os.environ.get('CACHE_TAMANO', 256)),
+        ttl=float(os.environ.get('CACHE_TTL', 300)),
+        respaldo=RespaldoSQLite(ruta_sqlite) if ruta_sqlite else None
+    )
+
+
+def _clave(version):
+    # Ruta + parámetros ordenados (el orden en la URL no importa) + versión de datos,
+    # más Accept: el formato de la respuesta se puede negociar con esa cabecera
+    parametros = '&'.join(f'{k}={v}' for k, v in sorted(request.args.items(multi=True)))
+    return f'{version}|{request.path}|{parametros}|{request.headers.get("Accept", "")}'
+
+
+def _responder(estado, tipo, etag, cuerpo):
+    # Comparación débil: la ETag de una respuesta comprimida se envía como W/"..."
+    if request.if_none_match.contains_weak(etag):
+        return Response(status=304, headers={'ETag': f'"{etag}"'})
+    respuesta = Response(cuerpo, status=estado, mimetype=tipo)
+    respuesta.set_etag(etag)
+    return respuesta
+
+
+def cacheada(cache, version):
+    """Decorador de rutas: sirve desde la cache y contesta 304 con If-None-Match.
+
+    'version' es una función que devuelve la versión actual de los datos.
+    Solo se guardan respuestas 200.
+    """
+    def decorador(vista):
+        @functools.wraps(vista)
+        def envoltura(*args, **kwargs):
+            clave = _clave(version())
+            entrada = cache.obtener(clave)
+            if entrada is not None:
+                return _responder(*entrada)
+
+            respuesta = make_response(vista(*args, **kwargs))
+            if respuesta.status_code != 200 or respuesta.is_streamed:
+                return respuesta
+            cuerpo = respuesta.get_data()
+            etag = hashlib.blake2b(cuerpo, digest_size=12).hexdigest()
+            entrada = (respuesta.status_code, respuesta.mimetype, etag, cuerpo)
+            cache.guardar(clave, entrada)
+            return _responder(*entrada)
+        return envoltura
+    return decorador
@@ -0,0 +1,582 @@
+import contextlib
+import json
+import math
+import os
+import threading
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: sin bloqueo entre procesos (basta el candado entre hilos)
+    fcntl = None
+
+import agregados
+import almacen
+import busqueda
+import metricas
+import sinergias
+from indice_espacial import IndiceEspacial
+from motor_filtros import MotorFiltros
+from zonas import ZONAS_CONOCIDAS
+
+# Columnas que se pueden modificar con PUT
+COLUMNAS_EDITABLES = ('categoria_negocio', 'latitud', 'longitud')
+
+# Cambios acumulados en el registro antes de volcarlos al almacén columnar
+COMPACTAR_CADA = 500
+
+ARCHIVO_CAMBIOS = 'cambios.wal'
+
+# Recarga en caliente: cada cuánto se revisa si el almacén columnar se regeneró (0 = nunca)
+REVISAR_ALMACEN_CADA_S = float(os.environ.get('REVISAR_ALMACEN_CADA_S', 2))
+# Un almacén recién escrito se deja asentar antes de cargarlo (el exportador
+# todavía borra el registro y guarda índices y agregados)
+ESPERA_RECARGA_S = 2.0
+# Si cambia más que esta fracción de filas se reconstruyen todos los índices
+LIMITE_RECARGA_INCREMENTAL = 0.2
+# Margen (grados, ~25 km) alrededor de los límites de la región en el que se
+# aceptan coordenadas nuevas; los límites son percentiles y dejan fuera negocios reales
+MARGEN_LIMITES_GRADOS = 0.25
+# Clave estable de una fila (no hay id del DENUE): nombre y coordenadas con estos decimales (~1 m)
+COLUMNAS_CLAVE = ('categoria_negocio', 'latitud', 'longitud')
+DECIMALES_CLAVE = 5
+
+
+def ruta_cambios(directorio=almacen.DIRECTORIO_COLUMNAR):
+    """El registro de cambios vive junto al almacén columnar (o junto al CSV si no existe)"""
+    if os.environ.get('RUTA_CAMBIOS'):
+        return os.environ['RUTA_CAMBIOS']
+    if os.path.isdir(directorio):
+        return os.path.join(directorio, ARCHIVO_CAMBIOS)
+    return os.path.splitext(almacen.RUTA_CSV)[0] + '.' + ARCHIVO_CAMBIOS
+
+
+def descartar_cambios(directorio=almacen.DIRECTORIO_COLUMNAR):
+    """Borra el registro de cambios (al regenerar el almacén desde el CSV)"""
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(ruta_cambios(directorio))
+
+
+def limites_de(df, limites=None):
+    """[lat_min, lon_min, lat_max, lon_max] aceptados para coordenadas nuevas.
+
+    Los límites dados (los de la región) o, si no hay, la extensión de los
+    datos, más MARGEN_LIMITES_GRADOS. None si no hay coordenadas.
+    """
+    if limites is None:
+        if not {'latitud', 'longitud'} <= set(df.columns) or not len(df):
+            return None
+        lats = df['latitud'].to_numpy(dtype=np.float64)
+        lons = df['longitud'].to_numpy(dtype=np.float64)
+        if not (np.isfinite(lats).any() and np.isfinite(lons).any()):
+            return None
+        limites = [np.nanmin(lats), np.nanmin(lons), np.nanmax(lats), np.nanmax(lons)]
+    margen = MARGEN_LIMITES_GRADOS
+    return [float(limites[0]) - margen, float(limites[1]) - margen,
+            float(limites[2]) + margen, float(limites[3]) + margen]
+
+
+def nueva_generacion(secuencia):
+    """(generación, línea de cabecera) de un registro nuevo que parte de 'secuencia'"""
+    generacion = uuid.uuid4().hex
+    cabecera = json.dumps({"generacion": generacion, "secuencia": secuencia}) + '\n'
+    return generacion, cabecera.encode('utf-8')
+
+
+def generacion_de(cabecera):
+    """Generación de la primera línea del registro (None si es un registro sin cabecera)"""
+    try:
+        return json.loads(cabecera).get('generacion')
+    except (ValueError, AttributeError):
+        return None
+
+
+def diferencias(anterior, nuevo):
+    """Posiciones de las filas que cambiaron entre dos versiones de la tabla, por columna.
+
+    Devuelve {columna: posiciones} (solo las columnas con cambios), o None si
+    las tablas no se pueden comparar fila a fila (otras columnas u otro número
+    de filas). Las categóricas se comparan por valor aunque cambie el diccionario.
+    """
+    if len(anterior) != len(nuevo) or list(anterior.columns) != list(nuevo.columns):
+        return None
+    cambios = {}
+    for columna in nuevo.columns:
+        serie_anterior, serie_nueva = anterior[columna], nuevo[columna]
+        if (isinstance(serie_anterior.dtype, pd.CategoricalDtype)
+                and isinstance(serie_nueva.dtype, pd.CategoricalDtype)):
+            # Códigos anteriores traducidos al diccionario nuevo; -2 = valor que ya no existe
+            traduccion = serie_nueva.cat.categories.get_indexer(serie_anterior.cat.categories)
+            traduccion = np.append(np.where(traduccion < 0, -2, traduccion), -1)
+            distintas = traduccion[serie_anterior.array.codes] != serie_nueva.array.codes
+        elif serie_anterior.dtype.kind in 'fiub' and serie_nueva.dtype.kind in 'fiub':
+            valores_anteriores, valores_nuevos = serie_anterior.to_numpy(), serie_nueva.to_numpy()
+            distintas = valores_anteriores != valores_nuevos
+            if 'f' in (valores_anteriores.dtype.kind, valores_nuevos.dtype.kind):
+                distintas &= ~(pd.isna(valores_anteriores) & pd.isna(valores_nuevos))
+        else:
+            iguales = serie_anterior.astype(object).eq(serie_nueva.astype(object))
+            distintas = ~(iguales | (serie_anterior.isna() & serie_nueva.isna())).to_numpy()
+        posiciones = np.flatnonzero(distintas)
+        if len(posiciones):
+            cambios[columna] = posiciones
+    return cambios
+
+
+def emparejar(anterior, nuevo):
+    """Filas que siguen en ambas tablas aunque cambien de posición: (posiciones anteriores, nuevas).
+
+    Se emparejan por clave estable (COLUMNAS_CLAVE, coordenadas redondeadas);
+    las repetidas en el mismo punto, en orden de aparición. Lo no emparejado
+    son filas eliminadas o insertadas. None si falta alguna columna de la clave.
+    """
+    if not all(c in anterior.columns and c in nuevo.columns for c in COLUMNAS_CLAVE):
+        return None
+    claves = []
+    for df in (anterior, nuevo):
+        clave = pd.DataFrame({
+            "nombre": df['categoria_negocio'].astype(object).fillna('').to_numpy(),
+            "lat": np.round(df['latitud'].to_numpy(dtype=np.float64), DECIMALES_CLAVE),
+            "lon": np.round(df['longitud'].to_numpy(dtype=np.float64), DECIMALES_CLAVE),
+        })
+        clave["ocurrencia"] = clave.groupby(["nombre", "lat", "lon"], dropna=False).cumcount()
+        clave["posicion"] = np.arange(len(df))
+        claves.append(clave)
+    pares = claves[0].merge(claves[1], on=["nombre", "lat", "lon", "ocurrencia"],
+                            suffixes=("_anterior", "_nueva"))
+    return pares["posicion_anterior"].to_numpy(), pares["posicion_nueva"].to_numpy()
+
+
+class Instantanea:
+    """Versión inmutable de los datos con sus índices.
+
+    Cada petición toma una y trabaja solo con ella; las escrituras crean
+    una nueva en lugar de modificar esta.
+    """
+
+    def __init__(self, df, indice, motor, agregados, version, secuencia):
+        self.df = df
+        self.indice = indice
+        self.motor = motor
+        self.agregados = agregados
+        self.version = version
+        self.secuencia = secuencia
+
+
+class DatosVivos:
+    """Datos que aceptan actualizaciones mediante un registro de cambios (WAL).
+
+    Cada cambio se agrega al registro (una línea JSON con número de
+    secuencia) antes de aplicarse; otros procesos lo leen y aplican al
+    pedir su instantánea. Cada COMPACTAR_CADA cambios el registro se vuelca
+    al almacén columnar y se reemplaza por uno nuevo. La primera línea de
+    cada registro es su generación: así un lector nota que lo reemplazaron
+    aunque el nuevo ya haya crecido más allá de su posición.
+    """
+
+    def __init__(self, df, directorio=almacen.DIRECTORIO_COLUMNAR, ruta=None, secuencia=0,
+                 zonas=ZONAS_CONOCIDAS, limites=None):
+        self.directorio = directorio
+        self.zonas = zonas
+        # Coordenadas aceptadas en los cambios: los límites de la región (o la
+        # extensión de los datos) más MARGEN_LIMITES_GRADOS
+        self.limites = limites_de(df, limites)
+        self.ruta = ruta or ruta_cambios(directorio)
+        self._candado = threading.Lock()
+        # Registro que se está leyendo (generación e inodo) y hasta dónde
+        self._generacion = None
+        self._inodo = None
+        self._posicion = 0
+        self._pendientes = 0
+        # Recarga en caliente: marca del almacén de los datos actuales y resumen de la última
+        self._marca = almacen.marca_columnar(directorio)
+        self._candado_recarga = threading.Lock()
+        self._proxima_revision = time.monotonic() + REVISAR_ALMACEN_CADA_S
+        self.ultima_recarga = None
+        self._iniciar(df, secuencia)
+        self.sincronizar()
+
+    @classmethod
+    def desde_disco(cls, ruta_csv=almacen.RUTA_CSV, directorio=almacen.DIRECTORIO_COLUMNAR, ruta=None,
+                    zonas=ZONAS_CONOCIDAS, limites=None):
+        """Carga el almacén (o el CSV) y aplica los cambios pendientes del registro"""
+        secuencia = 0
+        if almacen.existe_columnar(directorio):
+            secuencia = almacen.leer_meta(directorio).get('secuencia', 0)
+        with metricas.etapa('carga_datos'):
+            df = almacen.cargar_datos(ruta_csv, directorio)
+        return cls(df, directorio, ruta, secuencia=secuencia, zonas=zonas, limites=limites)
+
+    def _iniciar(self, df, secuencia):
+        self.actual = self._construir(df, secuencia)
+        self._version_base = self.actual.version
+
+    def _construir(self, df, secuencia):
+        """Instantánea de 'df' con todos sus índices construidos desde cero"""
+        indice = agregados_zonas = None
+        if {'latitud', 'longitud'} <= set(df.columns):
+            with metricas.etapa('indice_espacial'):
+                indice = IndiceEspacial(df['latitud'].to_numpy(), df['longitud'].to_numpy())
+        if 'categoria_negocio' in df.columns:
+            with metricas.etapa('sinergias'):
+                df = sinergias.clasificar(df)
+
+        version = almacen.version_datos(df)
+        if indice is not None and 'sinergia' in df.columns:
+            with metricas.etapa('agregados'):
+                agregados_zonas = agregados.preparar(df, indice, agregados.ruta_agregados(self.directorio),
+                                                     version=version, zonas=self.zonas)
+
+        # Índice de búsqueda de nombres: el guardado con el almacén, o se construye aquí
+        with metricas.etapa('indice_busqueda'):
+            motor = MotorFiltros(df, busqueda.cargar_indices(self.directorio))
+            for columna in busqueda.COLUMNAS_BUSQUEDA:
+                if columna in df.columns:
+                    motor.indice(columna).busqueda
+        return Instantanea(df, indice, motor, agregados_zonas, version, secuencia)
+
+    def _derivar(self, previa, df, cambiadas, movidas, version, secuencia):
+        """Instantánea de 'df' que reutiliza los índices de 'previa'; solo se tocan las filas cambiadas"""
+        indice = previa.indice
+        if indice is not None and len(movidas):
+            indice = indice.actualizar(movidas, df['latitud'].to_numpy()[movidas],
+                                       df['longitud'].to_numpy()[movidas])
+        agregados_zonas = previa.agregados
+        if agregados_zonas is not None:
+            agregados_zonas, _ = agregados.refrescar(agregados_zonas, df, indice, self.zonas, version)
+        return Instantanea(df, indice, previa.motor.con_cambios(df, cambiadas),
+                           agregados_zonas, version, secuencia)
+
+    def _renumerada(self, previa, df, secuencia):
+        """Instantánea de 'df' cuando se insertaron o eliminaron filas de 'previa'.
+
+        Las posiciones cambian, así que el índice espacial (barato) y los de
+        filtros se arman de nuevo, con la búsqueda difusa guardada con el
+        almacén; los agregados en memoria solo se recalculan en las zonas
+        cuyas filas cambiaron.
+        """
+        version = almacen.version_datos(df)
+        indice = IndiceEspacial(df['latitud'].to_numpy(), df['longitud'].to_numpy())
+        motor = MotorFiltros(df, busqueda.cargar_indices(self.directorio))
+        for columna in busqueda.COLUMNAS_BUSQUEDA:
+            if columna in df.columns:
+                motor.indice(columna).busqueda
+        agregados_zonas = previa.agregados
+        if agregados_zonas is not None:
+            agregados_zonas, _ = agregados.refrescar(agregados_zonas, df, indice, self.zonas, version)
+        return Instantanea(df, indice, motor, agregados_zonas, version, secuencia)
+
+    def instantanea(self):
+        """Versión más reciente, incluidos los cambios escritos por otros procesos"""
+        return self.sincronizar()
+
+    def sincronizar(self):
+        self._revisar_almacen()
+        # Sin cambios nuevos en el registro no hace falta ningún candado
+        try:
+            estado = os.stat(self.ruta)
+            inodo, tamano = estado.st_ino, estado.st_size
+        except OSError:
+            inodo, tamano = None, 0
+        if tamano != self._posicion or (tamano and inodo != self._inodo):
+            with self._candado, self._bloqueo(compartido=True):
+                self._leer_nuevos()
+        return self.actual
+
+    @contextlib.contextmanager
+    def _bloqueo(self, compartido=False):
+        """Candado entre procesos sobre un archivo .lock junto al registro"""
+        try:
+            archivo = open(self.ruta + '.lock', 'a')
+        except OSError:
+            # Sistema de archivos de solo lectura: nadie puede escribir cambios
+            yield
+            return
+        with archivo:
+            if fcntl is not None:
+                fcntl.flock(archivo, fcntl.LOCK_SH if compartido else fcntl.LOCK_EX)
+            yield
+
+    def _leer_nuevos(self):
+        try:
+            f = open(self.ruta, 'rb')
+        except OSError:
+            self._generacion, self._inodo, self._posicion = None, None, 0
+            return
+        with f:
+            cabecera = f.readline()
+            if not cabecera.endswith(b'\n'):
+                # Registro vacío o con la primera escritura a medias: se empieza desde cero
+                self._generacion, self._inodo, self._posicion = None, None, 0
+                return
+            generacion = generacion_de(cabecera)
+            if generacion != self._generacion:
+                # Otro proceso compactó (registro nuevo): lo que no alcanzamos a leer ya está en el almacén
+                self._generacion = generacion
+                self._posicion = len(cabecera) if generacion is not None else 0
+                if almacen.existe_columnar(self.directorio):
+                    marca = almacen.marca_columnar(self.directorio)
+                    secuencia = almacen.leer_meta(self.directorio).get('secuencia', 0)
+                    if secuencia > self.actual.secuencia:
+                        self._iniciar(almacen.cargar_columnar(self.directorio), secuencia)
+                        self._marca = marca
+            self._inodo = os.fstat(f.fileno()).st_ino
+            f.seek(self._posicion)
+            nuevos = f.read()
+        # Solo líneas completas (una escritura interrumpida deja la última a medias)
+        completos = nuevos.rfind(b'\n') + 1
+        self._posicion += completos
+        entradas = [json.loads(linea) for linea in nuevos[:completos].splitlines() if linea.strip()]
+        entradas = [e for e in entradas if e['n'] > self.actual.secuencia]
+        if entradas:
+            with metricas.etapa('aplicar_cambios'):
+                self._aplicar(entradas)
+
+    def _validar(self, cambio):
+        df = self.actual.df
+        cambio = dict(cambio)
+        if 'id' not in cambio:
+            raise ValueError("Cada cambio necesita un 'id'")
+        id = int(cambio.pop('id'))
+        if id < 0 or id >= len(df):
+            raise IndexError(f"Registro {id} no encontrado")
+        if not cambio:
+            raise ValueError(f"El cambio del registro {id} no tiene columnas")
+        editables = [c for c in COLUMNAS_EDITABLES if c in df.columns]
+        otras = sorted(set(cambio) - set(editables))
+        if otras:
+            raise ValueError(f"Columnas no editables: {otras} (editables: {editables})")
+        for columna, valor in cambio.items():
+            if valor is not None and pd.api.types.is_numeric_dtype(df[columna]):
+                try:
+                    valor = float(valor)
+                except (TypeError, ValueError):
+                    raise ValueError(f"'{columna}' del registro {id} debe ser un número")
+                if not math.isfinite(valor):
+                    raise ValueError(f"'{columna}' del registro {id} debe ser un número finito")
+                cambio[columna] = valor
+        rangos = {'latitud': (0, 2), 'longitud': (1, 3)}
+        for columna, (minimo, maximo) in rangos.items():
+            valor = cambio.get(columna)
+            if valor is not None and self.limites is not None and not (
+                    self.limites[minimo] <= valor <= self.limites[maximo]):
+                raise ValueError(f"'{columna}' del registro {id} fuera de la región "
+                                 f"({self.limites[minimo]:.4f} a {self.limites[maximo]:.4f})")
+        return {"id": id, "cambios": cambio}
+
+    def actualizar(self, cambios):
+        """Registra y aplica una lista de cambios [{"id": ..., columna: valor}].
+
+        Devuelve la instantánea que ya los incluye. Los lectores que tenían
+        la anterior la siguen usando sin esperar.
+        """
+        with self._candado, self._bloqueo():
+            self._leer_nuevos()
+            entradas = [self._validar(cambio) for cambio in cambios]
+            if not entradas:
+                raise ValueError("No hay cambios que aplicar")
+            for n, entrada in enumerate(entradas, start=self.actual.secuencia + 1):
+                entrada['n'] = n
+
+            bloque = ''.join(json.dumps(e, ensure_ascii=False) + '\n' for e in entradas).encode('utf-8')
+            with open(self.ruta, 'ab') as f:
+                # Descarta una línea a medias de una escritura interrumpida
+                f.truncate(self._posicion)
+                if self._posicion == 0:
+                    # Registro nuevo: empieza con su generación
+                    self._generacion, cabecera = nueva_generacion(self.actual.secuencia)
+                    bloque = cabecera + bloque
+                f.write(bloque)
+                f.flush()
+                os.fsync(f.fileno())
+                self._inodo = os.fstat(f.fileno()).st_ino
+                self._posicion = f.tell()
+
+            with metricas.etapa('aplicar_cambios'):
+                self._aplicar(entradas)
+            self._pendientes += len(entradas)
+            if self._pendientes >= COMPACTAR_CADA:
+                self._pendientes = 0
+                threading.Thread(target=self._compactar_en_segundo_plano, daemon=True).start()
+        return self.actual
+
+    def _aplicar(self, entradas):
+        """Nueva instantánea con las entradas aplicadas (copia solo las columnas cambiadas)"""
+        previa = self.actual
+        df = previa.df
+
+        # El último cambio de cada (columna, fila) es el que queda
+        por_columna = {}
+        for entrada in entradas:
+            for columna, valor in entrada['cambios'].items():
+                por_columna.setdefault(columna, {})[entrada['id']] = valor
+
+        columnas = {}
+        for columna, valores in por_columna.items():
+            posiciones = np.fromiter(valores, dtype=np.int64, count=len(valores))
+            nuevos = list(valores.values())
+            serie = df[columna]
+            if isinstance(serie.dtype, pd.CategoricalDtype):
+                categorias = serie.cat.categories
+                faltantes = list(dict.fromkeys(v for v in nuevos if v is not None and v not in categorias))
+                tipo = pd.CategoricalDtype(list(categorias) + faltantes) if faltantes else serie.dtype
+                codigos = serie.cat.codes.to_numpy().astype(np.int32)
+                codigos[posiciones] = tipo.categories.get_indexer(nuevos)
+                columnas[columna] = pd.Categorical.from_codes(codigos, dtype=tipo)
+            else:
+                arreglo = serie.to_numpy().copy()
+                if arreglo.dtype.kind == 'f':
+                    nuevos = [np.nan if v is None else v for v in nuevos]
+                arreglo[posiciones] = nuevos
+                columnas[columna] = arreglo
+
+        # Solo se reclasifican los nombres que cambiaron
+        if 'categoria_negocio' in por_columna and 'sinergia' in df.columns:
+            posiciones = np.fromiter(por_columna['categoria_negocio'], dtype=np.int64)
+            nombres = pd.Series(columnas['categoria_negocio']).iloc[posiciones].astype(object)
+            sinergia, rol = sinergias.clasificar_nombres(nombres.where(nombres.notna(), '').to_numpy())
+            for columna, codigos_nuevos in (('sinergia', sinergia), ('rol_sinergia', rol)):
+                codigos = df[columna].cat.codes.to_numpy().copy()
+                codigos[posiciones] = codigos_nuevos
+                columnas[columna] = pd.Categorical.from_codes(codigos, dtype=df[columna].dtype)
+
+        nuevo_df = pd.DataFrame({c: columnas[c] if c in columnas else df[c].values for c in df.columns},
+                                copy=False)
+        cambiadas = np.unique(np.fromiter((e['id'] for e in entradas), dtype=np.int64))
+        movidas = np.union1d(np.fromiter(por_columna.get('latitud', {}), dtype=np.int64),
+                             np.fromiter(por_columna.get('longitud', {}), dtype=np.int64))
+
+        secuencia = entradas[-1]['n']
+        # Publicar la nueva versión es una sola asignación
+        self.actual = self._derivar(previa, nuevo_df, cambiadas, movidas,
+                                    f"{self._version_base}-{secuencia}", secuencia)
+
+    def compactar(self):
+        """Vuelca la versión actual al almacén columnar y vacía el registro"""
+        if not almacen.existe_columnar(self.directorio):
+            return False
+        with self._candado, self._bloqueo():
+            self._leer_nuevos()
+            actual = self.actual
+            almacen.guardar_columnar(actual.df, self.directorio, secuencia=actual.secuencia)
+            self._version_base = almacen.version_datos(actual.df)
+            agregados_zonas = actual.agregados
+            if agregados_zonas is not None:
+                agregados_zonas = dict(agregados_zonas, version=self._version_base)
+                agregados.guardar(agregados_zonas, agregados.ruta_agregados(self.directorio))
+            # Los índices de filtros se reconstruyen sobre la versión compactada
+            motor = MotorFiltros(actual.df)
+            busqueda.guardar_indices(motor, self.directorio)
+            self._nuevo_registro(actual.secuencia)
+            # El almacén reescrito ya son estos datos: no hay que recargarlo
+            self._marca = almacen.marca_columnar(self.directorio)
+            self.actual = Instantanea(actual.df, actual.indice, motor,
+                                      agregados_zonas, self._version_base, actual.secuencia)
+        return True
+
+    def _nuevo_registro(self, secuencia):
+        # Reemplaza el registro por uno vacío de otra generación (otro inodo, escrito de una vez)
+        self._generacion, cabecera = nueva_generacion(secuencia)
+        temporal = f'{self.ruta}.{os.getpid()}.tmp'
+        with open(temporal, 'wb') as f:
+            f.write(cabecera)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporal, self.ruta)
+        self._inodo = os.stat(self.ruta).st_ino
+        self._posicion = len(cabecera)
+
+    def _compactar_en_segundo_plano(self):
+        try:
+            self.compactar()
+        except OSError:
+            # Se reintenta tras los siguientes COMPACTAR_CADA cambios
+            pass
+
+    def _revisar_almacen(self):
+        # Como mucho cada REVISAR_ALMACEN_CADA_S (un stat); la recarga corre en otro hilo
+        if REVISAR_ALMACEN_CADA_S <= 0 or time.monotonic() < self._proxima_revision:
+            return
+        self._proxima_revision = time.monotonic() + REVISAR_ALMACEN_CADA_S
+        marca = almacen.marca_columnar(self.directorio)
+        if marca is None or marca == self._marca or time.time() - marca / 1e9 < ESPERA_RECARGA_S:
+            return
+        if self._candado_recarga.acquire(blocking=False):
+            threading.Thread(target=self._recargar_en_segundo_plano, daemon=True).start()
+
+    def _recargar_en_segundo_plano(self):
+        try:
+            self.recargar()
+        except Exception as e:
+            # Almacén ilegible: se reintenta cuando se vuelva a escribir
+            self._marca = almacen.marca_columnar(self.directorio)
+            self.ultima_recarga = {"error": str(e)}
+        finally:
+            self._candado_recarga.release()
+
+    def recargar(self):
+        """Carga el almacén columnar regenerado y publica su instantánea.
+
+        La tabla se compara fila a fila con la vigente: si cambió poco, el
+        índice espacial, los filtros y los agregados se actualizan solo en las
+        filas cambiadas. Si se insertaron o eliminaron filas, se emparejan por
+        clave estable (emparejar): si son pocas, solo se recalculan los
+        agregados de las zonas tocadas. Si no, o si cambiaron las columnas, se
+        construye todo de nuevo. Todo ocurre sin bloquear a los lectores, que
+        siguen con su instantánea; la nueva se publica con una sola asignación.
+        Devuelve un resumen de la recarga.
+        """
+        inicio = time.perf_counter()
+        marca = almacen.marca_columnar(self.directorio)
+        with metricas.etapa('recarga'):
+            secuencia = almacen.leer_meta(self.directorio).get('secuencia', 0)
+            df = almacen.cargar_columnar(self.directorio)
+            previa = self.actual
+            nueva, resumen = self._recargada(previa, df, secuencia)
+            with self._candado:
+                if self.actual is not previa:
+                    # Se aplicaron cambios del registro mientras tanto: se compara con la vigente
+                    nueva, resumen = self._recargada(self.actual, df, secuencia)
+                self._version_base = nueva.version
+                # Lo que haya en el registro a partir de aquí se aplica sobre los datos nuevos
+                self._generacion, self._inodo, self._posicion = None, None, 0
+                self._pendientes = 0
+                self._marca = marca
+                self.actual = nueva
+        resumen["segundos"] = round(time.perf_counter() - inicio, 4)
+        self.ultima_recarga = resumen
+        return resumen
+
+    def _recargada(self, previa, df, secuencia):
+        # (instantánea nueva, resumen) de 'df' a partir de la instantánea 'previa'
+        cambios = diferencias(previa.df, df)
+        if cambios is not None:
+            cambiadas = np.unique(np.concatenate([np.empty(0, dtype=np.int64)] + list(cambios.values())))
+            if len(cambiadas) <= LIMITE_RECARGA_INCREMENTAL * len(df):
+                movidas = np.union1d(cambios.get('latitud', np.empty(0, dtype=np.int64)),
+                                     cambios.get('longitud', np.empty(0, dtype=np.int64)))
+                with metricas.etapa('recarga_incremental'):
+                    nueva = self._derivar(previa, df, cambiadas, movidas, almacen.version_datos(df), secuencia)
+                return nueva, {"modo": "incremental" if len(cambiadas) else "sin_cambios",
+                               "filas": len(df), "filas_cambiadas": int(len(cambiadas)),
+                               "columnas_cambiadas": {c: int(len(p)) for c, p in cambios.items()},
+                               "version": nueva.version}
+        pares = emparejar(previa.df, df) if list(previa.df.columns) == list(df.columns) else None
+        if pares is not None:
+            eliminadas = len(previa.df) - len(pares[0])
+            insertadas = len(df) - len(pares[1])
+            if eliminadas + insertadas <= LIMITE_RECARGA_INCREMENTAL * len(df):
+                with metricas.etapa('recarga_incremental'):
+                    nueva = self._renumerada(previa, df, secuencia)
+                return nueva, {"modo": "incremental_filas", "filas": len(df),
+                               "filas_anteriores": len(previa.df), "filas_insertadas": insertadas,
+                               "filas_eliminadas": eliminadas, "version": nueva.version}
+        with metricas.etapa('recarga_completa'):
+            nueva = self._construir(df, secuencia)
+        return nueva, {"modo": "completa", "filas": len(df),
+                       "filas_anteriores": len(previa.df), "version": nueva.version}
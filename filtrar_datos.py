@@ -1,37 +1,542 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
 import pandas as pd
 
+import agregados
+import almacen
+import busqueda
+import datos_vivos
+import metricas
+import regiones
+import sinergias
+from indice_espacial import KM_POR_GRADO, IndiceEspacial
+from motor_filtros import MotorFiltros
+
 # Archivo de entrada con todos los datos
 archivo_principal = 'db-ens-bc.csv'
 # Archivo de salida que crearemos
 archivo_filtrado = 'datos_ensenada.csv'
+# Versión columnar (binaria) que carga la API
+directorio_columnar = almacen.DIRECTORIO_COLUMNAR
+# Los demás municipios van a datos_<region>.csv y datos_<region>.col (ver regiones.py)
+
+# Percentiles de las coordenadas que definen los límites de una región
+PERCENTILES_LIMITES = (0.5, 99.5)
+
+# Una región sin "limites_validos" en el catálogo acepta las coordenadas dentro
+# de su caja de PERCENTILES_LIMITES ampliada estas veces su tamaño por lado: lo
+# que cae más lejos está mal capturado (hay negocios en 10.25, -124.44)
+FACTOR_LIMITES_VALIDOS = 3
+
+# Mismo nombre (normalizado) prácticamente en el mismo punto: es el mismo establecimiento
+DISTANCIA_DUPLICADO_M = 5
+
+# Más registros que estos con el mismo nombre en un punto son unidades distintas
+# de un edificio (consultorios de una clínica, cajeros, locales de un mercado)
+MAXIMO_GRUPO_DUPLICADO = 2
+
+# Nombres genéricos o descripciones de actividad ("VENTA DE ROPA", "CONSULTORIO
+# DENTAL"): no identifican a un establecimiento y no se deduplican. Son los que
+# siguen este patrón o aparecen en al menos LUGARES_NOMBRE_GENERICO lugares de la ciudad
+PATRON_NOMBRE_GENERICO = (r'\bSIN NOMBRE\b|^(?:VENTA|VENTAS|CONSULTORIO|CONSULTORIOS|CAJERO|DESPACHO|'
+                          r'TIENDA|ROPA|SEGUNDA|COMPRA|REPARACION|SERVICIO|SERVICIOS)\b')
+LUGARES_NOMBRE_GENERICO = 5
+# Un punto con tantos registros es un mercado, plaza o torre médica: sus
+# locales no se deduplican aunque repitan nombre
+REGISTROS_LUGAR_CONCURRIDO = 10
+# Decimales de las coordenadas que cuentan como un mismo lugar (~11 m)
+DECIMALES_LUGAR = 4
+
+# Reporte de la etapa de calidad, junto al almacén columnar
+ARCHIVO_CALIDAD = 'calidad.json'
+
+# Solo leemos las columnas necesarias, con tipos explícitos
+COLUMNAS_DENUE = ['nom_estab', 'latitud', 'longitud', 'cve_municipio_fk']
+TIPOS_DENUE = {
+    'nom_estab': 'string',
+    'latitud': 'float64',
+    'longitud': 'float64',
+    'cve_municipio_fk': 'Int32',
+}
+
+
+def crear_base_ensenada():
+    print("--- Creando la Base de Datos Final (Versión Corregida) ---")
+
+    try:
+        print(f"Paso 1: Cargando '{archivo_principal}'...")
+        df = pd.read_csv(archivo_principal, encoding='latin1', low_memory=False)
+        print("Archivo cargado.")
+
+        # Paso 2: Filtrar por Ensenada usando la columna correcta
+        print("Paso 2: Filtrando negocios de Ensenada (cve_municipio_fk == 1)...")
+        df_ensenada = df[df['cve_municipio_fk'] == 1].copy()
+
+        # Paso 3: Seleccionar las columnas correctas que sí existen
+        # Usamos 'nom_estab' como el nombre/categoría del negocio
+        print("Paso 3: Seleccionando las columnas finales (nom_estab, latitud, longitud)...")
+        df_final = df_ensenada[['nom_estab', 'latitud', 'longitud']]
+
+        # Renombrar 'nom_estab' para que la app lo entienda
+        df_final = df_final.rename(columns={'nom_estab': 'categoria_negocio'})
+
+        # Guardar el archivo final
+        df_final.to_csv(archivo_filtrado, index=False)
+
+        print(f"\n¡LISTO! Se ha creado el archivo '{archivo_filtrado}'.")
+        print("Este es el archivo definitivo. ¡Lo logramos!")
+        return df_final
+
+    except FileNotFoundError:
+        print(f"\nERROR: No se encontró el archivo '{archivo_principal}'.")
+    except KeyError as e:
+        print(f"\nERROR DE COLUMNA: No se encontró la columna {e}.")
+        print("Esto no debería pasar ahora, pero verifica los nombres si ocurre.")
+    return None
+
+
+def crear_base_por_bloques(municipios=(1,), tamano_bloque=200_000, archivo_entrada=None):
+    """Lee el DENUE completo por bloques y escribe cada municipio de forma incremental.
+
+    La memoria queda limitada por el tamaño del bloque, no por el del archivo.
+    Cada municipio se escribe en '<salida>.tmp' y solo reemplaza a su archivo
+    cuando todo el archivo de entrada se leyó sin errores.
+    Devuelve un diccionario municipio -> (archivo de salida, registros escritos).
+    """
+    archivo_entrada = archivo_entrada or archivo_principal
+    municipios = [int(m) for m in municipios]
+    # Ensenada (1) sigue escribiéndose en datos_ensenada.csv
+    salidas = {m: regiones.ruta_csv(regiones.clave_municipio(m)) for m in municipios}
+    temporales = {m: salida + '.tmp' for m, salida in salidas.items()}
+    escritos = {m: 0 for m in municipios}
+
+    print(f"--- Lectura por bloques de '{archivo_entrada}' (municipios: {municipios}) ---")
+    try:
+        # Empezar con temporales vacíos para poder agregar bloque por bloque
+        for temporal in temporales.values():
+            if os.path.exists(temporal):
+                os.remove(temporal)
+
+        inicio = time.perf_counter()
+        leidos = 0
+        bloques = pd.read_csv(archivo_entrada, encoding='latin1', usecols=COLUMNAS_DENUE,
+                              dtype=TIPOS_DENUE, chunksize=tamano_bloque)
+        for numero, bloque in enumerate(bloques, start=1):
+            leidos += len(bloque)
+            bloque = bloque[bloque['cve_municipio_fk'].isin(municipios)]
+
+            for municipio, grupo in bloque.groupby('cve_municipio_fk', sort=False):
+                municipio = int(municipio)
+                final = grupo[['nom_estab', 'latitud', 'longitud']].rename(
+                    columns={'nom_estab': 'categoria_negocio'})
+                final.to_csv(temporales[municipio], mode='a', index=False,
+                             header=escritos[municipio] == 0)
+                escritos[municipio] += len(final)
+
+            transcurrido = time.perf_counter() - inicio
+            print(f"Bloque {numero}: {leidos} filas leídas "
+                  f"({leidos / max(transcurrido, 1e-9):,.0f} filas/s)")
+
+        # Todo se leyó bien: ahora sí se reemplazan las salidas (un municipio
+        # sin registros conserva su archivo anterior)
+        for municipio, temporal in temporales.items():
+            if os.path.exists(temporal):
+                os.replace(temporal, salidas[municipio])
+
+        transcurrido = time.perf_counter() - inicio
+        print(f"\n¡LISTO! {leidos} filas en {transcurrido:.1f} s "
+              f"({leidos / max(transcurrido, 1e-9):,.0f} filas/s).")
+        for municipio, salida in salidas.items():
+            print(f"- Municipio {municipio}: {escritos[municipio]} registros en '{salida}'")
+        return {m: (salidas[m], escritos[m]) for m in municipios}
+
+    except FileNotFoundError:
+        print(f"\nERROR: No se encontró el archivo '{archivo_entrada}'.")
+    except ValueError as e:
+        # pandas lanza ValueError cuando falta alguna columna de usecols
+        print(f"\nERROR DE COLUMNA: {e}")
+    finally:
+        # Tras un error las salidas anteriores quedan intactas
+        for temporal in temporales.values():
+            if os.path.exists(temporal):
+                os.remove(temporal)
+    return None
+
+
+# Motor de filtros del último DataFrame usado (sus índices se reutilizan)
+_motor = None
+
+
+def motor_para(df):
+    global _motor
+    if _motor is None or _motor.df is not df:
+        _motor = MotorFiltros(df)
+    return _motor
+
+
+def leer_predicado(texto):
+    """(columna, operador, valor) de un filtro 'columna:operador:valor' de la URL"""
+    partes = texto.split(':', 2)
+    if len(partes) != 3 or not partes[0] or not partes[1]:
+        raise ValueError(f"Filtro '{texto}' inválido: usa columna:operador:valor "
+                         "(p. ej. categoria_negocio:contiene:farmacia)")
+    return tuple(partes)
+
+
+def filtrar_posiciones(df, columna, valor, operador='igual', predicados=(), limite=None, motor=None):
+    """Posiciones (en orden) de las filas que cumplen todos los predicados.
+
+    Operadores: igual, prefijo, contiene, similar (texto, sin importar acentos
+    ni mayúsculas; similar tolera errores de escritura); igual, mayor, menor, rango
+    (numérico, valor "min,max"); caja (valor "lat_min,lon_min,lat_max,lon_max").
+    'motor' permite usar el de una instantánea de datos_vivos.
+    """
+    predicados = list(predicados)
+    if columna or operador == 'caja':
+        predicados.insert(0, (columna, operador, valor))
+    if not predicados:
+        raise ValueError("Indica al menos un filtro: ?columna=&valor= o ?filtro=columna:operador:valor")
+    with metricas.etapa('filtrado'):
+        posiciones = (motor or motor_para(df)).filtrar(predicados)
+    if limite is not None:
+        posiciones = posiciones[:limite]
+    return posiciones
+
+
+def filtrar(df, columna, valor, operador='igual', predicados=(), limite=None, motor=None):
+    """Filtra con índices y devuelve los registros que cumplen todos los predicados
+    (operadores: ver filtrar_posiciones)"""
+    posiciones = filtrar_posiciones(df, columna, valor, operador, predicados, limite, motor)
+    return registros(df, posiciones)
+
+
+def registros(df, posiciones):
+    """Filas de df en esas posiciones como dicts (vacíos como None)"""
+    # Solo aquí se materializan las filas
+    with metricas.etapa('materializacion'):
+        filas = df.iloc[posiciones]
+        return filas.astype(object).where(filas.notna(), None).to_dict('records')
+
+
+# --- Calidad de datos (antes de exportar el almacén columnar) ---
+
+def limites_validos(lats, lons, factor=FACTOR_LIMITES_VALIDOS):
+    """Caja (lat_min, lon_min, lat_max, lon_max) de coordenadas creíbles para unos datos.
+
+    La caja de PERCENTILES_LIMITES ampliada 'factor' veces su tamaño por lado:
+    unas cuantas coordenadas mal capturadas no la mueven y los negocios
+    alejados del centro de la región quedan dentro.
+    """
+    lat_min, lat_max = np.nanpercentile(np.asarray(lats, dtype=np.float64), PERCENTILES_LIMITES)
+    lon_min, lon_max = np.nanpercentile(np.asarray(lons, dtype=np.float64), PERCENTILES_LIMITES)
+    margen_lat, margen_lon = factor * (lat_max - lat_min), factor * (lon_max - lon_min)
+    return (float(lat_min - margen_lat), float(lon_min - margen_lon),
+            float(lat_max + margen_lat), float(lon_max + margen_lon))
+
+
+def revisar_coordenadas(lats, lons, limites):
+    """Coordenadas con latitud y longitud intercambiadas corregidas y máscara de válidas.
+
+    Una coordenada es válida si es finita, no es (0, 0) y cae dentro de 'limites'.
+    Devuelve (lats, lons, validas, intercambiadas).
+    """
+    lat_min, lon_min, lat_max, lon_max = limites
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+
+    def dentro(la, lo):
+        return (la >= lat_min) & (la <= lat_max) & (lo >= lon_min) & (lo <= lon_max)
+
+    intercambiadas = ~dentro(lats, lons) & dentro(lons, lats)
+    lats, lons = np.where(intercambiadas, lons, lats), np.where(intercambiadas, lats, lons)
+    validas = dentro(lats, lons) & ~((lats == 0) & (lons == 0))
+    return lats, lons, validas, intercambiadas
+
+
+def normalizar_nombres(nombres):
+    """Nombres sin espacios sobrantes y la clave de cada uno para comparar (-1 si está vacío).
+
+    Solo se procesa cada nombre distinto una vez; la clave ignora acentos,
+    mayúsculas y puntuación (las palabras de busqueda.palabras).
+    """
+    codigos, unicos = pd.factorize(pd.Series(nombres, dtype=object))
+    unicos = np.asarray(unicos, dtype=object)
+    limpios = np.array([' '.join(str(nombre).split()) for nombre in unicos], dtype=object)
+    claves_texto = np.array([' '.join(busqueda.palabras(nombre)) for nombre in limpios], dtype=object)
+    claves, _ = pd.factorize(claves_texto)
+    # Sin palabras no hay con qué comparar: -1
+    claves = np.where(claves_texto == '', -1, claves)
+    claves_fila = np.where(codigos >= 0, claves[np.maximum(codigos, 0)], -1)
+    limpios_fila = np.where(codigos >= 0, limpios[np.maximum(codigos, 0)], None)
+    return limpios_fila, claves_fila, int(np.count_nonzero(unicos != limpios))
+
+
+def nombres_genericos(limpios, claves, lats, lons, lugares=LUGARES_NOMBRE_GENERICO):
+    """Máscara de filas que no se deduplican: su nombre no identifica a un
+    establecimiento, o están en un lugar con muchos locales.
+
+    Genérico = sigue PATRON_NOMBRE_GENERICO o la misma clave está en al menos
+    'lugares' lugares distintos (coordenadas a DECIMALES_LUGAR decimales).
+    """
+    patron = pd.Series(limpios, dtype=object).fillna('').str.upper().str.contains(
+        PATRON_NOMBRE_GENERICO, regex=True).to_numpy()
+    tabla = pd.DataFrame({"clave": claves, "lat": np.round(lats, DECIMALES_LUGAR),
+                          "lon": np.round(lons, DECIMALES_LUGAR)})
+    lugares_por_clave = tabla[claves >= 0].drop_duplicates().groupby("clave").size()
+    repetidas = lugares_por_clave.index[lugares_por_clave >= lugares].to_numpy()
+    concurridos = tabla.groupby(["lat", "lon"])["clave"].transform("size").to_numpy() >= REGISTROS_LUGAR_CONCURRIDO
+    return patron | np.isin(claves, repetidas) | concurridos
+
+
+def duplicados_cercanos(claves, lats, lons, distancia_m=DISTANCIA_DUPLICADO_M, maximo_grupo=MAXIMO_GRUPO_DUPLICADO):
+    """Filas que repiten un establecimiento: misma clave de nombre a menos de 'distancia_m'.
+
+    Los puntos se agrupan en celdas de 'distancia_m' de lado (hash espacial) y
+    se ordenan por (nombre, celda): los candidatos de cada punto son los de su
+    misma celda y las vecinas, que quedan contiguos y se encuentran con búsqueda
+    binaria. O(n log n) más los pares candidatos, en lugar de comparar todos
+    contra todos. Los grupos se unen por transitividad; de cada grupo de hasta
+    'maximo_grupo' filas se conserva la primera (los más grandes son unidades
+    distintas de un mismo edificio y se conservan todas). Devuelve (máscara de
+    filas a quitar, grupos quitados como listas de filas, la conservada primero,
+    número de grupos más grandes que se conservaron).
+    """
+    n = len(claves)
+    candidatas = np.flatnonzero(claves >= 0)
+    quitar = np.zeros(n, dtype=bool)
+    if len(candidatas) < 2:
+        return quitar, [], 0
+
+    lats, lons, claves = lats[candidatas], lons[candidatas], claves[candidatas]
+    alto = distancia_m / 1000 / KM_POR_GRADO
+    # Con el coseno de la latitud más alejada del ecuador ninguna celda queda más angosta que la distancia
+    ancho = alto / max(np.cos(np.radians(np.abs(lats).max())), 1e-6)
+    celda_y = np.floor((lats - lats.min()) / alto).astype(np.int64) + 1
+    celda_x = np.floor((lons - lons.min()) / ancho).astype(np.int64) + 1
+    bits = int(max(celda_y.max(), celda_x.max()) + 2).bit_length()
+    if int(claves.max()).bit_length() + 2 * bits > 63:
+        raise ValueError("Demasiadas celdas o nombres para la clave de 64 bits; usa una distancia mayor")
+    llave = (claves.astype(np.int64) << (2 * bits)) | (celda_y << bits) | celda_x
+    # Todo se trabaja en el orden de la llave: las búsquedas van en orden y aprovechan la cache
+    orden = np.argsort(llave, kind='stable')
+    llave, lats, lons = llave[orden], lats[orden], lons[orden]
+    posiciones = np.arange(len(llave))
+
+    pares_i, pares_j = [], []
+    # Media vecindad: cada par de celdas vecinas se revisa una sola vez
+    for dy, dx in ((0, 0), (0, 1), (1, -1), (1, 0), (1, 1)):
+        objetivo = llave + (dy << bits) + dx
+        fin = np.searchsorted(llave, objetivo, side='right')
+        # En la misma celda solo los que van después (cada par una vez)
+        inicio = posiciones + 1 if (dy, dx) == (0, 0) else np.searchsorted(llave, objetivo, side='left')
+        cuenta = np.maximum(fin - inicio, 0)
+        total = int(cuenta.sum())
+        if total == 0:
+            continue
+        desplazamiento = np.arange(total) - np.repeat(np.cumsum(cuenta) - cuenta, cuenta)
+        pares_i.append(np.repeat(posiciones, cuenta))
+        pares_j.append(np.repeat(inicio, cuenta) + desplazamiento)
+    if not pares_i:
+        return quitar, [], 0
+
+    i, j = np.concatenate(pares_i), np.concatenate(pares_j)
+    dy_km = (lats[i] - lats[j]) * KM_POR_GRADO
+    dx_km = (lons[i] - lons[j]) * KM_POR_GRADO * np.cos(np.radians((lats[i] + lats[j]) / 2))
+    cerca = dy_km ** 2 + dx_km ** 2 <= (distancia_m / 1000) ** 2
+    i, j = i[cerca], j[cerca]
+
+    # Componentes conexas: cada fila toma la etiqueta menor (su fila original
+    # más antigua) de sus pares hasta que ninguna cambie
+    etiquetas = orden.copy()
+    while True:
+        menor = np.minimum(etiquetas[i], etiquetas[j])
+        nuevas = etiquetas.copy()
+        np.minimum.at(nuevas, i, menor)
+        np.minimum.at(nuevas, j, menor)
+        if np.array_equal(nuevas, etiquetas):
+            break
+        etiquetas = nuevas
+    # Etiqueta = posición (en 'candidatas') de la fila conservada de su grupo
+    tamanos = np.bincount(etiquetas, minlength=len(etiquetas))
+    en_grupo = tamanos[etiquetas] > 1
+    multiples = int(np.count_nonzero((tamanos > maximo_grupo)))
+    repetidas = en_grupo & (etiquetas != orden) & (tamanos[etiquetas] <= maximo_grupo)
+    quitar[candidatas[orden[repetidas]]] = True
+
+    miembros = en_grupo & (tamanos[etiquetas] <= maximo_grupo)
+    filas = candidatas[orden[miembros]]
+    por_grupo = np.argsort(etiquetas[miembros] * len(etiquetas) + orden[miembros], kind='stable')
+    cortes = np.flatnonzero(np.diff(etiquetas[miembros][por_grupo])) + 1
+    grupos = [grupo.tolist() for grupo in np.split(filas[por_grupo], cortes)] if len(filas) else []
+    return quitar, grupos, multiples
+
+
+def limpiar(df, limites=None, distancia_m=DISTANCIA_DUPLICADO_M):
+    """Revisión de coordenadas, nombres y duplicados; devuelve (df limpio, reporte).
+
+    'limites' es la caja de coordenadas válidas; si no se da, se calcula de los
+    datos con limites_validos().
+    """
+    inicio = time.perf_counter()
+    tiempos = {}
+    entrada = len(df)
+    if limites is None:
+        limites = limites_validos(df['latitud'], df['longitud'])
+
+    lats, lons, validas, intercambiadas = revisar_coordenadas(df['latitud'], df['longitud'], limites)
+    invalidas = ~np.isfinite(lats) | ~np.isfinite(lons)
+    # Fila de la entrada de cada fila que queda (para el detalle de duplicados)
+    filas_entrada = np.flatnonzero(validas)
+    df = df.assign(latitud=lats, longitud=lons)[validas].reset_index(drop=True)
+    tiempos["coordenadas"] = time.perf_counter() - inicio
+
+    marca = time.perf_counter()
+    limpios, claves, normalizados = normalizar_nombres(df['categoria_negocio'].to_numpy())
+    df['categoria_negocio'] = limpios
+    tiempos["nombres"] = time.perf_counter() - marca
+
+    marca = time.perf_counter()
+    lats, lons = df['latitud'].to_numpy(), df['longitud'].to_numpy()
+    genericos = nombres_genericos(limpios, claves, lats, lons)
+    quitar, grupos, multiples = duplicados_cercanos(np.where(genericos, -1, claves), lats, lons, distancia_m)
+    # Cada grupo quitado, para revisarlo: nombre, lugar y filas de la entrada (la conservada primero)
+    detalle = [{"nombre": limpios[grupo[0]], "latitud": float(lats[grupo[0]]), "longitud": float(lons[grupo[0]]),
+                "filas_entrada": filas_entrada[grupo].tolist()} for grupo in grupos]
+    df = df[~quitar].reset_index(drop=True)
+    tiempos["duplicados"] = time.perf_counter() - marca
+    tiempos["total"] = time.perf_counter() - inicio
+
+    reporte = {
+        "entrada": entrada,
+        "salida": len(df),
+        "coordenadas": {
+            "limites": [round(float(v), 6) for v in limites],
+            "invalidas": int(np.count_nonzero(invalidas)),
+            "fuera_de_limites": int(np.count_nonzero(~validas & ~invalidas)),
+            "intercambiadas": int(np.count_nonzero(intercambiadas & validas)),
+        },
+        "nombres": {
+            "normalizados": normalizados,
+            "vacios": int(np.count_nonzero(claves < 0)),
+            "distintos": int(len(np.unique(claves[claves >= 0]))),
+        },
+        "duplicados": {
+            "distancia_m": distancia_m,
+            "maximo_grupo": MAXIMO_GRUPO_DUPLICADO,
+            "eliminados": int(np.count_nonzero(quitar)),
+            "grupos": len(grupos),
+            "nombres_genericos": int(np.count_nonzero(genericos)),
+            "grupos_mayores_conservados": multiples,
+            "detalle": detalle,
+        },
+        "tiempos_s": {etapa: round(segundos, 4) for etapa, segundos in tiempos.items()},
+        "filas_por_segundo": round(entrada / max(tiempos["total"], 1e-9)),
+    }
+    return df, reporte
+
+
+def guardar_reporte(reporte, directorio):
+    ruta = os.path.join(directorio, ARCHIVO_CALIDAD)
+    with open(ruta, 'w', encoding='utf-8') as f:
+        json.dump(reporte, f, ensure_ascii=False, indent=2)
+    return ruta
+
+
+def exportar_columnar(df=None, region=regiones.REGION_POR_DEFECTO, municipio=None, limpieza=True,
+                      limites=None):
+    """Genera el almacén columnar de una región, que la API abre con mmap al usarla.
+
+    El CSV de la región no se modifica: la limpieza solo llega al almacén.
+    'limites' son las coordenadas válidas; por omisión las "limites_validos"
+    de la región en el catálogo o, si no tiene, las que salen de sus datos.
+    """
+    directorio_region = regiones.directorio(region)
+    if df is None:
+        entrada = regiones.ruta_csv(region)
+        print(f"Leyendo '{entrada}'...")
+        df = pd.read_csv(entrada)
+
+    reporte = None
+    if limpieza:
+        if limites is None:
+            limites = regiones.cargar_catalogo().get(region, {}).get("limites_validos")
+        df, reporte = limpiar(df, limites)
+        coordenadas, duplicados = reporte["coordenadas"], reporte["duplicados"]
+        print(f"Calidad: {reporte['entrada']} -> {reporte['salida']} registros en "
+              f"{reporte['tiempos_s']['total']:.3f} s ({coordenadas['fuera_de_limites'] + coordenadas['invalidas']} "
+              f"coordenadas fuera de límites, {coordenadas['intercambiadas']} intercambiadas, "
+              f"{reporte['nombres']['normalizados']} nombres normalizados, "
+              f"{duplicados['eliminados']} duplicados en {duplicados['grupos']} grupos).")
 
-print("--- Creando la Base de Datos Final (Versión Corregida) ---")
+    # La clasificación de sinergias se guarda ya calculada
+    df = sinergias.clasificar(df)
+    almacen.guardar_columnar(df, directorio_region)
+    if reporte is not None:
+        print(f"Reporte de calidad en '{guardar_reporte(reporte, directorio_region)}'.")
+    # Índices y agregados se calculan sobre lo que abrirá la API (float32 y
+    # categorías): así su versión coincide y no se recalculan al arrancar
+    df = almacen.cargar_columnar(directorio_region)
+    # Los cambios registrados eran sobre los datos anteriores
+    datos_vivos.descartar_cambios(directorio_region)
+    print(f"Almacén columnar creado en '{directorio_region}' ({len(df)} registros).")
 
-try:
-    print(f"Paso 1: Cargando '{archivo_principal}'...")
-    df = pd.read_csv(archivo_principal, encoding='latin1', low_memory=False)
-    print("Archivo cargado.")
+    # Índice de búsqueda difusa de nombres, para no construirlo al arrancar la API
+    busqueda.guardar_indices(motor_para(df), directorio_region)
+    print(f"Índice de búsqueda de nombres guardado en '{directorio_region}'.")
 
-    # Paso 2: Filtrar por Ensenada usando la columna correcta
-    print("Paso 2: Filtrando negocios de Ensenada (cve_municipio_fk == 1)...")
-    df_ensenada = df[df['cve_municipio_fk'] == 1].copy()
+    # Agregados por zona: solo se recalculan las zonas cuyas filas cambiaron
+    ruta = agregados.ruta_agregados(directorio_region)
+    indice = IndiceEspacial(df['latitud'].to_numpy(), df['longitud'].to_numpy())
+    zonas = regiones.cargar_catalogo().get(region, {}).get("zonas", {})
+    resultado, recalculadas = agregados.refrescar(agregados.cargar(ruta), df, indice, zonas)
+    agregados.guardar(resultado, ruta)
+    print(f"Agregados por zona guardados en '{ruta}' (recalculadas: {recalculadas or 'ninguna'}).")
 
-    # Paso 3: Seleccionar las columnas correctas que sí existen
-    # Usamos 'nom_estab' como el nombre/categoría del negocio
-    print("Paso 3: Seleccionando las columnas finales (nom_estab, latitud, longitud)...")
-    df_final = df_ensenada[['nom_estab', 'latitud', 'longitud']]
+    # Límites de la región en el catálogo: la API rutea por coordenadas con
+    # ellos. Percentiles y no mínimo/máximo: unas cuantas coordenadas mal
+    # capturadas no deben estirar la caja sobre las regiones vecinas.
+    lat_min, lat_max = np.nanpercentile(df['latitud'].to_numpy(), PERCENTILES_LIMITES)
+    lon_min, lon_max = np.nanpercentile(df['longitud'].to_numpy(), PERCENTILES_LIMITES)
+    regiones.registrar(region, [lat_min, lon_min, lat_max, lon_max], len(df), municipio)
+    print(f"Región '{region}' registrada en '{regiones.RUTA_CATALOGO}'.")
+    return df
 
-    # Renombrar 'nom_estab' para que la app lo entienda
-    df_final.rename(columns={'nom_estab': 'categoria_negocio'}, inplace=True)
 
-    # Guardar el archivo final
-    df_final.to_csv(archivo_filtrado, index=False)
-    
-    print(f"\n¡LISTO! Se ha creado el archivo '{archivo_filtrado}'.")
-    print("Este es el archivo definitivo. ¡Lo logramos!")
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Construye la base de datos de negocios de Ensenada")
+    parser.add_argument('--solo-columnar', action='store_true',
+                        help=f"no leer '{archivo_principal}'; convertir '{archivo_filtrado}' existente")
+    parser.add_argument('--por-bloques', action='store_true',
+                        help="leer el DENUE por bloques (memoria acotada, sirve para el estatal o nacional)")
+    parser.add_argument('--entrada', default=archivo_principal,
+                        help="archivo DENUE de entrada para --por-bloques")
+    parser.add_argument('--municipios', type=int, nargs='+', default=[1],
+                        help="claves cve_municipio_fk a extraer (por defecto 1 = Ensenada)")
+    parser.add_argument('--tamano-bloque', type=int, default=200_000,
+                        help="filas por bloque en --por-bloques")
+    parser.add_argument('--region', default=regiones.REGION_POR_DEFECTO,
+                        help="región a convertir con --solo-columnar (lee datos_<region>.csv)")
+    parser.add_argument('--sin-limpieza', action='store_true',
+                        help="no revisar coordenadas, nombres ni duplicados antes de exportar")
+    parser.add_argument('--limites', type=float, nargs=4, metavar=('LAT_MIN', 'LON_MIN', 'LAT_MAX', 'LON_MAX'),
+                        help="caja de coordenadas válidas (por omisión la del catálogo o la de los datos)")
+    args = parser.parse_args()
+    limpieza = not args.sin_limpieza
 
-except FileNotFoundError:
-    print(f"\nERROR: No se encontró el archivo '{archivo_principal}'.")
-except KeyError as e:
-    print(f"\nERROR DE COLUMNA: No se encontró la columna {e}.")
-    print("Esto no debería pasar ahora, pero verifica los nombres si ocurre.")
\ No newline at end of file
+    if args.solo_columnar:
+        exportar_columnar(region=args.region, limpieza=limpieza, limites=args.limites)
+    elif args.por_bloques:
+        resultado = crear_base_por_bloques(args.municipios, args.tamano_bloque, args.entrada)
+        # Un almacén columnar (con sus índices y agregados) por municipio
+        for municipio, (_, escritos) in (resultado or {}).items():
+            if escritos:
+                exportar_columnar(region=regiones.clave_municipio(municipio), municipio=municipio,
+                                  limpieza=limpieza, limites=args.limites)
+    else:
+        df_final = crear_base_ensenada()
+        if df_final is not None:
+            exportar_columnar(df_final, limpieza=limpieza, limites=args.limites)
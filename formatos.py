@@ -0,0 +1,157 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+import negociacion
+
+try:
+    import pyarrow as pa
+except ImportError:
+    # Sin pyarrow no se ofrece Arrow IPC
+    pa = None
+
+# Filas que se serializan a la vez al transmitir una respuesta
+FILAS_POR_BLOQUE = 2000
+
+# Formatos de las rutas que devuelven una tabla (el primero es el de por defecto)
+FORMATOS_TABLA = ('json', 'columnas', 'msgpack') + (('arrow',) if pa is not None else ())
+
+
+def _textos_columna(serie):
+    """Valores de una columna ya convertidos a texto JSON, sin pasar por dicts por fila"""
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        # Solo se codifican las categorías presentes; el código -1 (vacío) es null
+        usados, posiciones = np.unique(serie.cat.codes.to_numpy(), return_inverse=True)
+        categorias = serie.cat.categories
+        tabla = np.array(['null' if codigo < 0 else json.dumps(str(categorias[codigo]), ensure_ascii=False)
+                          for codigo in usados.tolist()], dtype=object)
+        return tabla[posiciones.reshape(-1)]
+
+    valores = serie.to_numpy()
+    if valores.dtype.kind == 'f':
+        # JSON no tiene NaN ni infinito: van como null
+        nulos = ~np.isfinite(valores)
+        if valores.dtype == np.float32:
+            # float32 no tiene más de ~6 decimales útiles en coordenadas
+            valores = np.round(valores.astype(np.float64), 6)
+        textos = np.array([repr(v) for v in valores.tolist()], dtype=object)
+        textos[nulos] = 'null'
+        return textos
+    if valores.dtype.kind in 'iu':
+        return np.array([str(v) for v in valores.tolist()], dtype=object)
+    if valores.dtype.kind == 'b':
+        return np.where(valores, 'true', 'false').astype(object)
+    return np.array([json.dumps(None if pd.isna(v) else v, ensure_ascii=False, default=str)
+                     for v in valores.tolist()], dtype=object)
+
+
+def _plantilla_fila(columnas):
+    claves = [json.dumps(str(c), ensure_ascii=False) for c in columnas]
+    return '{' + ','.join(f'{clave}:%s' for clave in claves) + '}'
+
+
+def filas_json(df, inicio, fin, bloque=FILAS_POR_BLOQUE):
+    """Genera bloques de objetos JSON (una lista de textos por bloque) de las filas [inicio, fin)"""
+    plantilla = _plantilla_fila(df.columns)
+    for desde in range(inicio, fin, bloque):
+        pedazo = df.iloc[desde:min(desde + bloque, fin)]
+        columnas = [_textos_columna(pedazo[c]) for c in pedazo.columns]
+        yield [plantilla % fila for fila in zip(*columnas)]
+
+
+def generar_ndjson(df, inicio, fin):
+    """Una línea JSON por registro; memoria constante sin importar cuántas filas se pidan"""
+    for lineas in filas_json(df, inicio, fin):
+        yield '\n'.join(lineas) + '\n'
+
+
+def generar_json(df, inicio, fin, extra=None, clave='datos'):
+    """Documento {"datos": [...], ...} escrito por partes (arreglo JSON en bloques)"""
+    yield '{' + json.dumps(clave) + ':['
+    primero = True
+    for lineas in filas_json(df, inicio, fin):
+        yield ('' if primero else ',') + ','.join(lineas)
+        primero = False
+    yield ']'
+    for clave, valor in (extra or {}).items():
+        yield f',{json.dumps(clave)}:{json.dumps(valor)}'
+    yield '}'
+
+
+def _diccionario(serie):
+    """Códigos de una columna categórica contra solo las categorías presentes (-1 es vacío)"""
+    codigos = serie.array.codes
+    usados, posiciones = np.unique(codigos, return_inverse=True)
+    if len(usados) and usados[0] < 0:
+        # El vacío no entra al diccionario
+        posiciones = posiciones - 1
+        usados = usados[1:]
+    categorias = serie.cat.categories[usados]
+    return posiciones.reshape(-1).astype(np.int32), [str(c) for c in categorias]
+
+
+def tabla_columnas(df, extra=None):
+    """{"columnas": {...}, "diccionarios": {...}, ...}: un arreglo por columna; las
+    categóricas van como códigos del diccionario de su columna"""
+    columnas, diccionarios = [], []
+    for nombre in df.columns:
+        serie = df[nombre]
+        clave = json.dumps(str(nombre), ensure_ascii=False)
+        if isinstance(serie.dtype, pd.CategoricalDtype):
+            codigos, categorias = _diccionario(serie)
+            textos = ['null' if codigo < 0 else str(codigo) for codigo in codigos.tolist()]
+            diccionarios.append(f'{clave}:{json.dumps(categorias, ensure_ascii=False, separators=(",", ":"))}')
+        else:
+            textos = _textos_columna(serie)
+        columnas.append(f'{clave}:[{",".join(textos)}]')
+    partes = ['"columnas":{' + ','.join(columnas) + '}', '"diccionarios":{' + ','.join(diccionarios) + '}']
+    partes += [f'{json.dumps(clave)}:{json.dumps(valor)}' for clave, valor in (extra or {}).items()]
+    return '{' + ','.join(partes) + '}'
+
+
+def tabla_msgpack(df, extra=None):
+    """Lo mismo que tabla_columnas en MessagePack (float32 sin redondear)"""
+    columnas, diccionarios = {}, {}
+    for nombre in df.columns:
+        serie = df[nombre]
+        if isinstance(serie.dtype, pd.CategoricalDtype):
+            codigos, diccionarios[str(nombre)] = _diccionario(serie)
+            columnas[str(nombre)] = np.ma.masked_less(codigos, 0)
+        else:
+            columnas[str(nombre)] = serie.to_numpy()
+    return negociacion.empaquetar({"columnas": columnas, "diccionarios": diccionarios, **(extra or {})})
+
+
+def tabla_arrow(df, extra=None):
+    """Arrow IPC (stream): categóricas como diccionario, 'extra' en los metadatos del esquema"""
+    arreglos = []
+    for nombre in df.columns:
+        serie = df[nombre]
+        if isinstance(serie.dtype, pd.CategoricalDtype):
+            codigos, categorias = _diccionario(serie)
+            arreglos.append(pa.DictionaryArray.from_arrays(pa.array(codigos, mask=codigos < 0),
+                                                           pa.array(categorias, pa.string())))
+        else:
+            valores = serie.to_numpy()
+            nulos = np.isnan(valores) if valores.dtype.kind == 'f' else None
+            arreglos.append(pa.array(valores, mask=nulos, from_pandas=nulos is None))
+    tabla = pa.table(arreglos, names=[str(nombre) for nombre in df.columns])
+    tabla = tabla.replace_schema_metadata({clave: json.dumps(valor) for clave, valor in (extra or {}).items()})
+    salida = pa.BufferOutputStream()
+    with pa.ipc.new_stream(salida, tabla.schema) as escritor:
+        escritor.write_table(tabla)
+    return salida.getvalue().to_pybytes()
+
+
+def tabla(df, formato, extra=None):
+    """(cuerpo, tipo MIME) de las filas de df en un formato de FORMATOS_TABLA distinto de json"""
+    if formato == 'columnas':
+        cuerpo = tabla_columnas(df, extra).encode('utf-8')
+    elif formato == 'msgpack':
+        cuerpo = tabla_msgpack(df, extra)
+    elif formato == 'arrow' and pa is not None:
+        cuerpo = tabla_arrow(df, extra)
+    else:
+        raise negociacion.FormatoNoDisponible(f"Formato '{formato}' no disponible")
+    return cuerpo, negociacion.TIPOS[formato]
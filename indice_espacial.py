@@ -0,0 +1,140 @@
+import math
+
+import numpy as np
+
+RADIO_TIERRA_KM = 6371.0088
+KM_POR_GRADO = 111.32
+
+# Radio máximo de las búsquedas que piden los clientes (escala de ciudad):
+# el costo de una búsqueda crece con el cuadrado del radio
+MAXIMO_RADIO_KM = 10.0
+
+
+def haversine_km(lat, lon, lats, lons):
+    """Distancia en km desde (lat, lon) a cada punto de los arreglos lats/lons"""
+    lat1 = np.radians(lat)
+    lats = np.radians(np.asarray(lats, dtype=np.float64))
+    dlat = lats - lat1
+    dlon = np.radians(np.asarray(lons, dtype=np.float64) - lon)
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lats) * np.sin(dlon / 2) ** 2
+    return 2 * RADIO_TIERRA_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def validar_radio(radio_km):
+    """El radio como float; ValueError si no es un número finito en (0, MAXIMO_RADIO_KM]"""
+    try:
+        radio_km = float(radio_km)
+    except (TypeError, ValueError):
+        raise ValueError(f"Radio '{radio_km}' inválido: debe ser un número")
+    if not (math.isfinite(radio_km) and 0 < radio_km <= MAXIMO_RADIO_KM):
+        raise ValueError(f"El radio debe ser mayor que 0 y hasta {MAXIMO_RADIO_KM} km")
+    return radio_km
+
+
+class IndiceEspacial:
+    """Rejilla de celdas fijas sobre latitud/longitud para búsquedas por radio.
+
+    Se construye una sola vez; cada búsqueda solo revisa las celdas que tocan
+    el círculo pedido en lugar de recorrer toda la tabla.
+    """
+
+    def __init__(self, lats, lons, celda_km=0.5):
+        self.lats = np.asarray(lats, dtype=np.float64)
+        self.lons = np.asarray(lons, dtype=np.float64)
+        self.celda_km = celda_km
+        # Tamaño de celda en grados (la longitud se corrige por la latitud media)
+        lat_media = float(np.nanmean(self.lats)) if len(self.lats) else 0.0
+        self.paso_lat = celda_km / KM_POR_GRADO
+        self.paso_lon = celda_km / (KM_POR_GRADO * max(np.cos(np.radians(lat_media)), 0.01))
+        self.celdas = {}
+
+        validos = np.flatnonzero(np.isfinite(self.lats) & np.isfinite(self.lons))
+        if len(validos) == 0:
+            return
+
+        # Agrupar posiciones por celda con un solo ordenamiento
+        filas, columnas = self._celda(self.lats[validos], self.lons[validos])
+        orden = np.lexsort((columnas, filas))
+        filas, columnas, validos = filas[orden], columnas[orden], validos[orden]
+        cortes = np.flatnonzero((np.diff(filas) != 0) | (np.diff(columnas) != 0)) + 1
+        inicios = np.concatenate(([0], cortes))
+        for inicio, grupo in zip(inicios, np.split(validos.astype(np.int64), cortes)):
+            self.celdas[(int(filas[inicio]), int(columnas[inicio]))] = grupo
+
+    def __len__(self):
+        return len(self.lats)
+
+    def _celda(self, lat, lon):
+        filas = np.floor(np.asarray(lat) / self.paso_lat).astype(np.int64)
+        columnas = np.floor(np.asarray(lon) / self.paso_lon).astype(np.int64)
+        return filas, columnas
+
+    def candidatos(self, lat, lon, radio_km):
+        """Posiciones en las celdas que cubren el cuadro del radio (sin filtrar distancia)"""
+        dlat = radio_km / KM_POR_GRADO
+        dlon = radio_km / (KM_POR_GRADO * max(np.cos(np.radians(lat)), 0.01))
+        fila_min, col_min = (int(v) for v in self._celda(lat - dlat, lon - dlon))
+        fila_max, col_max = (int(v) for v in self._celda(lat + dlat, lon + dlon))
+
+        if (fila_max - fila_min + 1) * (col_max - col_min + 1) > len(self.celdas):
+            # Cuadro más grande que las celdas ocupadas: se recorren solo éstas
+            grupos = [grupo for (fila, columna), grupo in self.celdas.items()
+                      if fila_min <= fila <= fila_max and col_min <= columna <= col_max]
+        else:
+            grupos = []
+            for fila in range(fila_min, fila_max + 1):
+                for columna in range(col_min, col_max + 1):
+                    grupo = self.celdas.get((fila, columna))
+                    if grupo is not None:
+                        grupos.append(grupo)
+        if not grupos:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(grupos)
+
+    def buscar_radio(self, lat, lon, radio_km, con_distancias=False):
+        """Posiciones (ordenadas) de los puntos a no más de radio_km de (lat, lon)"""
+        posiciones = self.candidatos(lat, lon, radio_km)
+        distancias = haversine_km(lat, lon, self.lats[posiciones], self.lons[posiciones])
+        dentro = distancias <= radio_km
+        posiciones, distancias = posiciones[dentro], distancias[dentro]
+        orden = np.argsort(posiciones, kind='stable')
+        if con_distancias:
+            return posiciones[orden], distancias[orden]
+        return posiciones[orden]
+
+    def actualizar(self, posiciones, lats, lons):
+        """Nuevo índice con las filas 'posiciones' movidas a (lats, lons).
+
+        Es copia-en-escritura: solo se copian las celdas afectadas; el resto
+        se comparte con este índice, que sigue siendo válido para sus lectores.
+        """
+        posiciones = np.asarray(posiciones, dtype=np.int64)
+        nuevo = IndiceEspacial.__new__(IndiceEspacial)
+        nuevo.__dict__.update(self.__dict__)
+        nuevo.lats = self.lats.copy()
+        nuevo.lons = self.lons.copy()
+        nuevo.lats[posiciones] = lats
+        nuevo.lons[posiciones] = lons
+        nuevo.celdas = dict(self.celdas)
+
+        # Sacar las filas de sus celdas anteriores
+        validos = np.isfinite(self.lats[posiciones]) & np.isfinite(self.lons[posiciones])
+        filas, columnas = self._celda(self.lats[posiciones][validos], self.lons[posiciones][validos])
+        for celda in set(zip(filas.tolist(), columnas.tolist())):
+            restantes = np.setdiff1d(nuevo.celdas[celda], posiciones, assume_unique=True)
+            if len(restantes):
+                nuevo.celdas[celda] = restantes
+            else:
+                del nuevo.celdas[celda]
+
+        # Y ponerlas en las nuevas
+        validos = np.isfinite(nuevo.lats[posiciones]) & np.isfinite(nuevo.lons[posiciones])
+        movidas = posiciones[validos]
+        filas, columnas = self._celda(nuevo.lats[movidas], nuevo.lons[movidas])
+        for fila, columna, posicion in zip(filas.tolist(), columnas.tolist(), movidas.tolist()):
+            anterior = nuevo.celdas.get((fila, columna))
+            if anterior is None:
+                nuevo.celdas[(fila, columna)] = np.array([posicion], dtype=np.int64)
+            else:
+                nuevo.celdas[(fila, columna)] = np.union1d(anterior, [posicion])
+        return nuevo
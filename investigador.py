@@ -1,29 +1,237 @@
+import numpy as np
 import pandas as pd
 
+from indice_espacial import KM_POR_GRADO, haversine_km
+
 # --- IMPORTANTE ---
 # Escribe aquí el nombre EXACTO de tu archivo de datos grande
 # (Probablemente 'db-ens-bc.csv' o 'denue_inegi_02_.csv')
 nombre_de_tu_archivo = 'db-ens-bc.csv'
 
-print(f"--- Iniciando el Investigador de Archivos ---")
-print(f"Voy a analizar el archivo: '{nombre_de_tu_archivo}'")
-
-try:
-    # Cargar solo las primeras 5 filas para que sea rápido
-    df = pd.read_csv(nombre_de_tu_archivo, encoding='latin1', nrows=5)
-
-    print("\n¡Archivo leído con éxito! Estas son las columnas que encontré:")
-    
-    # Imprimir la lista de todas las columnas
-    print("--------------------------------------------------")
-    for columna in df.columns:
-        print(f"- {columna}")
-    print("--------------------------------------------------")
-    
-    print("\nCopia esta lista de columnas y muéstramela para poder darte el script de filtrado final.")
-
-except FileNotFoundError:
-    print(f"\nERROR: No encontré el archivo '{nombre_de_tu_archivo}'.")
-    print("Asegúrate de que el nombre esté bien escrito y que el archivo esté en esta misma carpeta.")
-except Exception as e:
-    print(f"\nOcurrió un error inesperado: {e}")
\ No newline at end of file
+TIPOS_ANALISIS = ('densidad', 'categorias', 'saturacion', 'competidor_cercano')
+
+# Fracción de puntos extremos que se deja fuera de la rejilla (hay coordenadas
+# muy lejos de la ciudad que estirarían la rejilla sin aportar nada)
+PERCENTIL_RECORTE = 0.5
+
+# Tamaños de celda aceptados (km) y celdas máximas de una rejilla (los
+# histogramas son densos: una celda muy chica sobre una caja grande no cabe)
+CELDA_MIN_KM = 0.05
+CELDA_MAX_KM = 10.0
+MAXIMO_CELDAS = 5_000_000
+
+# Formas del resultado de las rejillas: arreglos dispersos o GeoJSON
+FORMAS = ('arreglos', 'geojson')
+
+# Distancias por grupo que devuelve competidor_cercano (con el id de cada
+# negocio); las estadísticas del grupo sí usan todas
+MAXIMO_DISTANCIAS = 500
+
+
+def investigar_archivo(nombre=nombre_de_tu_archivo):
+    print(f"--- Iniciando el Investigador de Archivos ---")
+    print(f"Voy a analizar el archivo: '{nombre}'")
+
+    try:
+        # Cargar solo las primeras 5 filas para que sea rápido
+        df = pd.read_csv(nombre, encoding='latin1', nrows=5)
+
+        print("\n¡Archivo leído con éxito! Estas son las columnas que encontré:")
+
+        # Imprimir la lista de todas las columnas
+        print("--------------------------------------------------")
+        for columna in df.columns:
+            print(f"- {columna}")
+        print("--------------------------------------------------")
+
+        print("\nCopia esta lista de columnas y muéstramela para poder darte el script de filtrado final.")
+
+    except FileNotFoundError:
+        print(f"\nERROR: No encontré el archivo '{nombre}'.")
+        print("Asegúrate de que el nombre esté bien escrito y que el archivo esté en esta misma carpeta.")
+    except Exception as e:
+        print(f"\nOcurrió un error inesperado: {e}")
+
+
+class Rejilla:
+    """Rejilla cuadrada (celda_km x celda_km) sobre la extensión de los datos"""
+
+    def __init__(self, lats, lons, celda_km=0.5, caja=None):
+        if celda_km is None or not CELDA_MIN_KM <= celda_km <= CELDA_MAX_KM:
+            raise ValueError(f"celda_km debe ser un número entre {CELDA_MIN_KM} y {CELDA_MAX_KM}")
+        if caja is None:
+            lat_min, lat_max = np.nanpercentile(lats, [PERCENTIL_RECORTE, 100 - PERCENTIL_RECORTE])
+            lon_min, lon_max = np.nanpercentile(lons, [PERCENTIL_RECORTE, 100 - PERCENTIL_RECORTE])
+        else:
+            if len(caja) != 4 or not (np.all(np.isfinite(caja)) and caja[0] < caja[2] and caja[1] < caja[3]):
+                raise ValueError("La caja debe ser lat_min,lon_min,lat_max,lon_max")
+            lat_min, lon_min, lat_max, lon_max = caja
+        self.celda_km = celda_km
+        self.paso_lat = celda_km / KM_POR_GRADO
+        self.paso_lon = float(celda_km / (KM_POR_GRADO * np.cos(np.radians((lat_min + lat_max) / 2))))
+        self.lat_min, self.lon_min = float(lat_min), float(lon_min)
+        self.filas = max(int(np.ceil((lat_max - lat_min) / self.paso_lat)), 1)
+        self.columnas = max(int(np.ceil((lon_max - lon_min) / self.paso_lon)), 1)
+        if self.filas * self.columnas > MAXIMO_CELDAS:
+            raise ValueError(f"La rejilla tendría {self.filas * self.columnas} celdas (máximo {MAXIMO_CELDAS}); "
+                             "usa una celda_km mayor o una caja más chica")
+
+    def celdas(self, lats, lons):
+        """Número de celda de cada punto (-1 si queda fuera)"""
+        fila = np.floor((lats - self.lat_min) / self.paso_lat)
+        columna = np.floor((lons - self.lon_min) / self.paso_lon)
+        dentro = (fila >= 0) & (fila < self.filas) & (columna >= 0) & (columna < self.columnas)
+        return np.where(dentro, fila * self.columnas + columna, -1).astype(np.int64)
+
+    def descripcion(self):
+        return {
+            "celda_km": self.celda_km,
+            "origen": [self.lat_min, self.lon_min],
+            "paso": [self.paso_lat, self.paso_lon],
+            "forma": [self.filas, self.columnas],
+        }
+
+    def geojson(self, celdas, propiedades):
+        """FeatureCollection con un polígono por celda"""
+        fila, columna = np.divmod(np.asarray(celdas), self.columnas)
+        sur = self.lat_min + fila * self.paso_lat
+        oeste = self.lon_min + columna * self.paso_lon
+        elementos = []
+        for i, (s, o) in enumerate(zip(sur.tolist(), oeste.tolist())):
+            n, e = s + self.paso_lat, o + self.paso_lon
+            elementos.append({
+                "type": "Feature",
+                "geometry": {"type": "Polygon",
+                             "coordinates": [[[o, s], [e, s], [e, n], [o, n], [o, s]]]},
+                "properties": {clave: valores[i] for clave, valores in propiedades.items()},
+            })
+        return {"type": "FeatureCollection", "features": elementos}
+
+
+def _coordenadas(df):
+    return (df['latitud'].to_numpy(dtype=np.float64), df['longitud'].to_numpy(dtype=np.float64))
+
+
+def _resultado(rejilla, celdas, propiedades, forma, extra):
+    """Arreglos dispersos (solo celdas con negocios) o GeoJSON"""
+    if forma not in FORMAS:
+        raise ValueError(f"Forma '{forma}' no soportada. Usa una de: {', '.join(FORMAS)}")
+    if forma == 'geojson':
+        resultado = rejilla.geojson(celdas, propiedades)
+    else:
+        fila, columna = np.divmod(np.asarray(celdas), rejilla.columnas)
+        resultado = {"rejilla": rejilla.descripcion(),
+                     "fila": fila.tolist(), "columna": columna.tolist(), **propiedades}
+    resultado.update(extra)
+    return resultado
+
+
+def densidad(df, celda_km=0.5, forma='arreglos', caja=None):
+    """Negocios por celda con np.histogram2d"""
+    lats, lons = _coordenadas(df)
+    rejilla = Rejilla(lats, lons, celda_km, caja)
+    conteos, _, _ = np.histogram2d(
+        lats, lons, bins=[rejilla.filas, rejilla.columnas],
+        range=[[rejilla.lat_min, rejilla.lat_min + rejilla.filas * rejilla.paso_lat],
+               [rejilla.lon_min, rejilla.lon_min + rejilla.columnas * rejilla.paso_lon]])
+    conteos = conteos.astype(np.int64).ravel()
+    celdas = np.flatnonzero(conteos)
+    return _resultado(rejilla, celdas, {"conteo": conteos[celdas].tolist()}, forma, {
+        "negocios_en_rejilla": int(conteos.sum()),
+        "fuera_de_rejilla": int(len(lats) - conteos.sum()),
+        "densidad_max_km2": round(float(conteos.max()) / celda_km ** 2, 2) if len(conteos) else 0.0,
+    })
+
+
+def _conteos_por_categoria(df, celda_km, caja):
+    """Celdas con negocios y su matriz celdas x categoría de sinergia (id combinado celda*categoría)"""
+    lats, lons = _coordenadas(df)
+    rejilla = Rejilla(lats, lons, celda_km, caja)
+    celda = rejilla.celdas(lats, lons)
+    categorias = list(df['sinergia'].cat.categories) + ['otros']
+    codigo = df['sinergia'].cat.codes.to_numpy().astype(np.int64)
+    codigo[codigo < 0] = len(categorias) - 1
+
+    validos = celda >= 0
+    # Solo las celdas ocupadas: con celdas chicas la rejilla completa no cabría por categoría
+    celdas, combinado = np.unique(celda[validos], return_inverse=True)
+    matriz = np.bincount(combinado * len(categorias) + codigo[validos],
+                         minlength=len(celdas) * len(categorias)).reshape(len(celdas), len(categorias))
+    return rejilla, categorias, celdas, matriz
+
+
+def categorias(df, celda_km=0.5, forma='arreglos', caja=None):
+    rejilla, nombres, celdas, matriz = _conteos_por_categoria(df, celda_km, caja)
+    propiedades = {nombre: matriz[:, i].tolist() for i, nombre in enumerate(nombres)}
+    return _resultado(rejilla, celdas, propiedades, forma, {"categorias": nombres})
+
+
+def saturacion(df, celda_km=0.5, forma='arreglos', caja=None):
+    """Saturación: densidad de cada celda relativa a la celda p95"""
+    rejilla, _, celdas, matriz = _conteos_por_categoria(df, celda_km, caja)
+    totales = matriz.sum(axis=1)
+
+    referencia = max(float(np.percentile(totales, 95)), 1.0) if len(totales) else 1.0
+    indice_saturacion = np.minimum(totales / referencia, 1.0)
+
+    return _resultado(rejilla, celdas, {
+        "conteo": totales.tolist(),
+        "saturacion": np.round(indice_saturacion, 3).tolist(),
+    }, forma, {"referencia_p95": referencia})
+
+
+def competidor_cercano(df, bloque=1024, maximo_distancias=MAXIMO_DISTANCIAS, **_):
+    """Distancia de cada negocio clasificado al competidor más cercano del mismo tipo.
+
+    Cada grupo trae sus estadísticas y, para los primeros 'maximo_distancias'
+    negocios (por id), el id y la distancia de cada uno.
+    """
+    lats, lons = _coordenadas(df)
+    sinergia = df['sinergia'].cat.codes.to_numpy()
+    rol = df['rol_sinergia'].cat.codes.to_numpy()
+
+    resumen = []
+    for i, categoria in enumerate(df['sinergia'].cat.categories):
+        for j, nombre_rol in enumerate(df['rol_sinergia'].cat.categories):
+            grupo = np.flatnonzero((sinergia == i) & (rol == j))
+            if len(grupo) < 2:
+                continue
+            cercanos = np.empty(len(grupo))
+            for inicio in range(0, len(grupo), bloque):
+                parte = grupo[inicio:inicio + bloque]
+                matriz = haversine_km(lats[parte, None], lons[parte, None], lats[grupo], lons[grupo])
+                # Un negocio no es su propio competidor
+                matriz[np.arange(len(parte)), np.arange(inicio, inicio + len(parte))] = np.inf
+                cercanos[inicio:inicio + len(parte)] = matriz.min(axis=1)
+            resumen.append({
+                "categoria_sinergia": str(categoria),
+                "rol": str(nombre_rol),
+                "negocios": int(len(grupo)),
+                "mediana_km": round(float(np.median(cercanos)), 3),
+                "p10_km": round(float(np.percentile(cercanos, 10)), 3),
+                "p90_km": round(float(np.percentile(cercanos, 90)), 3),
+                "ids": grupo[:maximo_distancias].tolist(),
+                "distancias_km": np.round(cercanos[:maximo_distancias], 3).tolist(),
+                "distancias_truncadas": bool(len(grupo) > maximo_distancias),
+            })
+    return {"grupos": resumen}
+
+
+ANALISIS = {
+    'densidad': densidad,
+    'categorias': categorias,
+    'saturacion': saturacion,
+    'competidor_cercano': competidor_cercano,
+}
+
+
+def analizar(df, tipo_analisis, **opciones):
+    """Punto de entrada de la API: ejecuta el análisis pedido"""
+    if tipo_analisis not in ANALISIS:
+        raise ValueError(f"Tipo de análisis '{tipo_analisis}' no soportado. "
+                         f"Usa uno de: {', '.join(TIPOS_ANALISIS)}")
+    return ANALISIS[tipo_analisis](df, **opciones)
+
+
+if __name__ == '__main__':
+    investigar_archivo()
@@ -0,0 +1,266 @@
+"""Instrumentación de la API: tiempos por etapa, contadores y perfiles.
+
+Las métricas se exponen en /metrics (formato de texto de Prometheus). Son
+por proceso: con varios workers cada uno reporta las suyas.
+
+Perfiles: con la variable PERFIL_TOKEN definida, una petición con la
+cabecera 'X-Perfil: <token>' se ejecuta bajo cProfile y el resultado se
+guarda como .prof (se abre con snakeviz, o flameprof para una gráfica de
+llama). También se puede armar el perfilado de las siguientes N peticiones
+a una ruta con POST /metrics/perfil, sin volver a desplegar.
+"""
+import contextlib
+import contextvars
+import cProfile
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None
+
+# Límites de los histogramas de tiempo, en segundos
+LIMITES = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+DIRECTORIO_PERFILES = os.environ.get('PERFIL_DIR') or os.path.join(tempfile.gettempdir(), 'perfiles_api')
+
+# Etapas medidas durante la petición actual (para la cabecera Server-Timing)
+_etapas_peticion = contextvars.ContextVar('etapas_peticion', default=None)
+
+
+class Histograma:
+    """Histograma acumulado por combinación de etiquetas (como en Prometheus)"""
+
+    def __init__(self, nombre, ayuda, etiquetas, limites=LIMITES):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self.limites = limites
+        self.series = {}
+        self.candado = threading.Lock()
+
+    def observar(self, valor, *etiquetas):
+        with self.candado:
+            serie = self.series.get(etiquetas)
+            if serie is None:
+                serie = self.series[etiquetas] = [[0] * len(self.limites), 0.0, 0]
+            for i, limite in enumerate(self.limites):
+                if valor <= limite:
+                    serie[0][i] += 1
+            serie[1] += valor
+            serie[2] += 1
+
+    def texto(self):
+        lineas = [f'# HELP {self.nombre} {self.ayuda}', f'# TYPE {self.nombre} histogram']
+        with self.candado:
+            for etiquetas, (cubetas, suma, total) in sorted(self.series.items()):
+                base = _etiquetas(self.etiquetas, etiquetas)
+                for limite, cuenta in zip(self.limites, cubetas):
+                    lineas.append(f'{self.nombre}_bucket{{{base}le="{limite}"}} {cuenta}')
+                lineas.append(f'{self.nombre}_bucket{{{base}le="+Inf"}} {total}')
+                lineas.append(f'{self.nombre}_sum{{{base.rstrip(",")}}} {suma:.6f}')
+                lineas.append(f'{self.nombre}_count{{{base.rstrip(",")}}} {total}')
+        return lineas
+
+
+def _etiquetas(nombres, valores):
+    return ''.join(f'{nombre}="{_escapar(valor)}",' for nombre, valor in zip(nombres, valores))
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+PETICIONES = Histograma('api_peticion_segundos', 'Duración de las peticiones por ruta',
+                        ('ruta', 'metodo', 'estado'))
+ETAPAS = Histograma('api_etapa_segundos', 'Duración de cada etapa interna (carga, filtrado, serialización...)',
+                    ('etapa',))
+
+# Arranque en frío del proceso: etapa -> segundos (importación, carga de datos...)
+ARRANQUE = {}
+
+
+def registrar_arranque(nombre, segundos):
+    ARRANQUE[nombre] = round(segundos, 4)
+
+
+@contextlib.contextmanager
+def etapa(nombre):
+    """Mide un bloque de código como etapa: with metricas.etapa('filtrado'): ..."""
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        duracion = time.perf_counter() - inicio
+        ETAPAS.observar(duracion, nombre)
+        etapas = _etapas_peticion.get()
+        if etapas is not None:
+            etapas.append((nombre, duracion))
+
+
+def _memoria_rss():
+    # RSS actual (Linux); si no se puede leer, el máximo que reporta getrusage
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return _memoria_pico()
+
+
+def _memoria_pico():
+    if resource is None:
+        return 0
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # En Linux viene en KB, en macOS en bytes
+    return pico if sys.platform == 'darwin' else pico * 1024
+
+
+def _valor(nombre, ayuda, tipo, valor, etiquetas=''):
+    return [f'# HELP {nombre} {ayuda}', f'# TYPE {nombre} {tipo}', f'{nombre}{etiquetas} {valor}']
+
+
+def texto_prometheus(cache=None, datos=None):
+    """Todas las métricas en formato de texto de Prometheus (versión 0.0.4)"""
+    lineas = PETICIONES.texto() + ETAPAS.texto()
+    if ARRANQUE:
+        lineas += ['# HELP api_arranque_segundos Arranque en frío del proceso por etapa',
+                   '# TYPE api_arranque_segundos gauge']
+        lineas += [f'api_arranque_segundos{{etapa="{_escapar(nombre)}"}} {segundos}'
+                   for nombre, segundos in ARRANQUE.items()]
+    if cache is not None:
+        consultas = cache.aciertos + cache.fallos
+        lineas += _valor('api_cache_aciertos_total', 'Respuestas servidas desde la cache', 'counter', cache.aciertos)
+        lineas += _valor('api_cache_fallos_total', 'Respuestas que no estaban en la cache', 'counter', cache.fallos)
+        lineas += _valor('api_cache_tasa_aciertos', 'Aciertos / consultas a la cache', 'gauge',
+                         f'{cache.aciertos / consultas:.4f}' if consultas else 0)
+        lineas += _valor('api_cache_entradas', 'Respuestas guardadas en memoria', 'gauge', len(cache.entradas))
+    if callable(datos):
+        # Datos que se cargan al primer uso: sin cargar todavía, no se reportan
+        datos = datos()
+    if datos is not None:
+        instantanea = datos.actual
+        lineas += _valor('api_datos_filas', 'Registros cargados', 'gauge', len(instantanea.df))
+        lineas += _valor('api_datos_bytes', 'Memoria del DataFrame (sin contar textos)', 'gauge',
+                         int(instantanea.df.memory_usage(index=False).sum()))
+        lineas += _valor('api_datos_secuencia', 'Último cambio aplicado del registro de cambios', 'gauge',
+                         instantanea.secuencia)
+    lineas += _valor('api_memoria_rss_bytes', 'Memoria residente del proceso', 'gauge', _memoria_rss())
+    lineas += _valor('api_memoria_pico_bytes', 'Máxima memoria residente del proceso', 'gauge', _memoria_pico())
+    return '\n'.join(lineas) + '\n'
+
+
+class Perfilador:
+    """Perfilado opt-in con cProfile, de a una petición a la vez"""
+
+    def __init__(self, token=None, directorio=DIRECTORIO_PERFILES):
+        self.token = token
+        self.directorio = directorio
+        self.armados = {}
+        self.candado = threading.Lock()
+        # cProfile admite un solo perfilador activo por proceso
+        self.ocupado = threading.Lock()
+
+    def armar(self, ruta, muestras=1):
+        with self.candado:
+            self.armados[ruta] = self.armados.get(ruta, 0) + muestras
+
+    def debe_perfilar(self, ruta, cabecera):
+        if not self.token:
+            return False
+        if cabecera == self.token:
+            return True
+        with self.candado:
+            if self.armados.get(ruta, 0) > 0:
+                self.armados[ruta] -= 1
+                return True
+        return False
+
+    def iniciar(self):
+        if not self.ocupado.acquire(blocking=False):
+            return None
+        perfil = cProfile.Profile()
+        perfil.enable()
+        return perfil
+
+    def terminar(self, perfil, ruta):
+        perfil.disable()
+        self.ocupado.release()
+        os.makedirs(self.directorio, exist_ok=True)
+        marca = time.strftime('%Y%m%d-%H%M%S') + f'{time.time() % 1:.3f}'[1:]
+        nombre = f"{marca}-{re.sub(r'[^A-Za-z0-9]+', '_', ruta).strip('_')}.prof"
+        perfil.dump_stats(os.path.join(self.directorio, nombre))
+        return nombre
+
+
+def instrumentar(app, cache=None, datos=None):
+    """Registra en la app Flask los tiempos por ruta, la cabecera Server-Timing,
+    el perfilado opt-in y las rutas /metrics y /metrics/perfil.
+
+    'datos' puede ser una función que devuelva los DatosVivos ya cargados o
+    None (así /metrics no fuerza la carga).
+    """
+    from flask import Response, abort, g, jsonify, request, send_from_directory
+
+    perfilador = Perfilador(os.environ.get('PERFIL_TOKEN'))
+
+    @app.before_request
+    def _inicio():
+        g.metricas_inicio = time.perf_counter()
+        g.metricas_etapas = []
+        g.metricas_token = _etapas_peticion.set(g.metricas_etapas)
+        g.metricas_perfil = None
+        if perfilador.debe_perfilar(request.path, request.headers.get('X-Perfil')):
+            g.metricas_perfil = perfilador.iniciar()
+
+    @app.after_request
+    def _fin(respuesta):
+        inicio = g.pop('metricas_inicio', None)
+        if inicio is None:
+            return respuesta
+        duracion = time.perf_counter() - inicio
+        ruta = request.url_rule.rule if request.url_rule else 'sin_ruta'
+        PETICIONES.observar(duracion, ruta, request.method, respuesta.status_code)
+
+        perfil = g.pop('metricas_perfil', None)
+        if perfil is not None:
+            respuesta.headers['X-Perfil-Archivo'] = perfilador.terminar(perfil, request.path)
+
+        etapas = g.pop('metricas_etapas', [])
+        respuesta.headers['Server-Timing'] = ', '.join(
+            [f'{nombre};dur={segundos * 1000:.2f}' for nombre, segundos in etapas]
+            + [f'total;dur={duracion * 1000:.2f}'])
+        _etapas_peticion.reset(g.pop('metricas_token'))
+        return respuesta
+
+    @app.route('/metrics', methods=['GET'])
+    def metricas():
+        return Response(texto_prometheus(cache, datos), mimetype='text/plain; version=0.0.4')
+
+    def _autorizado():
+        return perfilador.token and request.headers.get('X-Perfil') == perfilador.token
+
+    @app.route('/metrics/perfil', methods=['POST'])
+    def armar_perfil():
+        # ?ruta=/excel/negocio/filtrar&muestras=3 perfila las siguientes 3 peticiones a esa ruta
+        if not _autorizado():
+            abort(403)
+        ruta = request.args.get('ruta', type=str)
+        if not ruta:
+            return jsonify({"error": "Falta la ruta a perfilar (?ruta=...)"}), 400
+        muestras = request.args.get('muestras', default=1, type=int)
+        perfilador.armar(ruta, muestras)
+        return jsonify({"mensaje": "Perfilado armado", "ruta": ruta, "muestras": muestras}), 200
+
+    @app.route('/metrics/perfil/<nombre>', methods=['GET'])
+    def descargar_perfil(nombre):
+        if not _autorizado():
+            abort(403)
+        return send_from_directory(perfilador.directorio, nombre, as_attachment=True)
+
+    return perfilador
@@ -0,0 +1,242 @@
+import numpy as np
+import pandas as pd
+
+import busqueda
+from sinergias import normalizar_nombres
+
+OPERADORES = ('igual', 'prefijo', 'contiene', 'similar', 'rango', 'mayor', 'menor', 'caja')
+
+# Puntaje mínimo de búsqueda difusa para el operador 'similar' (además
+# cada palabra del valor debe parecerse a alguna del nombre)
+UMBRAL_SIMILAR = 0.5
+
+
+def _normalizar(valor):
+    return busqueda.normalizar(valor)
+
+
+def _numeros(valor, formato):
+    """Los números separados por comas de 'valor'; ValueError si no siguen 'formato'"""
+    partes = str(valor).split(',')
+    try:
+        if len(partes) == formato.count(',') + 1:
+            return [float(parte) for parte in partes]
+    except ValueError:
+        pass
+    raise ValueError(f"Valor '{valor}' inválido: se espera '{formato}'")
+
+
+class IndiceTexto:
+    """Índices de una columna de texto: hash valor -> filas y valores ordenados.
+
+    Los valores se comparan normalizados (sin acentos, mayúsculas, sin
+    espacios sobrantes). La búsqueda difusa se construye al primer uso o se
+    recibe ya hecha ('indice_busqueda', guardado con el almacén).
+    """
+
+    def __init__(self, serie, indice_busqueda=None):
+        categorica = serie if isinstance(serie.dtype, pd.CategoricalDtype) else serie.astype('category')
+        codigos = categorica.cat.codes.to_numpy()
+        normalizados = normalizar_nombres(pd.Series(categorica.cat.categories))
+
+        # Varias categorías pueden normalizarse igual ("X" y "X  "): se agrupan
+        grupos, unicos = pd.factorize(normalizados)
+        grupo_fila = np.where(codigos >= 0, grupos[np.maximum(codigos, 0)], -1)
+
+        # Filas ordenadas por grupo: cada grupo es un tramo contiguo
+        self.grupo_fila = grupo_fila
+        self.filas = np.argsort(grupo_fila, kind='stable')
+        limites = np.searchsorted(grupo_fila[self.filas], np.arange(len(unicos) + 1))
+        self.inicios, self.fines = limites[:-1], limites[1:]
+        self.hash = {valor: i for i, valor in enumerate(unicos)}
+
+        # Valores ordenados para búsquedas binarias por prefijo
+        self.orden = np.argsort(np.asarray(unicos, dtype=object)).astype(np.int64)
+        self.ordenados = np.asarray(unicos, dtype=object)[self.orden]
+        self.unicos = pd.Series(unicos)
+
+        if indice_busqueda is not None and indice_busqueda.huella != busqueda.huella_nombres(unicos):
+            indice_busqueda = None
+        self._busqueda = indice_busqueda
+
+    @property
+    def busqueda(self):
+        if self._busqueda is None:
+            self._busqueda = busqueda.IndiceBusqueda(self.unicos)
+        return self._busqueda
+
+    def _filas_de(self, grupos):
+        if len(grupos) == 0:
+            return np.empty(0, dtype=np.int64)
+        if len(grupos) > 64:
+            # Con muchos grupos sale más barato marcar las filas que concatenar tramos
+            marcados = np.zeros(len(self.inicios) + 1, dtype=bool)
+            marcados[np.asarray(grupos)] = True
+            return np.flatnonzero(marcados[self.grupo_fila])
+        return np.sort(np.concatenate([self.filas[self.inicios[g]:self.fines[g]] for g in grupos]))
+
+    def igual(self, valor):
+        grupo = self.hash.get(_normalizar(valor))
+        return self._filas_de([] if grupo is None else [grupo])
+
+    def prefijo(self, valor):
+        valor = _normalizar(valor)
+        inicio = np.searchsorted(self.ordenados, valor, side='left')
+        fin = np.searchsorted(self.ordenados, valor + '\uffff', side='left')
+        return self._filas_de(self.orden[inicio:fin])
+
+    def contiene(self, valor):
+        # Se revisan los valores distintos, no cada fila
+        grupos = np.flatnonzero(self.unicos.str.contains(_normalizar(valor), regex=False).to_numpy())
+        return self._filas_de(grupos)
+
+    def similares(self, consulta, k=10, minimo=0.3):
+        """Valores (normalizados) más parecidos a la consulta, con su puntaje"""
+        grupos, puntajes = self.busqueda.buscar(consulta, k, minimo)
+        return list(zip(self.unicos.to_numpy()[grupos].tolist(), puntajes.tolist()))
+
+    def similar(self, consulta):
+        grupos, _ = self.busqueda.buscar(consulta, k=None, minimo=UMBRAL_SIMILAR, todas=True)
+        return self._filas_de(grupos)
+
+
+class IndiceNumerico:
+    """Valores ordenados de una columna numérica para consultas por rango"""
+
+    def __init__(self, serie):
+        # Tipo de la columna: 'igual' redondea la consulta igual que los datos (float32)
+        tipo = np.dtype(getattr(serie.dtype, 'numpy_dtype', serie.dtype))
+        self.tipo = tipo if np.issubdtype(tipo, np.floating) else np.dtype(np.float64)
+        valores = serie.to_numpy(dtype=np.float64)
+        validos = np.flatnonzero(~np.isnan(valores))
+        self.orden = validos[np.argsort(valores[validos], kind='stable')]
+        self.ordenados = valores[self.orden]
+
+    def rango(self, minimo=-np.inf, maximo=np.inf):
+        inicio = np.searchsorted(self.ordenados, minimo, side='left')
+        fin = np.searchsorted(self.ordenados, maximo, side='right')
+        return np.sort(self.orden[inicio:fin])
+
+    def igual(self, valor):
+        valor = float(np.asarray(float(valor), dtype=self.tipo))
+        return self.rango(valor, valor)
+
+
+class MotorFiltros:
+    """Filtros que trabajan con posiciones de fila; solo al final se arma el DataFrame.
+
+    Tras una actualización los índices no se reconstruyen: las filas cambiadas
+    ('sucias') se excluyen de los índices base y se evalúan directamente.
+    """
+
+    # Si cambia más que esta fracción de filas conviene reconstruir los índices
+    LIMITE_SUCIAS = 0.02
+
+    def __init__(self, df, busquedas=None):
+        self.df = df
+        self.base = df
+        self.indices = {}
+        # Índices de búsqueda difusa ya construidos (por columna), p. ej. cargados del almacén
+        self.busquedas = busquedas or {}
+        self.sucias = np.empty(0, dtype=np.int64)
+
+    def con_cambios(self, df, posiciones):
+        """Motor para la nueva versión 'df' que comparte los índices de este"""
+        sucias = np.union1d(self.sucias, np.asarray(posiciones, dtype=np.int64))
+        if len(sucias) > self.LIMITE_SUCIAS * len(df):
+            return MotorFiltros(df)
+        nuevo = MotorFiltros(df)
+        nuevo.base = self.base
+        nuevo.indices = self.indices
+        nuevo.busquedas = self.busquedas
+        nuevo.sucias = sucias
+        return nuevo
+
+    def indice(self, columna):
+        # Cada índice se construye la primera vez que se usa su columna,
+        # siempre sobre la versión base (la de los índices compartidos)
+        if columna not in self.indices:
+            if columna not in self.base.columns:
+                raise KeyError(f"La columna '{columna}' no existe")
+            serie = self.base[columna]
+            if pd.api.types.is_numeric_dtype(serie) and not isinstance(serie.dtype, pd.CategoricalDtype):
+                self.indices[columna] = IndiceNumerico(serie)
+            else:
+                self.indices[columna] = IndiceTexto(serie, self.busquedas.get(columna))
+        return self.indices[columna]
+
+    def posiciones(self, columna, operador, valor):
+        """Posiciones (ordenadas) de las filas que cumplen un predicado"""
+        resultado = self._posiciones_base(columna, operador, valor)
+        if len(self.sucias) == 0:
+            return resultado
+
+        # Las filas cambiadas se evalúan sobre sus valores actuales
+        resultado = np.setdiff1d(resultado, self.sucias, assume_unique=True)
+        cambiadas = MotorFiltros(self.df.iloc[self.sucias].reset_index(drop=True))
+        cumplen = self.sucias[cambiadas.posiciones(columna, operador, valor)]
+        return np.union1d(resultado, cumplen)
+
+    def _posiciones_base(self, columna, operador, valor):
+        if operador not in OPERADORES:
+            raise ValueError(f"Operador '{operador}' no soportado. Usa uno de: {', '.join(OPERADORES)}")
+
+        if operador == 'caja':
+            lat_min, lon_min, lat_max, lon_max = _numeros(valor, 'lat_min,lon_min,lat_max,lon_max')
+            return np.intersect1d(self.indice('latitud').rango(lat_min, lat_max),
+                                  self.indice('longitud').rango(lon_min, lon_max),
+                                  assume_unique=True)
+
+        indice = self.indice(columna)
+        if isinstance(indice, IndiceNumerico):
+            if operador == 'igual':
+                return indice.igual(valor)
+            if operador == 'mayor':
+                return indice.rango(minimo=float(valor))
+            if operador == 'menor':
+                return indice.rango(maximo=float(valor))
+            if operador == 'rango':
+                minimo, maximo = _numeros(valor, 'minimo,maximo')
+                return indice.rango(minimo, maximo)
+        else:
+            if operador == 'igual':
+                return indice.igual(valor)
+            if operador == 'prefijo':
+                return indice.prefijo(valor)
+            if operador == 'contiene':
+                return indice.contiene(valor)
+            if operador == 'similar':
+                return indice.similar(valor)
+        raise ValueError(f"El operador '{operador}' no aplica a la columna '{columna}'")
+
+    def buscar(self, columna, consulta, k=10):
+        """Búsqueda difusa: los k valores más parecidos, con puntaje y filas de cada uno"""
+        candidatos = dict(self.indice(columna).similares(consulta, 2 * k))
+        if len(self.sucias):
+            # Valores que solo aparecen en filas cambiadas (nombres nuevos)
+            cambiadas = MotorFiltros(self.df.iloc[self.sucias].reset_index(drop=True))
+            for valor, puntaje in cambiadas.indice(columna).similares(consulta, 2 * k):
+                candidatos[valor] = max(puntaje, candidatos.get(valor, 0))
+
+        resultados = []
+        for valor, puntaje in sorted(candidatos.items(), key=lambda c: -c[1]):
+            # 'igual' ya toma en cuenta las filas cambiadas
+            filas = self.posiciones(columna, 'igual', valor)
+            if len(filas):
+                resultados.append((valor, puntaje, filas))
+            if len(resultados) == k:
+                break
+        return resultados
+
+    def filtrar(self, predicados):
+        """Intersección de varios predicados (columna, operador, valor)"""
+        resultado = None
+        for columna, operador, valor in predicados:
+            posiciones = self.posiciones(columna, operador, valor)
+            resultado = posiciones if resultado is None else np.intersect1d(
+                resultado, posiciones, assume_unique=True)
+            if len(resultado) == 0:
+                break
+        if resultado is None:
+            return np.arange(len(self.df))
+        return resultado
@@ -0,0 +1,289 @@
+"""Negociación de formato y compresión de las respuestas.
+
+Las rutas de datos contestan en el formato que pida el cliente, con
+?formato= o con la cabecera Accept:
+
+    json      application/json                   (por defecto, una fila por objeto)
+    ndjson    application/x-ndjson               (solo /excel/negocio/datos)
+    columnas  application/vnd.columnas+json      (JSON por columnas, textos como diccionario)
+    msgpack   application/msgpack                (mismo contenido que columnas, binario;
+                                                  también application/x-msgpack y application/vnd.msgpack)
+    arrow     application/vnd.apache.arrow.stream (Arrow IPC; requiere pyarrow)
+    png       image/png                          (solo /tiles)
+
+Un formato pedido con ?formato= que la ruta no tiene se contesta con 406;
+si viene solo en Accept se usa el de por defecto. Las respuestas de estos
+tipos (menos PNG) se comprimen con brotli (si está instalado) o gzip según Accept-Encoding.
+
+Este módulo no importa pandas: lo usa también la entrada ligera de Vercel.
+"""
+import gzip
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+from werkzeug.datastructures import Accept, MIMEAccept
+from werkzeug.http import parse_accept_header
+
+import metricas
+
+try:
+    import brotli
+except ImportError:
+    # Sin brotli solo se ofrece gzip
+    brotli = None
+
+# Formato -> tipo MIME
+TIPOS = {
+    "json": "application/json",
+    "ndjson": "application/x-ndjson",
+    "columnas": "application/vnd.columnas+json",
+    "msgpack": "application/msgpack",
+    "arrow": "application/vnd.apache.arrow.stream",
+    "png": "image/png",
+}
+
+# Otros tipos MIME con los que los clientes piden un formato
+ALIAS = {
+    "application/x-msgpack": "msgpack",
+    "application/vnd.msgpack": "msgpack",
+}
+
+# Formatos de las rutas que devuelven un objeto (no una tabla)
+FORMATOS_OBJETO = ('json', 'msgpack')
+
+# Respuestas más chicas no se comprimen (la cabecera gzip y el CPU no se pagan)
+MINIMO_COMPRIMIR = 1024
+
+NIVEL_GZIP = 6
+CALIDAD_BROTLI = 5
+
+# Cuerpos ya comprimidos por (ETag, codificación): las respuestas de la cache no se recomprimen
+CAPACIDAD_COMPRIMIDAS = 64
+
+
+class FormatoNoDisponible(ValueError):
+    pass
+
+
+def elegir(formato, accept, disponibles):
+    """Formato de la respuesta: el de ?formato= o el mejor de Accept entre los disponibles.
+
+    El primero de 'disponibles' es el que se usa sin preferencia (o con */*).
+    """
+    if formato:
+        if formato not in disponibles:
+            raise FormatoNoDisponible(
+                f"Formato '{formato}' no disponible; usa uno de: {', '.join(disponibles)}")
+        return formato
+    if not accept:
+        return disponibles[0]
+    nombres = {TIPOS[nombre]: nombre for nombre in disponibles}
+    nombres.update({tipo: nombre for tipo, nombre in ALIAS.items() if nombre in disponibles})
+    elegido = parse_accept_header(accept, MIMEAccept).best_match(list(nombres))
+    return nombres[elegido] if elegido else disponibles[0]
+
+
+def codificaciones():
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def codificacion(accept_encoding):
+    """'br', 'gzip' o None según la cabecera Accept-Encoding"""
+    if not accept_encoding:
+        return None
+    return parse_accept_header(accept_encoding, Accept).best_match(codificaciones())
+
+
+def comprimir(cuerpo, codificacion):
+    if codificacion == 'br':
+        return brotli.compress(cuerpo, quality=CALIDAD_BROTLI)
+    # mtime=0: el mismo cuerpo da siempre los mismos bytes
+    return gzip.compress(cuerpo, compresslevel=NIVEL_GZIP, mtime=0)
+
+
+def comprimir_partes(partes, codificacion):
+    """Comprime una respuesta que se envía por partes sin juntarla en memoria"""
+    if codificacion == 'br':
+        compresor = brotli.Compressor(quality=CALIDAD_BROTLI)
+        agregar, terminar = compresor.process, compresor.finish
+    else:
+        compresor = zlib.compressobj(NIVEL_GZIP, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        agregar, terminar = compresor.compress, compresor.flush
+    for parte in partes:
+        comprimida = agregar(parte)
+        if comprimida:
+            yield comprimida
+    yield terminar()
+
+
+class _Comprimidas:
+    """LRU chico de cuerpos comprimidos por (ETag, codificación)"""
+
+    def __init__(self, capacidad=CAPACIDAD_COMPRIMIDAS):
+        self.capacidad = capacidad
+        self.entradas = OrderedDict()
+        self.candado = threading.Lock()
+
+    def obtener(self, clave, cuerpo, codificacion):
+        with self.candado:
+            if clave in self.entradas:
+                self.entradas.move_to_end(clave)
+                return self.entradas[clave]
+        comprimido = comprimir(cuerpo, codificacion)
+        with self.candado:
+            self.entradas[clave] = comprimido
+            while len(self.entradas) > self.capacidad:
+                self.entradas.popitem(last=False)
+        return comprimido
+
+
+def comprimir_respuestas(app, minimo=MINIMO_COMPRIMIR):
+    """Registra en la app Flask la compresión (brotli/gzip) de las respuestas de datos"""
+    from flask import request
+
+    # PNG ya viene comprimido
+    tipos = set(TIPOS.values()) - {TIPOS["png"]}
+    comprimidas = _Comprimidas()
+
+    @app.after_request
+    def _comprimir(respuesta):
+        if respuesta.mimetype not in tipos:
+            return respuesta
+        respuesta.vary.add('Accept')
+        respuesta.vary.add('Accept-Encoding')
+        elegida = codificacion(request.headers.get('Accept-Encoding'))
+        if (elegida is None or respuesta.status_code != 200 or respuesta.direct_passthrough
+                or 'Content-Encoding' in respuesta.headers):
+            return respuesta
+
+        etag, _ = respuesta.get_etag()
+        with metricas.etapa('compresion'):
+            if respuesta.is_streamed:
+                partes = respuesta.iter_encoded()
+                respuesta.response = comprimir_partes(partes, elegida)
+                respuesta.headers.pop('Content-Length', None)
+            else:
+                cuerpo = respuesta.get_data()
+                if len(cuerpo) < minimo:
+                    return respuesta
+                if etag:
+                    respuesta.set_data(comprimidas.obtener((etag, elegida), cuerpo, elegida))
+                else:
+                    respuesta.set_data(comprimir(cuerpo, elegida))
+        respuesta.headers['Content-Encoding'] = elegida
+        if etag:
+            # Los bytes ya no son los de la ETag fuerte: misma representación, ETag débil
+            respuesta.set_etag(etag, weak=True)
+        return respuesta
+
+
+# MessagePack (https://msgpack.org): los arreglos numpy se escriben de una vez,
+# sin pasar por un objeto de Python por valor
+
+def _cabecera(n, corta, base16, base32, limite_corta=16):
+    if n < limite_corta:
+        return bytes([corta | n])
+    if n < 1 << 16:
+        return struct.pack('>BH', base16, n)
+    return struct.pack('>BI', base32, n)
+
+
+def _entero(valor):
+    if -32 <= valor < 128:
+        return struct.pack('>b', valor)
+    if valor < 1 << 63:
+        return struct.pack('>Bq', 0xd3, valor)
+    return struct.pack('>BQ', 0xcf, valor)
+
+
+def _texto(valor):
+    datos = valor.encode('utf-8')
+    n = len(datos)
+    if n < 32:
+        return bytes([0xa0 | n]) + datos
+    if n < 1 << 8:
+        return struct.pack('>BB', 0xd9, n) + datos
+    if n < 1 << 16:
+        return struct.pack('>BH', 0xda, n) + datos
+    return struct.pack('>BI', 0xdb, n) + datos
+
+
+def _arreglo(valores):
+    """Un arreglo numpy 1D como arreglo de MessagePack; NaN y valores enmascarados como nil"""
+    nulos = np.ma.getmaskarray(valores) if np.ma.isMaskedArray(valores) else None
+    valores = np.ma.getdata(valores)
+    cabecera = _cabecera(len(valores), 0x90, 0xdc, 0xdd)
+    if len(valores) == 0:
+        return cabecera
+
+    if valores.dtype.kind == 'f':
+        nulos = np.isnan(valores) if nulos is None else nulos | np.isnan(valores)
+        marca, tipo = (0xca, '>f4') if valores.dtype == np.float32 else (0xcb, '>f8')
+    elif valores.dtype.kind in 'iu':
+        validos = valores[~nulos] if nulos is not None else valores
+        minimo, maximo = (int(validos.min()), int(validos.max())) if len(validos) else (0, 0)
+        if 0 <= minimo and maximo < 128:
+            # positive fixint: un byte por valor, sin marca
+            marca, tipo = None, 'u1'
+        elif -(1 << 15) <= minimo and maximo < 1 << 15:
+            marca, tipo = 0xd1, '>i2'
+        elif -(1 << 31) <= minimo and maximo < 1 << 31:
+            marca, tipo = 0xd2, '>i4'
+        else:
+            marca, tipo = 0xd3, '>i8'
+    elif valores.dtype.kind == 'b':
+        bytes_ = np.where(valores, 0xc3, 0xc2).astype(np.uint8)
+        if nulos is not None:
+            bytes_[nulos] = 0xc0
+        return cabecera + bytes_.tobytes()
+    else:
+        if nulos is not None:
+            valores = np.where(nulos, None, valores.astype(object))
+        return cabecera + b''.join(_empaquetar(valor) for valor in valores.tolist())
+
+    if marca is None:
+        datos = valores.astype(np.uint8).reshape(-1, 1)
+    else:
+        registros = np.empty(len(valores), dtype=[('marca', 'u1'), ('valor', tipo)])
+        registros['marca'] = marca
+        registros['valor'] = valores
+        datos = registros.view(np.uint8).reshape(len(valores), -1)
+    if nulos is None or not nulos.any():
+        return cabecera + datos.tobytes()
+    # Los nulos quedan en un solo byte (nil): se quitan los demás bytes de esas filas
+    datos[nulos, 0] = 0xc0
+    conservar = np.ones(datos.shape, dtype=bool)
+    conservar[nulos, 1:] = False
+    return cabecera + datos[conservar].tobytes()
+
+
+def _empaquetar(objeto):
+    if objeto is None:
+        return b'\xc0'
+    if isinstance(objeto, (bool, np.bool_)):
+        return b'\xc3' if objeto else b'\xc2'
+    if isinstance(objeto, (int, np.integer)):
+        return _entero(int(objeto))
+    if isinstance(objeto, (float, np.floating)):
+        return struct.pack('>Bd', 0xcb, float(objeto))
+    if isinstance(objeto, str):
+        return _texto(objeto)
+    if isinstance(objeto, (bytes, bytearray)):
+        return _cabecera(len(objeto), 0, 0xc5, 0xc6, limite_corta=0) + bytes(objeto)
+    if isinstance(objeto, dict):
+        return _cabecera(len(objeto), 0x80, 0xde, 0xdf) + b''.join(
+            _empaquetar(str(clave)) + _empaquetar(valor) for clave, valor in objeto.items())
+    if isinstance(objeto, np.ndarray) and objeto.ndim == 1:
+        return _arreglo(objeto)
+    if isinstance(objeto, (list, tuple, np.ndarray)):
+        return _cabecera(len(objeto), 0x90, 0xdc, 0xdd) + b''.join(_empaquetar(v) for v in objeto)
+    # Como json.dumps(default=str)
+    return _texto(str(objeto))
+
+
+def empaquetar(objeto):
+    """MessagePack de dicts, listas, escalares y arreglos numpy (NaN y enmascarados como nil)"""
+    return _empaquetar(objeto)
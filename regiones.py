@@ -0,0 +1,260 @@
+"""Datos separados por región (municipio del DENUE).
+
+Cada región tiene su CSV (datos_<region>.csv), su almacén columnar
+(datos_<region>.col, con su registro de cambios y agregados) y sus zonas.
+Una región se carga la primera vez que una petición la usa; si la memoria
+estimada de las regiones cargadas pasa del presupuesto se descargan las
+usadas hace más tiempo (LRU). La región por defecto no se descarga.
+
+El catálogo regiones.json lo escribe filtrar_datos.py: límites (para
+saber a qué región pertenecen unas coordenadas), registros y, para
+regiones nuevas, sus zonas.
+"""
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import artefacto
+from zonas import ZONAS_CONOCIDAS
+
+# Catálogo de regiones que genera filtrar_datos.py
+RUTA_CATALOGO = 'regiones.json'
+
+PLANTILLA_CSV = 'datos_{region}.csv'
+PLANTILLA_COLUMNAR = 'datos_{region}.col'
+
+# Región de las peticiones que no indican otra (ni zona ni coordenadas)
+REGION_POR_DEFECTO = 'ensenada'
+
+# Regiones conocidas aunque no estén en el catálogo: municipio del DENUE, nombre,
+# zonas y, si se conoce, la caja de coordenadas válidas que usa la limpieza de
+# filtrar_datos.py (lat_min, lon_min, lat_max, lon_max)
+REGIONES = {
+    "ensenada": {"municipio": 1, "nombre": "Ensenada", "zonas": ZONAS_CONOCIDAS,
+                 "limites_validos": [28.0, -117.2, 32.75, -112.5]},
+}
+
+# Memoria (estimada) que pueden ocupar a la vez las regiones cargadas
+PRESUPUESTO_BYTES = int(float(os.environ.get('REGIONES_MEMORIA_MB', 512)) * 1024 * 1024)
+
+# Módulos cuyos objetos se recorren al estimar la memoria de los índices
+MODULOS_INDICES = ('indice_espacial', 'motor_filtros', 'busqueda')
+
+
+class RegionDesconocida(LookupError):
+    pass
+
+
+def ruta_csv(region):
+    return PLANTILLA_CSV.format(region=region)
+
+
+def directorio(region):
+    return PLANTILLA_COLUMNAR.format(region=region)
+
+
+def clave_municipio(municipio):
+    """Clave de la región de un municipio (municipio_<n> si no está en REGIONES)"""
+    for clave, region in REGIONES.items():
+        if region["municipio"] == int(municipio):
+            return clave
+    return f'municipio_{int(municipio)}'
+
+
+def _leer(ruta):
+    try:
+        with open(ruta, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def cargar_catalogo(ruta=RUTA_CATALOGO):
+    """REGIONES más lo guardado en el catálogo: clave -> datos de la región"""
+    catalogo = {clave: dict(region) for clave, region in REGIONES.items()}
+    for clave, guardada in _leer(ruta).items():
+        region = catalogo.setdefault(clave, {"nombre": clave, "zonas": {}})
+        region.update(guardada)
+        region["zonas"] = {nombre: tuple(valores) for nombre, valores in region.get("zonas", {}).items()}
+    return catalogo
+
+
+def registrar(region, limites, filas, municipio=None, ruta=RUTA_CATALOGO):
+    """Guarda en el catálogo los límites [lat_min, lon_min, lat_max, lon_max] de una región"""
+    catalogo = _leer(ruta)
+    entrada = catalogo.setdefault(region, {})
+    entrada.update({"limites": [round(float(v), 6) for v in limites], "filas": int(filas)})
+    if municipio is not None:
+        entrada["municipio"] = int(municipio)
+    temporal = ruta + '.tmp'
+    with open(temporal, 'w', encoding='utf-8') as f:
+        json.dump(catalogo, f, ensure_ascii=False, indent=2)
+    os.replace(temporal, ruta)
+
+
+def _bytes_indices(*objetos):
+    # Arreglos numpy propios de los índices (los abiertos con mmap no cuentan)
+    vistos, pendientes, total = set(), list(objetos), 0
+    while pendientes:
+        objeto = pendientes.pop()
+        if id(objeto) in vistos:
+            continue
+        vistos.add(id(objeto))
+        if isinstance(objeto, np.ndarray):
+            if not artefacto.compartido(objeto):
+                total += objeto.nbytes
+        elif isinstance(objeto, dict):
+            pendientes.extend(objeto.values())
+        elif isinstance(objeto, (list, tuple)):
+            pendientes.extend(objeto)
+        elif type(objeto).__module__ in MODULOS_INDICES:
+            pendientes.extend(vars(objeto).values())
+    return total
+
+
+def memoria(datos):
+    """Memoria aproximada de unos DatosVivos: la tabla más los índices"""
+    import almacen
+    instantanea = datos.instantanea()
+    return (almacen.uso_memoria(instantanea.df)["privada_bytes"]
+            + _bytes_indices(instantanea.indice, instantanea.motor))
+
+
+class Regiones:
+    """Los DatosVivos de cada región, cargados al primer uso y con presupuesto de memoria"""
+
+    def __init__(self, catalogo=None, presupuesto=PRESUPUESTO_BYTES, por_defecto=REGION_POR_DEFECTO):
+        self.catalogo = catalogo if catalogo is not None else cargar_catalogo()
+        self.presupuesto = presupuesto
+        self.por_defecto = por_defecto
+        # clave -> (DatosVivos, bytes); de la menos a la más recién usada
+        self.cargadas = OrderedDict()
+        self.descargas = 0
+        self._candado = threading.Lock()
+        self._cargando = {}
+
+    def region(self, clave):
+        if clave not in self.catalogo:
+            raise RegionDesconocida(f"Región '{clave}' no encontrada")
+        return self.catalogo[clave]
+
+    def zonas(self, clave):
+        return self.region(clave).get("zonas", {})
+
+    def cargada(self, clave):
+        return clave in self.cargadas
+
+    def ruta(self, region=None, zona=None, lat=None, lon=None):
+        """Región de una petición: la indicada, la que tiene la zona o la que contiene el punto"""
+        if region:
+            self.region(region)
+            return region
+        if zona:
+            for clave in [self.por_defecto] + [c for c in self.catalogo if c != self.por_defecto]:
+                if zona in self.catalogo.get(clave, {}).get("zonas", {}):
+                    return clave
+            raise RegionDesconocida(f"Zona '{zona}' no encontrada")
+        if lat is not None and lon is not None:
+            return self.region_de_punto(lat, lon) or self.por_defecto
+        return self.por_defecto
+
+    def region_de_punto(self, lat, lon):
+        """La región cuyos límites contienen el punto (la más chica si hay varias), o None"""
+        candidatas = []
+        for clave, region in self.catalogo.items():
+            limites = region.get("limites")
+            if limites and limites[0] <= lat <= limites[2] and limites[1] <= lon <= limites[3]:
+                candidatas.append(((limites[2] - limites[0]) * (limites[3] - limites[1]), clave))
+        return min(candidatas)[1] if candidatas else None
+
+    def zonas_todas(self):
+        """Zonas de todas las regiones (si un nombre se repite, gana la región por defecto)"""
+        todas = {}
+        for clave in [self.por_defecto] + [c for c in self.catalogo if c != self.por_defecto]:
+            for nombre, zona in self.catalogo.get(clave, {}).get("zonas", {}).items():
+                todas.setdefault(nombre, zona)
+        return todas
+
+    def agrupar(self, centros, por_defecto=None):
+        """Posiciones de los centros (nombre, lat, lon) agrupadas por la región que los contiene"""
+        grupos = {}
+        for posicion, (_, lat, lon) in enumerate(centros):
+            clave = self.region_de_punto(lat, lon) or por_defecto or self.por_defecto
+            grupos.setdefault(clave, []).append(posicion)
+        return grupos
+
+    def fijar(self, clave, datos):
+        """Registra datos ya cargados de una región (p. ej. la de por defecto)"""
+        with self._candado:
+            self.cargadas[clave] = (datos, memoria(datos))
+            self._recortar(clave)
+
+    def datos(self, clave=None):
+        """DatosVivos de la región; la primera vez se cargan del disco"""
+        clave = clave or self.por_defecto
+        region = self.region(clave)
+        with self._candado:
+            if clave in self.cargadas:
+                self.cargadas.move_to_end(clave)
+                return self.cargadas[clave][0]
+            candado = self._cargando.setdefault(clave, threading.Lock())
+
+        # Otras regiones siguen atendiéndose mientras esta se carga
+        with candado:
+            with self._candado:
+                if clave in self.cargadas:
+                    return self.cargadas[clave][0]
+            cargados = self._cargar(clave, region)
+            tamano = memoria(cargados)
+            with self._candado:
+                self.cargadas[clave] = (cargados, tamano)
+                self._recortar(clave)
+        return cargados
+
+    def _cargar(self, clave, region):
+        import datos_vivos
+        ruta = None
+        if os.environ.get('RUTA_CAMBIOS') and clave != self.por_defecto:
+            # RUTA_CAMBIOS es el registro de la región por defecto; las demás van a su lado
+            ruta = os.path.join(os.path.dirname(os.environ['RUTA_CAMBIOS']),
+                                f'{clave}.{datos_vivos.ARCHIVO_CAMBIOS}')
+        return datos_vivos.DatosVivos.desde_disco(
+            region.get("csv") or ruta_csv(clave), region.get("directorio") or directorio(clave),
+            ruta=ruta, zonas=region.get("zonas", {}), limites=region.get("limites"))
+
+    def _recortar(self, protegida):
+        # Descarga las menos usadas hasta entrar en el presupuesto
+        total = sum(tamano for _, tamano in self.cargadas.values())
+        for clave in list(self.cargadas):
+            if total <= self.presupuesto:
+                break
+            if clave in (protegida, self.por_defecto):
+                continue
+            total -= self.cargadas.pop(clave)[1]
+            self.descargas += 1
+
+    def resumen(self):
+        cargadas = dict(self.cargadas)
+        return {
+            "por_defecto": self.por_defecto,
+            "presupuesto_bytes": self.presupuesto,
+            "en_memoria_bytes": sum(tamano for _, tamano in cargadas.values()),
+            "descargas": self.descargas,
+            "regiones": {
+                clave: {
+                    "nombre": region.get("nombre", clave),
+                    "municipio": region.get("municipio"),
+                    "registros": region.get("filas"),
+                    "limites": region.get("limites"),
+                    "zonas": list(region.get("zonas", {})),
+                    "cargada": clave in cargadas,
+                    "memoria_bytes": cargadas[clave][1] if clave in cargadas else None,
+                    # Resumen de la última recarga en caliente del almacén (datos_vivos)
+                    "ultima_recarga": cargadas[clave][0].ultima_recarga if clave in cargadas else None
+                }
+                for clave, region in self.catalogo.items()
+            }
+        }
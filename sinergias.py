@@ -0,0 +1,137 @@
+import numpy as np
+import pandas as pd
+
+from indice_espacial import haversine_km
+
+# Tabla de sinergias: negocios "ancla" que atraen clientes y el negocio
+# complementario que debería existir cerca de ellos
+SINERGIAS = {
+    "educacion": {
+        "ancla": r"\b(?:ESCUELA|PRIMARIA|SECUNDARIA|PREPARATORIA|BACHILLERATO|JARDIN DE NINOS|KINDER|COLEGIO|UNIVERSIDAD|CONALEP|CECYTE|CBTIS)\b",
+        "complemento": r"\b(?:PAPELERIA|LIBRERIA|FOTOCOPIAS|COPIAS|UTILES ESCOLARES)\b",
+        "oportunidad": "Papelería / Tienda de útiles",
+    },
+    "salud": {
+        "ancla": r"\b(?:HOSPITAL|CLINICA|CONSULTORIO|CENTRO DE SALUD|UNIDAD MEDICA|IMSS|ISSSTE|CRUZ ROJA|LABORATORIO CLINICO)\b",
+        "complemento": r"\b(?:FARMACIA|BOTICA|DROGUERIA)\b",
+        "oportunidad": "Farmacia / Productos médicos",
+    },
+    "deporte": {
+        "ancla": r"\b(?:GIMNASIO|GYM|FITNESS|CROSSFIT|DEPORTIVO|UNIDAD DEPORTIVA|ALBERCA)\b",
+        "complemento": r"\b(?:SUPLEMENTOS?|NUTRICION DEPORTIVA|ARTICULOS DEPORTIVOS|ROPA DEPORTIVA)\b",
+        "oportunidad": "Suplementos / Ropa deportiva",
+    },
+}
+
+ROLES = ["ancla", "complemento"]
+
+# Radio en el que un complemento "cubre" a su ancla
+RADIO_COMPLEMENTO_KM = 0.5
+
+
+def normalizar_nombres(serie):
+    """Mayúsculas, sin acentos y sin espacios sobrantes (operaciones vectorizadas)"""
+    return (serie.astype(str)
+            .str.normalize('NFKD')
+            .str.encode('ascii', errors='ignore')
+            .str.decode('ascii')
+            .str.upper()
+            .str.replace(r'\s+', ' ', regex=True)
+            .str.strip())
+
+
+def clasificar(df):
+    """Agrega las columnas categóricas 'sinergia' y 'rol_sinergia'.
+
+    La clasificación se hace sobre los nombres únicos y se guarda en el
+    DataFrame, así que llamadas posteriores no vuelven a procesar texto.
+    """
+    if 'sinergia' in df.columns and 'rol_sinergia' in df.columns:
+        return df
+
+    nombres = pd.Categorical(df['categoria_negocio'].astype(object).fillna(''))
+    sinergia_unicos, rol_unicos = clasificar_nombres(nombres.categories)
+
+    codigos = nombres.codes
+    df = df.copy()
+    df['sinergia'] = pd.Categorical.from_codes(sinergia_unicos[codigos], categories=list(SINERGIAS))
+    df['rol_sinergia'] = pd.Categorical.from_codes(rol_unicos[codigos], categories=ROLES)
+    return df
+
+
+def clasificar_nombres(nombres):
+    """Códigos de sinergia y de rol (-1 = ninguno) para una lista de nombres"""
+    unicos = normalizar_nombres(pd.Series(nombres, dtype=object))
+
+    # Los complementos van primero: "ARTICULOS DEPORTIVOS" no es un ancla
+    condiciones, sinergias, roles = [], [], []
+    for rol in reversed(ROLES):
+        for codigo, tabla in enumerate(SINERGIAS.values()):
+            condiciones.append(unicos.str.contains(tabla[rol], regex=True).to_numpy())
+            sinergias.append(codigo)
+            roles.append(ROLES.index(rol))
+
+    sinergia = np.select(condiciones, sinergias, default=-1).astype(np.int8)
+    rol = np.select(condiciones, roles, default=-1).astype(np.int8)
+    return sinergia, rol
+
+
+def _distancia_mas_cercana(lat_a, lon_a, lat_c, lon_c, bloque=1024):
+    """Distancia de cada ancla a su complemento más cercano, por bloques"""
+    if len(lat_c) == 0:
+        return np.full(len(lat_a), np.inf)
+    minimos = np.empty(len(lat_a))
+    for inicio in range(0, len(lat_a), bloque):
+        fin = inicio + bloque
+        matriz = haversine_km(lat_a[inicio:fin, None], lon_a[inicio:fin, None], lat_c, lon_c)
+        minimos[inicio:fin] = matriz.min(axis=1)
+    return minimos
+
+
+def buscar_oportunidades(df, indice, lat, lon, radio_km, radio_complemento_km=RADIO_COMPLEMENTO_KM):
+    """Anclas dentro del radio que no tienen su negocio complementario cerca.
+
+    'df' debe venir de clasificar() y 'indice' construido sobre las mismas filas.
+    """
+    # Los complementos justo afuera de la zona también cuentan
+    posiciones, distancias = indice.buscar_radio(lat, lon, radio_km + radio_complemento_km,
+                                                 con_distancias=True)
+    sinergia = df['sinergia'].cat.codes.to_numpy()[posiciones]
+    rol = df['rol_sinergia'].cat.codes.to_numpy()[posiciones]
+    lats = indice.lats[posiciones]
+    lons = indice.lons[posiciones]
+    nombres = df['categoria_negocio'].to_numpy()
+
+    es_ancla = (rol == ROLES.index('ancla')) & (distancias <= radio_km)
+    es_complemento = rol == ROLES.index('complemento')
+
+    oportunidades = []
+    for codigo, categoria in enumerate(SINERGIAS):
+        anclas = np.flatnonzero(es_ancla & (sinergia == codigo))
+        if len(anclas) == 0:
+            continue
+        complementos = np.flatnonzero(es_complemento & (sinergia == codigo))
+
+        # Varias anclas en el mismo punto (ej. turnos de una escuela) cuentan una vez
+        _, unicas = np.unique(np.round(np.column_stack((lats[anclas], lons[anclas])), 5),
+                              axis=0, return_index=True)
+        anclas = anclas[np.sort(unicas)]
+
+        cercania = _distancia_mas_cercana(lats[anclas], lons[anclas],
+                                          lats[complementos], lons[complementos])
+        for i in np.flatnonzero(cercania > radio_complemento_km):
+            j = anclas[i]
+            oportunidades.append({
+                "categoria_sinergia": categoria,
+                "oportunidad": SINERGIAS[categoria]["oportunidad"],
+                "ancla": str(nombres[posiciones[j]]).strip(),
+                "ancla_lat": float(lats[j]),
+                "ancla_lon": float(lons[j]),
+                "distancia_centro_km": round(float(distancias[j]), 3),
+                "distancia_complemento_km": None if np.isinf(cercania[i]) else round(float(cercania[i]), 3),
+                "confianza": "alta" if cercania[i] > 2 * radio_complemento_km else "media"
+            })
+
+    # Primero las más claras: sin complemento cerca y más al centro de la zona
+    oportunidades.sort(key=lambda op: (op["confianza"] != "alta", op["distancia_centro_km"]))
+    return oportunidades
@@ -0,0 +1,284 @@
+"""Puntaje de cualquier sitio con tablas de sumas acumuladas (summed-area tables).
+
+Para cada capa (todos los negocios, escuelas, farmacias, gimnasios...) se
+guarda la suma acumulada 2D de los conteos en una rejilla. La cantidad de
+negocios en cualquier rectángulo sale de 4 lecturas de la tabla, así que
+contar alrededor de un punto es O(1) sin importar cuántos negocios haya,
+y una rejilla de miles de sitios candidatos se puntúa en una sola llamada
+vectorizada.
+
+El círculo de radio r se aproxima con el cuadrado de la misma área (lado
+r·√π) y las esquinas se interpolan dentro de la celda (como si los negocios
+de cada celda estuvieran repartidos parejo): los conteos son aproximados.
+
+No importa pandas: la entrada ligera de Vercel arma las tablas de los .npy.
+"""
+import math
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from indice_espacial import KM_POR_GRADO
+
+# Capa -> (sinergia, rol) de sinergias.py; None = todos los negocios
+CAPAS = {
+    "todos": None,
+    "escuelas": ("educacion", "ancla"),
+    "papelerias": ("educacion", "complemento"),
+    "salud": ("salud", "ancla"),
+    "farmacias": ("salud", "complemento"),
+    "gimnasios": ("deporte", "ancla"),
+    "deportivos": ("deporte", "complemento"),
+}
+
+# Tamaño de celda de las tablas; si la rejilla pasara de MAXIMO_CELDAS se usan celdas más grandes
+CELDA_KM = 0.1
+MAXIMO_CELDAS = 1_000_000
+
+# Fracción de puntos extremos que queda fuera de la rejilla (como investigador.PERCENTIL_RECORTE)
+PERCENTIL_RECORTE = 0.5
+
+RADIO_KM = 1.0
+# Separación de los sitios candidatos de /sitios/rejilla
+PASO_KM = 0.25
+MAXIMO_RADIO_KM = 5.0
+# La rejilla cubre los radios de los sitios en su borde
+MARGEN_KM = MAXIMO_RADIO_KM
+
+# Sitios que se pueden puntuar en una petición
+MAXIMO_SITIOS = 250_000
+
+# Tablas (una por región y versión de datos) que se mantienen en memoria
+TABLAS_EN_MEMORIA = 4
+
+
+class TablasSitios:
+    """Sumas acumuladas 2D de cada capa sobre una rejilla fija"""
+
+    def __init__(self, lats, lons, capas, celda_km=CELDA_KM, caja=None):
+        """'capas' es nombre -> máscara booleana de los negocios de la capa (None = todos)"""
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        validos = np.isfinite(lats) & np.isfinite(lons)
+        if caja is None:
+            lat_min, lat_max = np.percentile(lats[validos], [PERCENTIL_RECORTE, 100 - PERCENTIL_RECORTE])
+            lon_min, lon_max = np.percentile(lons[validos], [PERCENTIL_RECORTE, 100 - PERCENTIL_RECORTE])
+        else:
+            lat_min, lon_min, lat_max, lon_max = caja
+        self.caja = [float(lat_min), float(lon_min), float(lat_max), float(lon_max)]
+
+        km_por_grado_lon = KM_POR_GRADO * math.cos(math.radians((lat_min + lat_max) / 2))
+        margen_lat, margen_lon = MARGEN_KM / KM_POR_GRADO, MARGEN_KM / km_por_grado_lon
+        alto_km = (lat_max - lat_min + 2 * margen_lat) * KM_POR_GRADO
+        ancho_km = (lon_max - lon_min + 2 * margen_lon) * km_por_grado_lon
+        self.celda_km = max(celda_km, math.sqrt(alto_km * ancho_km / MAXIMO_CELDAS))
+        self.km_por_grado_lon = km_por_grado_lon
+        self.paso_lat = self.celda_km / KM_POR_GRADO
+        self.paso_lon = self.celda_km / km_por_grado_lon
+        self.lat_min = float(lat_min - margen_lat)
+        self.lon_min = float(lon_min - margen_lon)
+        self.filas = max(int(math.ceil(alto_km / self.celda_km)), 1)
+        self.columnas = max(int(math.ceil(ancho_km / self.celda_km)), 1)
+
+        fila = np.floor((lats - self.lat_min) / self.paso_lat)
+        columna = np.floor((lons - self.lon_min) / self.paso_lon)
+        dentro = validos & (fila >= 0) & (fila < self.filas) & (columna >= 0) & (columna < self.columnas)
+        celdas = (fila[dentro] * self.columnas + columna[dentro]).astype(np.int64)
+        self.fuera_de_rejilla = int(np.count_nonzero(validos & ~dentro))
+
+        # Una tabla por capa, apiladas para leer todas las capas de una vez;
+        # el entero más chico que alcanza para el total (la última celda)
+        self.capas = list(capas)
+        self.tablas = np.zeros((len(capas), self.filas + 1, self.columnas + 1),
+                               dtype=np.min_scalar_type(len(lats)))
+        for tabla, mascara in zip(self.tablas, capas.values()):
+            conteos = np.bincount(celdas if mascara is None else celdas[np.asarray(mascara)[dentro]],
+                                  minlength=self.filas * self.columnas)
+            tabla[1:, 1:] = conteos.reshape(self.filas, self.columnas).cumsum(axis=0).cumsum(axis=1)
+
+    @classmethod
+    def _capas(cls, sinergia, categorias_sinergia, rol, categorias_rol):
+        capas = {}
+        for nombre, clase in CAPAS.items():
+            if clase is None:
+                capas[nombre] = None
+            elif clase[0] in categorias_sinergia and clase[1] in categorias_rol:
+                capas[nombre] = ((sinergia == categorias_sinergia.index(clase[0]))
+                                 & (rol == categorias_rol.index(clase[1])))
+        return capas
+
+    @classmethod
+    def desde_df(cls, df):
+        """Desde un DataFrame ya clasificado con sinergias.clasificar"""
+        capas = cls._capas(df['sinergia'].array.codes, [str(c) for c in df['sinergia'].cat.categories],
+                           df['rol_sinergia'].array.codes, [str(c) for c in df['rol_sinergia'].cat.categories])
+        return cls(df['latitud'].to_numpy(), df['longitud'].to_numpy(), capas)
+
+    @classmethod
+    def desde_artefacto(cls, almacen_columnar):
+        """Desde los .npy del almacén (sin pandas)"""
+        columnas = almacen_columnar.columnas
+        capas = cls._capas(almacen_columnar.arreglo('sinergia'), columnas['sinergia']['categorias'],
+                           almacen_columnar.arreglo('rol_sinergia'), columnas['rol_sinergia']['categorias'])
+        return cls(almacen_columnar.arreglo('latitud'), almacen_columnar.arreglo('longitud'), capas)
+
+    def _acumulado(self, tablas, y, x):
+        # Suma acumulada en coordenadas fraccionarias de celda (interpolación bilineal), por capa
+        y0 = np.minimum(np.floor(y).astype(np.int64), self.filas - 1)
+        x0 = np.minimum(np.floor(x).astype(np.int64), self.columnas - 1)
+        fy, fx = y - y0, x - x0
+        return ((tablas[:, y0, x0] * (1 - fx) + tablas[:, y0, x0 + 1] * fx) * (1 - fy)
+                + (tablas[:, y0 + 1, x0] * (1 - fx) + tablas[:, y0 + 1, x0 + 1] * fx) * fy)
+
+    def contar(self, lats, lons, radio_km=RADIO_KM, capas=None):
+        """Negocios de cada capa a ~radio_km de cada sitio: capa -> arreglo de conteos"""
+        if not 0 < radio_km <= MAXIMO_RADIO_KM:
+            raise ValueError(f"El radio debe ser mayor que 0 y hasta {MAXIMO_RADIO_KM} km")
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        # Mitad del lado del cuadrado con la misma área que el círculo
+        mitad_km = radio_km * math.sqrt(math.pi) / 2
+        centro_y = (lats - self.lat_min) / self.paso_lat
+        centro_x = (lons - self.lon_min) / self.paso_lon
+        mitad_y = mitad_km / self.celda_km
+        mitad_x = mitad_km / (KM_POR_GRADO * np.cos(np.radians(lats))) / self.paso_lon
+        y1, y2 = np.clip(centro_y - mitad_y, 0, self.filas), np.clip(centro_y + mitad_y, 0, self.filas)
+        x1, x2 = np.clip(centro_x - mitad_x, 0, self.columnas), np.clip(centro_x + mitad_x, 0, self.columnas)
+
+        capas = capas or self.capas
+        for nombre in capas:
+            if nombre not in self.capas:
+                raise ValueError(f"Capa '{nombre}' no disponible; usa una de: {', '.join(self.capas)}")
+        tablas = self.tablas if capas == self.capas else self.tablas[[self.capas.index(c) for c in capas]]
+        # Rectángulo = 4 lecturas de la suma acumulada
+        totales = (self._acumulado(tablas, y2, x2) - self._acumulado(tablas, y1, x2)
+                   - self._acumulado(tablas, y2, x1) + self._acumulado(tablas, y1, x1))
+        return dict(zip(capas, np.maximum(totales, 0.0)))
+
+    def puntuar(self, lats, lons, radio_km=RADIO_KM):
+        """Conteos por capa y oportunidad por sinergia: anclas por cada complemento (+1).
+
+        Más alto = más demanda (escuelas, clínicas, gimnasios) sin su negocio
+        complementario cerca. 'puntaje' es la suma de las tres sinergias.
+        """
+        conteos = self.contar(lats, lons, radio_km)
+        oportunidad = {}
+        for ancla, clase in CAPAS.items():
+            if clase is None or clase[1] != 'ancla' or ancla not in conteos:
+                continue
+            complemento = next((nombre for nombre, otra in CAPAS.items() if otra == (clase[0], 'complemento')), None)
+            if complemento in conteos:
+                oportunidad[clase[0]] = conteos[ancla] / (conteos[complemento] + 1)
+        puntaje = sum(oportunidad.values()) if oportunidad else np.zeros(len(np.atleast_1d(lats)))
+        return conteos, oportunidad, puntaje
+
+    def rejilla(self, caja=None, paso_km=PASO_KM):
+        """Centros de una rejilla de sitios candidatos (por filas, de sur a norte): (lats, lons, descripción)"""
+        if paso_km <= 0:
+            raise ValueError("El paso debe ser mayor que 0")
+        lat_min, lon_min, lat_max, lon_max = caja or self.caja
+        paso_lat = paso_km / KM_POR_GRADO
+        paso_lon = paso_km / (KM_POR_GRADO * math.cos(math.radians((lat_min + lat_max) / 2)))
+        filas = max(int(math.ceil((lat_max - lat_min) / paso_lat)), 1)
+        columnas = max(int(math.ceil((lon_max - lon_min) / paso_lon)), 1)
+        if filas * columnas > MAXIMO_SITIOS:
+            raise ValueError(f"La rejilla tendría {filas * columnas} sitios (máximo {MAXIMO_SITIOS}); "
+                             "usa un paso mayor o una caja más chica")
+        lats = lat_min + (np.arange(filas) + 0.5) * paso_lat
+        lons = lon_min + (np.arange(columnas) + 0.5) * paso_lon
+        descripcion = {"paso_km": paso_km, "origen": [lat_min, lon_min],
+                       "paso": [paso_lat, paso_lon], "forma": [filas, columnas]}
+        return np.repeat(lats, columnas), np.tile(lons, filas), descripcion
+
+    def descripcion(self):
+        return {
+            "celda_km": round(self.celda_km, 4),
+            "forma": [self.filas, self.columnas],
+            "caja": self.caja,
+            "capas": self.capas,
+            "fuera_de_rejilla": self.fuera_de_rejilla,
+            "memoria_bytes": int(self.tablas.nbytes),
+        }
+
+
+# (región, versión) -> TablasSitios, de las menos a las más recién usadas
+_tablas = OrderedDict()
+_candado = threading.Lock()
+
+
+def tablas_para(region, version, construir):
+    """Las tablas de esos datos; 'construir' se llama solo si no están en memoria"""
+    clave = (region, version)
+    with _candado:
+        if clave in _tablas:
+            _tablas.move_to_end(clave)
+            return _tablas[clave]
+    tablas = construir()
+    with _candado:
+        _tablas[clave] = tablas
+        while len(_tablas) > TABLAS_EN_MEMORIA:
+            _tablas.popitem(last=False)
+    return tablas
+
+
+def leer_caja(texto):
+    """'lat_min,lon_min,lat_max,lon_max' -> lista de 4 floats (None si no viene)"""
+    if not texto:
+        return None
+    caja = [float(valor) for valor in texto.split(',')]
+    if len(caja) != 4 or not np.all(np.isfinite(caja)) or caja[0] >= caja[2] or caja[1] >= caja[3]:
+        raise ValueError("La caja debe ser lat_min,lon_min,lat_max,lon_max")
+    return caja
+
+
+def leer_puntos(puntos):
+    """[[lat, lon], ...] del cuerpo de la petición -> (lats, lons)"""
+    puntos = np.asarray(puntos, dtype=np.float64)
+    if puntos.ndim != 2 or puntos.shape[1] != 2:
+        raise ValueError("'puntos' debe ser una lista de [lat, lon]")
+    if len(puntos) > MAXIMO_SITIOS:
+        raise ValueError(f"Máximo {MAXIMO_SITIOS} puntos por petición")
+    if not np.isfinite(puntos).all():
+        raise ValueError("Las coordenadas de los puntos deben ser números finitos")
+    return puntos[:, 0], puntos[:, 1]
+
+
+def puntuar_grupos(grupos, lats, lons, radio_km=RADIO_KM):
+    """puntuar() de cada grupo [(TablasSitios, posiciones)] con sus tablas, juntos en el orden de los puntos"""
+    conteos, oportunidad, puntaje = {}, {}, np.zeros(len(lats))
+    for tablas, posiciones in grupos:
+        parciales = tablas.puntuar(lats[posiciones], lons[posiciones], radio_km)
+        for destino, origen in zip((conteos, oportunidad), parciales[:2]):
+            for nombre, valores in origen.items():
+                destino.setdefault(nombre, np.zeros(len(lats)))[posiciones] = valores
+        puntaje[posiciones] = parciales[2]
+    return conteos, oportunidad, puntaje
+
+
+def respuesta(tablas, lats, lons, radio_km, formato='json', unico=False):
+    """Conteos, oportunidad y puntaje de los sitios, listos para jsonify o negociacion.empaquetar.
+
+    'tablas' es una TablasSitios o, con puntos de varias regiones, una lista
+    [(TablasSitios, posiciones)] (ver puntuar_grupos). En JSON van redondeados
+    a 2 decimales; en MessagePack como arreglos float32. Con 'unico' (un solo
+    sitio) van como números, no como listas.
+    """
+    if isinstance(tablas, TablasSitios):
+        tablas = [(tablas, slice(None))]
+    conteos, oportunidad, puntaje = puntuar_grupos(tablas, np.asarray(lats, dtype=np.float64),
+                                                   np.asarray(lons, dtype=np.float64), radio_km)
+    if unico:
+        convertir = lambda valores: round(float(valores[0]), 2)
+    elif formato == 'msgpack':
+        convertir = lambda valores: np.asarray(valores, dtype=np.float32)
+    else:
+        convertir = lambda valores: np.round(valores, 2).tolist()
+    return {
+        "radio_km": radio_km,
+        "conteos": {nombre: convertir(valores) for nombre, valores in conteos.items()},
+        "oportunidad": {nombre: convertir(valores) for nombre, valores in oportunidad.items()},
+        "puntaje": convertir(puntaje),
+        "nota": "Conteos aproximados (tablas de sumas acumuladas, celdas de "
+                f"{max(t.celda_km for t, _ in tablas) * 1000:.0f} m); oportunidad = anclas / (complementos + 1)"
+    }
@@ -0,0 +1,377 @@
+"""Teselas z/x/y (Web Mercator) con todos los negocios, para la capa del mapa.
+
+Cada tesela agrega los puntos en una rejilla de RESOLUCION x RESOLUCION
+celdas: cuántos negocios hay en la celda, su centroide y, con ?color=, la
+categoría más común. Se sirve como JSON (por columnas) o como PNG.
+
+Los puntos se ordenan una sola vez por su clave cuádruple (Morton) al
+nivel ZOOM_INDICE: los de cualquier tesela hasta ese nivel quedan
+contiguos y se encuentran con dos búsquedas binarias. Las teselas se
+guardan en disco por región y versión de datos (TESELAS_DIR); las que no
+están se generan al pedirlas. Al aparecer una versión nueva de una región
+se borran del disco las teselas de las anteriores. Para precalcular la
+pirámide:
+
+    python teselas.py --hasta-zoom 14
+"""
+import json
+import os
+import shutil
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+# Píxeles por lado de una tesela y celdas por lado en que se agregan los puntos
+TAMANO = 256
+RESOLUCION = 64
+
+# Nivel de la clave cuádruple con la que se ordenan los puntos (16 bits por eje)
+ZOOM_INDICE = 16
+ZOOM_MAXIMO = 20
+
+# Hasta dónde llega la pirámide que genera la línea de comandos
+ZOOM_PRECALCULO = 14
+
+# Límite de Web Mercator
+LATITUD_MAXIMA = 85.05112878
+
+DIRECTORIO_TESELAS = os.environ.get('TESELAS_DIR', 'teselas')
+
+# Columnas con las que se puede colorear (pocas categorías)
+COLUMNAS_COLOR = ('sinergia', 'rol_sinergia')
+
+# Colores RGB; las categorías sin color propio usan PALETA
+COLORES = {
+    "educacion": (37, 99, 235),
+    "salud": (220, 38, 38),
+    "deporte": (234, 88, 12),
+    "ancla": (37, 99, 235),
+    "complemento": (22, 163, 74),
+}
+PALETA = ((147, 51, 234), (8, 145, 178), (202, 138, 4), (219, 39, 119), (101, 163, 13))
+COLOR_PUNTOS = (234, 88, 12)
+COLOR_SIN_CATEGORIA = (107, 114, 128)
+
+FORMATOS = {'json': 'application/json', 'png': 'image/png'}
+
+# Pirámides (una por región y versión de datos) que se mantienen en memoria
+PIRAMIDES_EN_MEMORIA = 4
+
+
+def mercator(lats, lons):
+    """Coordenadas de Web Mercator normalizadas a [0, 1) (x hacia el este, y hacia el sur)"""
+    lats = np.clip(np.asarray(lats, dtype=np.float64), -LATITUD_MAXIMA, LATITUD_MAXIMA)
+    x = (np.asarray(lons, dtype=np.float64) + 180.0) / 360.0
+    y = 0.5 - np.log(np.tan(np.pi / 4 + np.radians(lats) / 2)) / (2 * np.pi)
+    return x, y
+
+
+def _latitud(y):
+    return np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * y))))
+
+
+def _separar(v):
+    # Intercala ceros entre los bits (16 bits -> 32) para la clave de Morton
+    v = v.astype(np.uint64) & 0xFFFF
+    v = (v | (v << 8)) & 0x00FF00FF
+    v = (v | (v << 4)) & 0x0F0F0F0F
+    v = (v | (v << 2)) & 0x33333333
+    return (v | (v << 1)) & 0x55555555
+
+
+def _juntar(v):
+    v = v & 0x55555555
+    v = (v | (v >> 1)) & 0x33333333
+    v = (v | (v >> 2)) & 0x0F0F0F0F
+    v = (v | (v >> 4)) & 0x00FF00FF
+    return (v | (v >> 8)) & 0xFFFF
+
+
+def clave_cuadruple(x, y):
+    return _separar(np.asarray(x)) | (_separar(np.asarray(y)) << np.uint64(1))
+
+
+def validar(z, x, y):
+    if not 0 <= z <= ZOOM_MAXIMO:
+        raise ValueError(f"Zoom fuera de rango (0 a {ZOOM_MAXIMO})")
+    if not (0 <= x < 1 << z and 0 <= y < 1 << z):
+        raise ValueError(f"Tesela {z}/{x}/{y} fuera de rango")
+
+
+class Piramide:
+    """Puntos ordenados por clave cuádruple; cualquier tesela se arma sin recorrer todos"""
+
+    def __init__(self, lats, lons, categorias=None):
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        validos = np.isfinite(lats) & np.isfinite(lons) & (np.abs(lats) <= LATITUD_MAXIMA)
+        x, y = mercator(lats[validos], lons[validos])
+        lado = 1 << ZOOM_INDICE
+        claves = clave_cuadruple(np.clip((x * lado).astype(np.int64), 0, lado - 1),
+                                 np.clip((y * lado).astype(np.int64), 0, lado - 1))
+        orden = np.argsort(claves, kind='stable')
+        self.claves = claves[orden]
+        self.x = x[orden]
+        self.y = y[orden]
+        # columna -> (códigos en el orden de la pirámide, nombres de las categorías)
+        self.categorias = {nombre: (np.asarray(codigos)[validos][orden], list(nombres))
+                           for nombre, (codigos, nombres) in (categorias or {}).items()}
+
+    @classmethod
+    def desde_df(cls, df):
+        categorias = {columna: (df[columna].array.codes, [str(c) for c in df[columna].cat.categories])
+                      for columna in COLUMNAS_COLOR
+                      if columna in df.columns and df[columna].dtype == 'category'}
+        return cls(df['latitud'].to_numpy(), df['longitud'].to_numpy(), categorias)
+
+    @classmethod
+    def desde_artefacto(cls, almacen_columnar):
+        """Desde los .npy del almacén (sin pandas)"""
+        categorias = {columna: (almacen_columnar.arreglo(columna), almacen_columnar.columnas[columna]['categorias'])
+                      for columna in COLUMNAS_COLOR
+                      if almacen_columnar.columnas.get(columna, {}).get('tipo') == 'categoria'}
+        return cls(almacen_columnar.arreglo('latitud'), almacen_columnar.arreglo('longitud'), categorias)
+
+    def __len__(self):
+        return len(self.claves)
+
+    def posiciones(self, z, x, y):
+        """Rango (o posiciones) de los puntos que caen en la tesela"""
+        if z <= ZOOM_INDICE:
+            desplazamiento = np.uint64(2 * (ZOOM_INDICE - z))
+            prefijo = clave_cuadruple(x, y)
+            inicio, fin = np.searchsorted(self.claves, [prefijo << desplazamiento,
+                                                        (prefijo + np.uint64(1)) << desplazamiento])
+            return slice(int(inicio), int(fin))
+        # Más cerca que el índice: la tesela de ZOOM_INDICE que la contiene, filtrada
+        nivel = z - ZOOM_INDICE
+        rango = self.posiciones(ZOOM_INDICE, x >> nivel, y >> nivel)
+        lado = 1 << z
+        dentro = ((np.floor(self.x[rango] * lado) == x) & (np.floor(self.y[rango] * lado) == y))
+        return rango.start + np.flatnonzero(dentro)
+
+    def tesela(self, z, x, y, color=None):
+        """Agregados de la tesela: conteo, centroide y categoría dominante por celda"""
+        validar(z, x, y)
+        if color is not None and color not in self.categorias:
+            raise ValueError(f"No se puede colorear por '{color}'; usa uno de: {', '.join(self.categorias)}")
+        posiciones = self.posiciones(z, x, y)
+        lado = 1 << z
+        px = self.x[posiciones] * lado - x
+        py = self.y[posiciones] * lado - y
+        celdas = (np.clip((py * RESOLUCION).astype(np.int64), 0, RESOLUCION - 1) * RESOLUCION
+                  + np.clip((px * RESOLUCION).astype(np.int64), 0, RESOLUCION - 1))
+        usadas, inversa, conteos = np.unique(celdas, return_inverse=True, return_counts=True)
+        centro_x = np.bincount(inversa, weights=self.x[posiciones], minlength=len(usadas)) / np.maximum(conteos, 1)
+        centro_y = np.bincount(inversa, weights=self.y[posiciones], minlength=len(usadas)) / np.maximum(conteos, 1)
+
+        resultado = {
+            "z": z, "x": x, "y": y,
+            "resolucion": RESOLUCION,
+            "total": int(conteos.sum()),
+            "celdas": {
+                "columna": (usadas % RESOLUCION).tolist(),
+                "fila": (usadas // RESOLUCION).tolist(),
+                "conteo": conteos.tolist(),
+                "lat": np.round(_latitud(centro_y), 6).tolist(),
+                "lon": np.round(centro_x * 360.0 - 180.0, 6).tolist(),
+            }
+        }
+        if color is not None:
+            codigos, nombres = self.categorias[color]
+            # Solo las categorías presentes; -1 (vacío) gana solo si la celda no tiene otra
+            presentes, compactos = np.unique(codigos[posiciones], return_inverse=True)
+            votos = np.bincount(inversa * len(presentes) + compactos.reshape(-1),
+                                minlength=len(usadas) * len(presentes)).reshape(len(usadas), len(presentes))
+            if len(presentes) > 1 and presentes[0] < 0:
+                votos[votos[:, 1:].sum(axis=1) > 0, 0] = 0
+            dominante = presentes[votos.argmax(axis=1)] if len(usadas) else presentes
+            elegidas = np.unique(dominante)
+            resultado["color"] = color
+            resultado["categorias"] = [nombres[c] if c >= 0 else None for c in elegidas.tolist()]
+            resultado["celdas"]["categoria"] = np.searchsorted(elegidas, dominante).tolist()
+        return resultado
+
+
+def color_de(categoria):
+    if categoria is None:
+        return COLOR_SIN_CATEGORIA
+    if categoria in COLORES:
+        return COLORES[categoria]
+    return PALETA[sum(categoria.encode('utf-8')) % len(PALETA)]
+
+
+def _png_rgba(pixeles):
+    # PNG mínimo (RGBA de 8 bits, sin filtro por fila) con zlib
+    alto, ancho = pixeles.shape[:2]
+    filas = np.concatenate([np.zeros((alto, 1), dtype=np.uint8), pixeles.reshape(alto, ancho * 4)], axis=1)
+
+    def bloque(tipo, datos):
+        return (struct.pack('>I', len(datos)) + tipo + datos
+                + struct.pack('>I', zlib.crc32(tipo + datos) & 0xFFFFFFFF))
+
+    return (b'\x89PNG\r\n\x1a\n'
+            + bloque(b'IHDR', struct.pack('>IIBBBBB', ancho, alto, 8, 6, 0, 0, 0))
+            + bloque(b'IDAT', zlib.compress(filas.tobytes(), 6))
+            + bloque(b'IEND', b''))
+
+
+def png(tesela):
+    """La tesela como imagen: una celda = un cuadro, más opaco mientras más negocios tenga"""
+    celdas = tesela["celdas"]
+    rgba = np.zeros((RESOLUCION, RESOLUCION, 4), dtype=np.uint8)
+    if tesela["total"]:
+        conteos = np.asarray(celdas["conteo"], dtype=np.float64)
+        if "categoria" in celdas:
+            paleta = np.array([color_de(c) for c in tesela["categorias"]], dtype=np.uint8)
+            colores = paleta[celdas["categoria"]]
+        else:
+            colores = np.array(COLOR_PUNTOS, dtype=np.uint8)
+        filas, columnas = np.asarray(celdas["fila"]), np.asarray(celdas["columna"])
+        rgba[filas, columnas, :3] = colores
+        # Escala logarítmica: una celda con un negocio se ve, una con cientos no satura el resto
+        rgba[filas, columnas, 3] = (110 + 145 * np.log1p(conteos) / np.log1p(conteos.max())).astype(np.uint8)
+    escala = TAMANO // RESOLUCION
+    return _png_rgba(rgba.repeat(escala, axis=0).repeat(escala, axis=1))
+
+
+def codificar(tesela, formato):
+    if formato == 'png':
+        return png(tesela)
+    return json.dumps(tesela, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+class CacheTeselas:
+    """Teselas en disco: <directorio>/<región>/<versión>/<color>/<z>/<x>/<y>.<formato>"""
+
+    def __init__(self, directorio=DIRECTORIO_TESELAS):
+        self.directorio = directorio
+        # región -> versión vigente (la última que se sirvió)
+        self._vigentes = {}
+        self._candado = threading.Lock()
+
+    def publicar(self, region, version):
+        """Marca la versión vigente de la región y borra del disco las demás; devuelve las borradas"""
+        version = str(version)
+        with self._candado:
+            if self._vigentes.get(region) == version:
+                return []
+            self._vigentes[region] = version
+        base = os.path.join(self.directorio, region)
+        try:
+            anteriores = [nombre for nombre in os.listdir(base) if nombre != version]
+        except OSError:
+            return []
+        for nombre in anteriores:
+            # Otro proceso puede estar borrando la misma carpeta; en solo lectura no se borra nada
+            shutil.rmtree(os.path.join(base, nombre), ignore_errors=True)
+        return anteriores
+
+    def ruta(self, region, version, z, x, y, formato, color=None):
+        return os.path.join(self.directorio, region, str(version), color or 'puntos',
+                            str(z), str(x), f'{y}.{formato}')
+
+    def leer(self, *clave):
+        try:
+            with open(self.ruta(*clave), 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def guardar(self, cuerpo, *clave):
+        """Escritura atómica; en un sistema de archivos de solo lectura no se guarda"""
+        ruta = self.ruta(*clave)
+        temporal = f'{ruta}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            os.makedirs(os.path.dirname(ruta), exist_ok=True)
+            with open(temporal, 'wb') as f:
+                f.write(cuerpo)
+            os.replace(temporal, ruta)
+            return True
+        except OSError:
+            return False
+
+
+# (región, versión) -> Piramide, de la menos a la más recién usada
+_piramides = OrderedDict()
+_candado = threading.Lock()
+
+
+def piramide_para(region, version, construir):
+    """La pirámide de esos datos; 'construir' se llama solo si no está en memoria"""
+    clave = (region, version)
+    with _candado:
+        if clave in _piramides:
+            _piramides.move_to_end(clave)
+            return _piramides[clave]
+    piramide = construir()
+    with _candado:
+        # Las pirámides de versiones anteriores de la región ya no se piden
+        for anterior in [c for c in _piramides if c[0] == region and c != clave]:
+            del _piramides[anterior]
+        _piramides[clave] = piramide
+        while len(_piramides) > PIRAMIDES_EN_MEMORIA:
+            _piramides.popitem(last=False)
+    return piramide
+
+
+def servir(cache, region, version, z, x, y, formato='json', color=None, construir=None):
+    """(cuerpo, tipo MIME) de la tesela: del disco, o generada y guardada.
+
+    'construir' devuelve la Piramide; solo se usa si la tesela no está en disco.
+    """
+    validar(z, x, y)
+    if formato not in FORMATOS:
+        raise ValueError(f"Formato de tesela '{formato}' no disponible; usa json o png")
+    if color is not None and color not in COLUMNAS_COLOR:
+        raise ValueError(f"No se puede colorear por '{color}'; usa uno de: {', '.join(COLUMNAS_COLOR)}")
+    cache.publicar(region, version)
+    clave = (region, version, z, x, y, formato, color)
+    cuerpo = cache.leer(*clave)
+    if cuerpo is None:
+        tesela = piramide_para(region, version, construir).tesela(z, x, y, color)
+        cuerpo = codificar(tesela, formato)
+        # Las teselas vacías (casi todas) no se guardan
+        if tesela["total"]:
+            cache.guardar(cuerpo, *clave)
+    return cuerpo, FORMATOS[formato]
+
+
+def generar(piramide, cache, region, version, hasta_zoom=ZOOM_PRECALCULO, colores=(None,),
+            formatos=tuple(FORMATOS)):
+    """Escribe en disco todas las teselas con negocios hasta 'hasta_zoom'; devuelve cuántas"""
+    cache.publicar(region, version)
+    total = 0
+    for z in range(min(hasta_zoom, ZOOM_INDICE) + 1):
+        prefijos = np.unique(piramide.claves >> np.uint64(2 * (ZOOM_INDICE - z)))
+        xs, ys = _juntar(prefijos), _juntar(prefijos >> np.uint64(1))
+        for x, y in zip(xs.tolist(), ys.tolist()):
+            for color in colores:
+                tesela = piramide.tesela(z, x, y, color)
+                for formato in formatos:
+                    cache.guardar(codificar(tesela, formato), region, version, z, x, y, formato, color)
+                    total += 1
+    return total
+
+
+if __name__ == '__main__':
+    import argparse
+
+    import regiones
+
+    parser = argparse.ArgumentParser(description="Precalcula la pirámide de teselas de una región")
+    parser.add_argument('--region', default=regiones.REGION_POR_DEFECTO)
+    parser.add_argument('--hasta-zoom', type=int, default=ZOOM_PRECALCULO)
+    parser.add_argument('--color', action='append', choices=COLUMNAS_COLOR,
+                        help="generar también las teselas coloreadas por esta columna (se puede repetir)")
+    argumentos = parser.parse_args()
+
+    datos = regiones.Regiones().datos(argumentos.region)
+    instantanea = datos.instantanea()
+    generadas = generar(Piramide.desde_df(instantanea.df), CacheTeselas(), argumentos.region,
+                        instantanea.version, argumentos.hasta_zoom, (None,) + tuple(argumentos.color or ()))
+    print(f"{generadas} teselas de {argumentos.region} (versión {instantanea.version}) "
+          f"en {DIRECTORIO_TESELAS}")
@@ -0,0 +1,8 @@
+# Zonas conocidas: nombre -> (latitud, longitud, radio por defecto en km)
+ZONAS_CONOCIDAS = {
+    "maneadero": (31.7167, -116.5667, 3),
+    "centro": (31.8650, -116.6217, 2),
+    "chapultepec": (31.8386, -116.6014, 2),
+    "sauzal": (31.8833, -116.6833, 2.5),
+    "valle dorado": (31.8489, -116.5858, 2)
+}